@@ -0,0 +1,185 @@
+# answer_cache.py
+"""
+Caché persistente de respuestas de /analyze.
+
+La clave exacta es un sha256 de todo lo que determina la respuesta: la
+pregunta normalizada, las KBs (id + versión), los chunks recuperados (hash
+de su texto), el modelo de chat y la versión de la plantilla del prompt. Si
+cambia cualquiera de ellos (otra pregunta, una KB reconstruida, otra
+recuperación, otro prompt) la entrada simplemente no se encuentra.
+
+Nivel semántico opcional: si no hay acierto exacto, se reutiliza la respuesta
+de una pregunta ya respondida cuyo embedding tenga similitud coseno >=
+`semantic_threshold` con la nueva, siempre sobre los mismos documentos
+(`scope`: KBs + modelo + prompt + espacio de embeddings).
+
+SQLite como EmbeddingCache: TTL, tope de entradas con expulsión LRU y
+contadores de aciertos y tokens ahorrados.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_cache import normalize_question
+
+EXACT, SEMANTIC = "exact", "semantic"
+
+
+def _digest(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def chunk_id(text: str) -> str:
+    """Id de un chunk recuperado: hash de su contenido (estable entre reinicios)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def answer_scope(kbs: Sequence[Tuple[str, str]], model: str, prompt_version: str, space: str) -> str:
+    """Los documentos y la configuración sobre los que una respuesta es reutilizable."""
+    return _digest({"kbs": [list(kb) for kb in kbs], "model": model, "prompt": prompt_version, "space": space})
+
+
+def answer_key(scope: str, question: str, chunk_ids: Sequence[Sequence[str]]) -> str:
+    """Clave exacta: scope + pregunta normalizada + ids de los chunks recuperados de cada KB."""
+    return _digest({"scope": scope, "question": normalize_question(question),
+                    "chunks": [list(ids) for ids in chunk_ids]})
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    tokens: int
+    match: str  # EXACT o SEMANTIC
+    similarity: Optional[float] = None
+    question: Optional[str] = None
+
+
+class AnswerCache:
+    """
+    Respuestas por clave exacta, con TTL (`ttl_seconds`, 0 = sin vencimiento)
+    y `max_entries` con expulsión LRU. `semantic_threshold` > 0 activa el
+    nivel semántico (necesita el embedding de la pregunta).
+    """
+
+    def __init__(self, path: Path, max_entries: int = 5000, ttl_seconds: float = 7 * 24 * 3600,
+                 semantic_threshold: float = 0.0):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                " key TEXT PRIMARY KEY,"
+                " scope TEXT NOT NULL,"
+                " question TEXT NOT NULL,"
+                " vector BLOB,"
+                " answer TEXT NOT NULL,"
+                " tokens INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers(scope)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers(last_used)")
+
+    def _expired_before(self, now: float) -> float:
+        return now - self.ttl_seconds if self.ttl_seconds > 0 else float("-inf")
+
+    def get(self, key: str, scope: str, query_vector=None) -> Optional[CachedAnswer]:
+        """Busca por clave exacta y, si no está y hay vector, por similitud dentro del scope."""
+        now = time.time()
+        oldest = self._expired_before(now)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, tokens FROM answers WHERE key = ? AND created_at >= ?", (key, oldest)
+            ).fetchone()
+            found = CachedAnswer(row[0], row[1], EXACT) if row else None
+            hit_key = key
+
+            if found is None and self.semantic_threshold > 0 and query_vector is not None:
+                rows = self._conn.execute(
+                    "SELECT key, question, vector, answer, tokens FROM answers "
+                    "WHERE scope = ? AND vector IS NOT NULL AND created_at >= ?",
+                    (scope, oldest),
+                ).fetchall()
+                query = np.asarray(query_vector, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1.0)
+                rows = [r for r in rows if len(r[2]) == query.nbytes]
+                if rows:
+                    matrix = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+                    similarities = matrix @ query
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.semantic_threshold:
+                        hit_key, question, _, answer, tokens = rows[best]
+                        found = CachedAnswer(answer, tokens, SEMANTIC,
+                                             similarity=round(float(similarities[best]), 4), question=question)
+
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.semantic_hits += found.match == SEMANTIC
+            self.saved_tokens += found.tokens
+            with self._conn:
+                self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, hit_key))
+        return found
+
+    def put(self, key: str, scope: str, question: str, answer: str, tokens: int, query_vector=None):
+        """Guarda la respuesta; expulsa las vencidas y, por LRU, las que excedan max_entries."""
+        now = time.time()
+        vector = None
+        if query_vector is not None:
+            array = np.asarray(query_vector, dtype=np.float32)
+            vector = (array / (np.linalg.norm(array) or 1.0)).tobytes()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, scope, question, vector, answer, tokens, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, scope, question, vector, answer, int(tokens or 0), now, now),
+            )
+            expired = self._conn.execute(
+                "DELETE FROM answers WHERE created_at < ?", (self._expired_before(now),)
+            ).rowcount
+            excess = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE key IN "
+                    "(SELECT key FROM answers ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+            self.evictions += max(expired, 0) + max(excess, 0)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "semantic_threshold": self.semantic_threshold,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+                "evictions": self.evictions,
+            }
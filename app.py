@@ -1,18 +1,39 @@
 import os
 import re
+import asyncio
+import hashlib
 import json
-import pickle
+import time
+import shutil
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple, Dict
+from dataclasses import dataclass, field, replace
+from typing import Callable, List, Tuple, Dict, Optional, Iterator, Sequence
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-import PyPDF2
 from openai import OpenAI
-import tiktoken
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from prompts import generate_prompt, save_prompt_to_file
+from async_upstream import AsyncUpstream, UpstreamTimeoutError
+from embedding_pipeline import EMBEDDING_MODEL, MAX_WORKERS as EMBEDDING_WORKERS
+from embedding_providers import IncompatibleEmbeddingsError, create_provider
+from chunking import chunk_document, get_encoder
+from embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from answer_cache import AnswerCache, CachedAnswer, answer_key, answer_scope, chunk_id
+from upload_cache import HashingRequest, UploadKBStore, upload_digest
+from pdf_extract import EXTRACT_WORKERS, extract_pdf_text, file_sha256, iter_pdf_pages
+from ingest_jobs import IngestJob, IngestJobManager, QueueFullError
+from kb_store import (collect_versions, is_kb_dir, load_kb_dir, load_published, load_registry,
+                      migrate_legacy_pickle, published_dir, read_manifest, save_kb_dir)
+from vector_index import FlatIndex, build_index
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from context_packing import CANDIDATES as CONTEXT_CANDIDATES, TOKEN_BUDGET as CONTEXT_TOKEN_BUDGET, pack_context
+from financial_tables import FinancialTable, is_direct_ratio_question, ratio_facts, ratio_question, ratio_table
+import telemetry
 
 # --- Config ---
 load_dotenv()
@@ -33,66 +54,115 @@ PRELOADED_FILES = {
 ALLOWED_EXTENSIONS = {"pdf"}
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
+app.request_class = HashingRequest
 app.config["UPLOAD_FOLDER"] = str(UPLOAD_DIR)
 app.config["MAX_CONTENT_LENGTH"] = 20 * 1024 * 1024
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Cliente asíncrono del camino ASGI (asgi.py): pool de conexiones, límite de concurrencia, plazos y reintentos
+upstream = AsyncUpstream(api_key=os.getenv("OPENAI_API_KEY"))
+CHAT_MODEL = "gpt-5"
+# Proveedor de embeddings de KBs y preguntas (EMBEDDING_PROVIDER=openai|local)
+embedding_provider = create_provider(client)
+# Las KBs de otros proveedores van en su propio subdirectorio y no pisan las de OpenAI
+KB_DIR = EMBEDDINGS_DIR if embedding_provider.name == "openai" else EMBEDDINGS_DIR / embedding_provider.name
+KB_DIR.mkdir(exist_ok=True)
+
+# Versión del pipeline de ingesta (extracción, chunking, tablas financieras):
+# súbela al cambiar cómo se construye una KB para que ingest_kbs.py la reconstruya
+PIPELINE_VERSION = "1"
+
+# Registro escrito por ingest_kbs.py. Si existe, el arranque solo abre las KBs
+# que lista (sin extraer ni embeber nada) y sus presets reemplazan a PRELOADED_FILES.
+kb_manifest = load_registry(KB_DIR)
+if kb_manifest is not None:
+    PRELOADED_FILES = {
+        key: BASE_DIR / entry["source"] for key, entry in kb_manifest["kbs"].items() if key != "sura"
+    }
+
+# Caché de embeddings por contenido, compartida por todas las KBs (EMBEDDING_CACHE=0 la desactiva)
+embedding_cache = (
+    EmbeddingCache(
+        EMBEDDINGS_DIR / "embedding_cache.sqlite3",
+        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+    )
+    if os.getenv("EMBEDDING_CACHE", "1") != "0" else None
+)
+
+# Caché LRU de embeddings de preguntas (QUERY_CACHE_PERSIST=1 la guarda también en disco)
+query_cache = QueryEmbeddingCache(
+    max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2048")),
+    store=(
+        EmbeddingCache(EMBEDDINGS_DIR / "query_cache.sqlite3")
+        if os.getenv("QUERY_CACHE_PERSIST", "0") == "1" else None
+    ),
+)
+
+# Caché de respuestas de /analyze (ANSWER_CACHE=0 la desactiva). Con
+# ANSWER_CACHE_SEMANTIC_THRESHOLD > 0 (p. ej. 0.95) reutiliza también la
+# respuesta de una pregunta casi idéntica sobre los mismos documentos.
+answer_cache = (
+    AnswerCache(
+        EMBEDDINGS_DIR / "answer_cache.sqlite3",
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000")),
+        ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_HOURS", "168")) * 3600,
+        semantic_threshold=float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "0")),
+    )
+    if os.getenv("ANSWER_CACHE", "1") != "0" else None
+)
 
 
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def chunk_tokens(document: str, token_limit: int = 500) -> List[str]:
+def chunk_tokens(document: str, token_limit: int = 500, overlap: int = 0) -> List[str]:
     """
     Divide el documento en chunks basados en tokens.
     Aumenté el límite a 500 tokens para chunks más contextuales.
+    Ver `chunking.chunk_document` para obtener también los offsets de cada chunk.
     """
-    # enc = tiktoken.encoding_for_model('gpt-5-mini')
-    enc = tiktoken.encoding_for_model('gpt-5')
-    chunks = []
-    tokens = enc.encode(document, disallowed_special=())
-    
-    while tokens:
-        chunk = tokens[:token_limit]
-        chunk_text = enc.decode(chunk)
-        
-        # Buscar el último punto de ruptura natural
-        last_punctuation = max(
-            chunk_text.rfind("."),
-            chunk_text.rfind("?"),
-            chunk_text.rfind("!"),
-            chunk_text.rfind("\n"),
-        )
-        
-        if last_punctuation != -1 and len(tokens) > token_limit:
-            chunk_text = chunk_text[:last_punctuation + 1]
-        
-        cleaned_text = chunk_text.replace("\n", " ").strip()
-        
-        if cleaned_text and (not cleaned_text.isspace()):
-            chunks.append(cleaned_text)
-        
-        tokens = tokens[len(enc.encode(chunk_text, disallowed_special=())):]
-    
-    return chunks
+    return [c.text for c in chunk_document(document, token_limit=token_limit, overlap=overlap)]
 
 
-def get_embedding(text: str, model: str = "text-embedding-3-small") -> List[float]:
-    """
-    Genera embeddings usando OpenAI API en lugar de modelos locales para mejor rendimiento.
-    """
-    text = text.replace("\n", " ")
-    response = client.embeddings.create(
-        input=[text],
-        model=model
-    )
-    return response.data[0].embedding
+def _record_query_embedding(span, tokens: int):
+    """Una llamada al proveedor (fallo de la caché) y sus tokens, en el span y en la traza."""
+    span.set(calls=1, tokens=tokens)
+    telemetry.add_tokens("embedding", tokens)
+
+
+def get_query_embedding(question: str) -> np.ndarray:
+    """Embedding de una pregunta, pasando por la caché LRU de consultas."""
+    with telemetry.span("embed", kind="query", calls=0, tokens=0) as span:
+        def compute(text: str) -> Sequence[float]:
+            vector, tokens = embedding_provider.embed_query_usage(text)
+            _record_query_embedding(span, tokens)
+            return vector
+
+        return query_cache.get_or_compute(embedding_provider.space, question, compute)
+
+
+async def _embed_query_async(text: str) -> Tuple[Sequence[float], int]:
+    if embedding_provider.name != "openai":
+        # El proveedor local no hace red: se calcula en un hilo para no frenar el event loop
+        return await asyncio.to_thread(embedding_provider.embed_query_usage, text)
+    return await upstream.embed(text, model=embedding_provider.model, dimensions=embedding_provider.dimensions)
 
 
-def read_pdf_text(file_path: str) -> Tuple[str, str, str, int]:
+async def get_query_embedding_async(question: str) -> np.ndarray:
+    """Como get_query_embedding, sin bloquear el event loop (camino ASGI)."""
+    with telemetry.span("embed", kind="query", calls=0, tokens=0) as span:
+        async def compute(text: str) -> Sequence[float]:
+            vector, tokens = await _embed_query_async(text)
+            _record_query_embedding(span, tokens)
+            return vector
+
+        return await query_cache.get_or_compute_async(embedding_provider.space, question, compute)
+
+
+def infer_pdf_metadata(file_path: str) -> Tuple[str, str, int]:
     """
-    Lee el PDF y extrae (texto, país, empresa, año).
+    (país, empresa, año) según el nombre del archivo: `EMPRESA_PAIS_AÑO.pdf`.
     Para el archivo de Sura, usa valores por defecto.
     """
     stem = Path(file_path).stem
@@ -133,155 +203,831 @@ def read_pdf_text(file_path: str) -> Tuple[str, str, str, int]:
                 anio = int(m.group(1))
             else:
                 anio = 2024
+    return pais, empresa, anio
 
-    # Lectura del PDF
-    text_parts = []
-    with open(file_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        if getattr(reader, "is_encrypted", False):
-            try:
-                reader.decrypt("")
-            except Exception:
-                pass
-        for page in reader.pages:
-            t = page.extract_text()
-            if t:
-                text_parts.append(t)
-    
-    text = "\n".join(text_parts).strip()
+
+def read_pdf_text(file_path: str, **extract_kwargs) -> Tuple[str, str, str, int]:
+    """
+    Lee el PDF y extrae (texto, país, empresa, año); los metadatos salen del
+    nombre del archivo (infer_pdf_metadata).
+    `extract_kwargs` se pasan a extract_pdf_text (workers, on_progress...).
+    """
+    pais, empresa, anio = infer_pdf_metadata(file_path)
+
+    # Lectura del PDF (en paralelo por rangos de páginas y con caché por página)
+    text = extract_pdf_text(file_path, **extract_kwargs)
     return text, pais, empresa, anio
 
 
+def read_pdf_pages(file_path: str) -> Iterator[Tuple[int, str]]:
+    """
+    Modo generador de read_pdf_text: entrega (nº de página, texto) a medida que
+    se extrae cada página, sin esperar a tener el documento completo.
+    """
+    return iter_pdf_pages(file_path)
+
+
+# Modo de búsqueda por defecto: lexical, dense o hybrid (ver KnowledgeBase.search)
+RETRIEVAL_MODES = ("lexical", "dense", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+# Candidatos de cada ranking que entran a la fusión híbrida
+HYBRID_DEPTH = 20
+# Preguntas que solo piden ratios se responden con las tablas de los EEFF, sin el modelo
+RATIO_DIRECT_ANSWERS = os.getenv("RATIO_DIRECT_ANSWERS", "1") != "0"
+# Fragmentos por KB para el prompt: con presupuesto de tokens se recuperan
+# CONTEXT_CANDIDATES y se empaquetan (context_packing.py); con
+# CONTEXT_TOKEN_BUDGET=0 se usan los 3 primeros, como antes
+CONTEXT_TOP_K = CONTEXT_CANDIDATES if CONTEXT_TOKEN_BUDGET > 0 else 3
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Normaliza (L2) cada fila de la matriz en float32 contiguo.
+    Las filas con norma cero se dejan en cero para no generar NaN.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _as_matrix(vectors) -> np.ndarray:
+    """Matriz contigua float32 normalizada (vacía si no hay vectores)."""
+    if len(vectors) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return _normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+@dataclass(frozen=True)
+class KBSnapshot:
+    """
+    Contenido de una KB en un momento dado. Nunca se modifica: reconstruir o
+    recargar arma uno nuevo y lo publica de una vez, así las búsquedas en curso
+    terminan sobre el anterior y ninguna ve chunks de una versión con vectores de otra.
+    """
+    chunks: Sequence[str] = ()
+    # Matriz (n_chunks x dim) float32 normalizada, usada para la búsqueda (mmap si viene de disco)
+    matrix: np.ndarray = field(default_factory=lambda: np.empty((0, 0), dtype=np.float32))
+    # Índice de búsqueda sobre la matriz (exacto por defecto, ver vector_index.py)
+    index: object = None
+    # Índice léxico BM25 sobre los chunks (búsqueda sin llamadas de red)
+    lexical: Optional[BM25Index] = None
+    # Partidas de los estados financieros y ratios (ver financial_tables.py)
+    financials: Optional[FinancialTable] = None
+    metadata: Dict = field(default_factory=dict)
+    manifest: Dict = field(default_factory=dict)
+    # Versión en disco de la que se cargó (ver kb_store.published_dir); None si no viene de disco
+    stamp: Optional[str] = None
+
+
+def _kb_stamp(path: Path) -> Optional[str]:
+    return published_dir(path)[1]
+
+
+def _snapshot_field(name: str) -> property:
+    """Atributo de KnowledgeBase que lee el snapshot publicado; asignarlo publica uno nuevo."""
+    def getter(self):
+        return getattr(self._snapshot, name)
+
+    def setter(self, value):
+        self._publish(**{name: value})
+
+    return property(getter, setter)
+
+
 class KnowledgeBase:
     """
     Clase para manejar la base de conocimiento con embeddings.
+    El contenido vive en un KBSnapshot inmutable que se reemplaza atómicamente.
     """
+    chunks = _snapshot_field("chunks")
+    matrix = _snapshot_field("matrix")
+    index = _snapshot_field("index")
+    lexical = _snapshot_field("lexical")
+    financials = _snapshot_field("financials")
+    metadata = _snapshot_field("metadata")
+    manifest = _snapshot_field("manifest")
+
     def __init__(self, name: str):
         self.name = name
-        self.chunks = []
-        self.embeddings = []
-        self.metadata = {}
-        self.embeddings_path = EMBEDDINGS_DIR / f"{name}_embeddings.pkl"
+        self._snapshot = KBSnapshot(index=FlatIndex(np.empty((0, 0), dtype=np.float32)))
+        # Serializa a quienes publican (construcción, recarga); las búsquedas no lo toman
+        self._write_lock = threading.RLock()
+        self.path = KB_DIR / name
+        # Formato anterior (pickle); se migra automáticamente al cargar
+        self.legacy_path = EMBEDDINGS_DIR / f"{name}_embeddings.pkl"
+
+    def _publish(self, snapshot: Optional[KBSnapshot] = None, **changes):
+        """Reemplaza el snapshot por `snapshot` o por una copia del actual con `changes`."""
+        with self._write_lock:
+            self._snapshot = snapshot if snapshot is not None else replace(self._snapshot, **changes)
+
+    def exists(self) -> bool:
+        return is_kb_dir(self.path) or self.legacy_path.exists()
+
+    def is_current(self, source_sha256: str) -> bool:
+        """La KB en disco se construyó desde ese PDF, con este pipeline y este espacio de embeddings."""
+        manifest = read_manifest(self.path)
+        if manifest is None:
+            return False
+        try:
+            embedding_provider.check_manifest(manifest)
+        except IncompatibleEmbeddingsError:
+            return False
+        return (manifest.get("source_sha256") == source_sha256
+                and manifest.get("pipeline_version") == PIPELINE_VERSION)
+
+    @property
+    def version(self) -> str:
+        """Versión del contenido de la KB: PDF de origen, espacio de embeddings y número de chunks."""
+        snap = self._snapshot
+        fields = [snap.manifest.get(k) for k in ("source_sha256", "provider", "model", "dimensions", "dim")]
+        return hashlib.sha256(json.dumps([*fields, len(snap.chunks)]).encode("utf-8")).hexdigest()[:12]
     
-    def build_from_pdf(self, pdf_path: str, force_rebuild: bool = False):
+    def build_from_pdf(self, pdf_path: str, force_rebuild: bool = False,
+                       on_progress: Optional[Callable[[str, int, int], None]] = None,
+                       embed_workers: int = EMBEDDING_WORKERS, pdf_workers: int = EXTRACT_WORKERS):
         """
         Construye o carga la base de conocimiento desde un PDF.
+        `on_progress(etapa, hechos, total)` informa el avance de cada etapa
+        (extract, chunk, embed, save); `embed_workers` y `pdf_workers` acotan
+        el paralelismo de la construcción.
+        Al reconstruir una KB que ya está en disco solo se embeben los chunks
+        nuevos o modificados; devuelve entonces cuántos se reutilizaron,
+        agregaron y eliminaron (None si solo se cargó la KB existente).
+        La KB nueva se publica recién cuando quedó guardada; mientras tanto las
+        búsquedas siguen respondiendo con la anterior.
         """
-        if not force_rebuild and self.embeddings_path.exists():
+        # Una construcción a la vez por KB
+        with self._write_lock:
+            return self._build_from_pdf(pdf_path, force_rebuild, on_progress, embed_workers, pdf_workers)
+
+    def _build_from_pdf(self, pdf_path: str, force_rebuild: bool,
+                        on_progress: Optional[Callable[[str, int, int], None]],
+                        embed_workers: int, pdf_workers: int) -> Optional[Dict[str, int]]:
+        report = on_progress or (lambda stage, done, total: None)
+        if not force_rebuild and self.exists():
             print(f"Cargando embeddings existentes para {self.name}...")
-            self.load()
-            return
+            try:
+                self.load()
+                if self.financials is None and Path(pdf_path).exists():
+                    # KB guardada antes de la extracción de tablas (los chunks no conservan las líneas)
+                    financials = self.extract_financials(pdf_path, year=self.metadata.get("anio"))
+                    # Se guarda como una versión nueva: la publicada no se modifica
+                    self._save(replace(self._snapshot, financials=financials))
+                    self.load()
+                return None
+            except IncompatibleEmbeddingsError as e:
+                print(f"[WARN] {self.name}: {e}; se reconstruye")
         
         print(f"Construyendo base de conocimiento para {self.name}...")
-        text, pais, empresa, anio = read_pdf_text(pdf_path)
+        with telemetry.span("extract", kb=self.name) as span:
+            text, pais, empresa, anio = read_pdf_text(
+                pdf_path,
+                workers=pdf_workers,
+                on_progress=lambda done, total: report("extract", done, total),
+            )
+            span.set(chars=len(text))
         
         if not text:
             raise ValueError(f"No se pudo extraer texto del PDF: {pdf_path}")
         
-        self.metadata = {
+        metadata = {
             "pais": pais,
             "empresa": empresa,
             "anio": anio,
-            "pdf_path": str(pdf_path)
+            "source_file": Path(pdf_path).name
         }
         
         # Generar chunks
-        self.chunks = chunk_tokens(text, token_limit=500)
-        print(f"Generados {len(self.chunks)} chunks")
+        report("chunk", 0, 1)
+        with telemetry.span("chunk", kb=self.name) as span:
+            chunks = chunk_tokens(text, token_limit=500)
+            lexical = BM25Index.build(chunks)
+            span.set(chunks=len(chunks))
+        report("chunk", 1, 1)
+
+        financials = self.extract_financials(pdf_path, text, year=anio)
+        print(f"Generados {len(chunks)} chunks")
+
+        # Vectores de la versión anterior de la KB: los chunks sin cambios no se vuelven a embeber
+        previous_rows, previous_matrix = self._previous_vectors()
+        hashes = [chunk_id(chunk) for chunk in chunks]
+        missing = [i for i, h in enumerate(hashes) if h not in previous_rows]
+        current = set(hashes)
+        diff = {
+            "reused": len(chunks) - len(missing),
+            "added": len(missing),
+            "removed": sum(h not in current for h in previous_rows),
+        }
+        if previous_rows:
+            print(f"  {diff['reused']} chunks sin cambios, {diff['added']} nuevos o modificados, "
+                  f"{diff['removed']} eliminados")
         
-        # Generar embeddings para cada chunk
+        # Generar embeddings por lotes y en paralelo (en el orden de los chunks)
         print("Generando embeddings...")
-        self.embeddings = []
-        for i, chunk in enumerate(self.chunks):
-            if i % 10 == 0:
-                print(f"  Procesando chunk {i}/{len(self.chunks)}")
-            embedding = get_embedding(chunk)
-            self.embeddings.append(embedding)
+        def embed_progress(done, total):
+            print(f"  Embeddings {done}/{total} chunks")
+            report("embed", done, total)
+
+        report("embed", 0, len(missing))
+        with telemetry.span("embed", kind="documents", kb=self.name) as span:
+            vectors, stats = embedding_provider.embed_documents(
+                [chunks[i] for i in missing],
+                max_workers=embed_workers,
+                on_progress=embed_progress,
+                cache=embedding_cache,
+            )
+            span.set(chunks=stats.chunks, cached=stats.cached, calls=stats.batches, tokens=stats.tokens,
+                     retries=stats.retries, reused=diff["reused"])
+        telemetry.add_tokens("embedding", stats.tokens)
+        print(
+            f"  {stats.chunks} chunks ({stats.cached} desde caché) en {stats.batches} lotes, "
+            f"{stats.seconds:.1f}s ({stats.chunks_per_sec:.1f} chunks/s, {stats.retries} reintentos)"
+        )
+        if diff["reused"]:
+            matrix = np.empty((len(chunks), previous_matrix.shape[1]), dtype=np.float32)
+            reused = [i for i, h in enumerate(hashes) if h in previous_rows]
+            matrix[reused] = previous_matrix[[previous_rows[hashes[i]] for i in reused]]
+            if missing:
+                matrix[missing] = np.asarray(vectors, dtype=np.float32)
+            vectors = matrix
+        matrix = _as_matrix(vectors)
+        manifest = {
+            "name": self.name,
+            **embedding_provider.describe(),
+            "source_sha256": file_sha256(pdf_path),
+            "pipeline_version": PIPELINE_VERSION,
+        }
         
         # Guardar para uso futuro
-        self.save()
+        report("save", 0, 1)
+        with telemetry.span("save", kb=self.name):
+            self._save(KBSnapshot(chunks=chunks, matrix=matrix, index=build_index(matrix), lexical=lexical,
+                                  financials=financials, metadata=metadata, manifest=manifest))
+            # Se publica lo guardado: vectores con mmap, compartidos con los demás procesos
+            self.load()
+        report("save", 1, 1)
         print(f"Base de conocimiento guardada para {self.name}")
+        return diff
+
+    def _previous_vectors(self) -> Tuple[Dict[str, int], np.ndarray]:
+        """
+        Fila de cada chunk (por hash de contenido) en la versión guardada de la
+        KB y su matriz; vacío si no hay KB en disco o es de otro espacio de embeddings.
+        """
+        empty = ({}, np.empty((0, 0), dtype=np.float32))
+        if not is_kb_dir(self.path):
+            return empty
+        try:
+            chunks, matrix, manifest = load_kb_dir(self.path)
+            embedding_provider.check_manifest(manifest)
+        except (IncompatibleEmbeddingsError, ValueError, OSError) as e:
+            print(f"[WARN] {self.name}: no se reutilizan los embeddings anteriores ({e})")
+            return empty
+        rows = {}
+        for i, chunk in enumerate(chunks):
+            rows.setdefault(chunk_id(chunk), i)
+        return rows, matrix
     
+    def extract_financials(self, pdf_path: str, text: Optional[str] = None,
+                           year: Optional[int] = None) -> FinancialTable:
+        """Partidas de los estados financieros del PDF (ver financial_tables.py)."""
+        with telemetry.span("tables", kb=self.name) as span:
+            if text is None:
+                text = extract_pdf_text(pdf_path)
+            table = FinancialTable.from_text(text, default_year=year)
+            span.set(items=len(table.items), periods=len(table.periods))
+        print(f"Partidas financieras de {self.name}: {', '.join(table.items) or 'ninguna'}")
+        return table
+
     def save(self):
-        """Guarda la base de conocimiento en disco."""
-        data = {
-            "chunks": self.chunks,
-            "embeddings": self.embeddings,
-            "metadata": self.metadata
-        }
-        with open(self.embeddings_path, "wb") as f:
-            pickle.dump(data, f)
+        """Guarda la base de conocimiento en disco (directorio con manifest, vectores y chunks)."""
+        self._save(self._snapshot)
+
+    def _save(self, snap: KBSnapshot):
+        def write_indexes(directory: Path):
+            snap.index.save(directory)
+            if snap.lexical is not None:
+                snap.lexical.save(directory)
+            if snap.financials is not None:
+                snap.financials.save(directory)
+
+        # Los índices se escriben en la carpeta de la versión nueva, antes de publicarla
+        save_kb_dir(self.path, snap.chunks, snap.matrix, {**snap.manifest, "metadata": snap.metadata},
+                    extra=write_indexes)
     
     def load(self):
-        """Carga la base de conocimiento desde disco."""
-        with open(self.embeddings_path, "rb") as f:
-            data = pickle.load(f)
-        self.chunks = data["chunks"]
-        self.embeddings = data["embeddings"]
-        self.metadata = data["metadata"]
-    
+        """
+        Carga la base de conocimiento desde disco y la publica; los vectores se
+        abren con mmap, así varios procesos comparten una sola copia en memoria.
+        """
+        with self._write_lock:
+            if not is_kb_dir(self.path) and self.legacy_path.exists():
+                print(f"Migrando {self.legacy_path.name} al formato de directorio...")
+                migrate_legacy_pickle(self.legacy_path, self.path, EMBEDDING_MODEL,
+                                      [PRELOADED_DIR, BASE_DIR, UPLOAD_DIR])
+            directory, stamp, chunks, matrix, manifest = load_published(self.path)
+            # No mezclar vectores de otro proveedor/modelo con las preguntas del actual
+            embedding_provider.check_manifest(manifest)
+            lexical = BM25Index.load(directory, count=len(chunks))
+            if lexical is None:
+                # KBs guardadas antes del índice léxico: se construye en memoria (la versión
+                # publicada no se modifica; se guarda con la próxima)
+                lexical = BM25Index.build(chunks)
+            self._publish(KBSnapshot(
+                chunks=chunks,
+                matrix=matrix,
+                index=build_index(matrix, directory=directory),
+                lexical=lexical,
+                financials=FinancialTable.load(directory),
+                metadata=manifest.get("metadata", {}),
+                manifest=manifest,
+                stamp=stamp,
+            ))
+        # Versiones anteriores que ya no usa ningún snapshot de este proceso
+        collect_versions(self.path)
+
+    def refresh(self) -> bool:
+        """
+        Si otro proceso reescribió la KB en disco (p. ej. /rebuild-sura en otro
+        worker de gunicorn), carga y publica la versión nueva. Devuelve True si recargó.
+        """
+        stamp = self._snapshot.stamp
+        if stamp is None or _kb_stamp(self.path) in (None, stamp):
+            return False
+        # Si este proceso la está construyendo o recargando, se sigue con el snapshot actual
+        if not self._write_lock.acquire(blocking=False):
+            return False
+        try:
+            if _kb_stamp(self.path) in (None, self._snapshot.stamp):
+                return False
+            self.load()
+            print(f"[KB] {self.name} recargada desde disco ({len(self.chunks)} chunks)")
+            return True
+        except (OSError, ValueError) as e:
+            # Versión borrada justo al abrirla u otro error de lectura: se reintenta después
+            print(f"[WARN] {self.name}: no se pudo recargar ({e})")
+            return False
+        finally:
+            self._write_lock.release()
+
+    def set_vectors(self, vectors):
+        """Reemplaza los vectores por una matriz contigua float32 normalizada y rehace el índice."""
+        matrix = _as_matrix(vectors)
+        self._publish(matrix=matrix, index=build_index(matrix))
+
+    def search(self, question: str, top_k: int = 5, mode: str = None,
+               query_vector=None) -> List[Tuple[str, float]]:
+        """
+        Busca los chunks más relevantes para la pregunta según `mode`:
+          lexical  BM25 sobre los chunks (sin llamadas de red)
+          dense    similitud coseno con el embedding de la pregunta
+          hybrid   fusión de ambos rankings por ranking recíproco (RRF)
+        `query_vector` evita volver a embeber la pregunta en modos dense/hybrid.
+        """
+        mode = mode or RETRIEVAL_MODE
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Modo de búsqueda desconocido: {mode}")
+        # Toda la búsqueda usa el mismo snapshot, aunque otro hilo publique uno nuevo
+        snap = self._snapshot
+        if len(snap.chunks) == 0:
+            return []
+        if mode != "lexical" and query_vector is None:
+            query_vector = get_query_embedding(question)
+        with telemetry.span("search", kb=self.name, mode=mode, chunks=len(snap.chunks)):
+            return self._search(snap, question, top_k, mode, query_vector)
+
+    def _search(self, snap: KBSnapshot, question: str, top_k: int, mode: str,
+                query_vector) -> List[Tuple[str, float]]:
+        lexical = snap.lexical
+        if lexical is None:
+            lexical = BM25Index.build(snap.chunks)
+            self._publish_if_current(snap, lexical=lexical)
+        if mode == "lexical":
+            ids, scores = lexical.search(question, top_k)
+            return [(snap.chunks[idx], float(score)) for idx, score in zip(ids, scores)]
+
+        if mode == "dense":
+            return self._results(snap, self._dense_search(snap, [query_vector], top_k))[0]
+
+        depth = max(top_k * 4, HYBRID_DEPTH)
+        lexical_ids, _ = lexical.search(question, depth)
+        dense_ids, _ = self._dense_search(snap, np.atleast_2d(query_vector), depth)[0]
+        return [(snap.chunks[idx], score) for idx, score in reciprocal_rank_fusion([dense_ids, lexical_ids], top_k)]
+
+    def _publish_if_current(self, snap: KBSnapshot, **changes):
+        """Completa el snapshot `snap` (p. ej. con un índice perezoso) si sigue siendo el publicado."""
+        # Sin esperar: si hay una construcción en curso, el dato se recalcula la próxima vez
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            if self._snapshot is snap:
+                self._snapshot = replace(snap, **changes)
+        finally:
+            self._write_lock.release()
+
     def search_similar(self, query: str, top_k: int = 5) -> List[Tuple[str, float]]:
         """
-        Busca los chunks más similares a la consulta.
+        Busca los chunks más similares a la consulta (similitud coseno vía el índice).
         """
-        query_embedding = get_embedding(query)
-        
-        # Calcular similitudes
-        similarities = []
-        for embedding in self.embeddings:
-            sim = cosine_similarity(
-                np.array(query_embedding).reshape(1, -1),
-                np.array(embedding).reshape(1, -1)
-            )[0][0]
-            similarities.append(sim)
-        
-        # Obtener los top_k chunks más similares
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        results = []
-        for idx in top_indices:
-            results.append((self.chunks[idx], similarities[idx]))
-        
-        return results
+        if self._snapshot.matrix.size == 0:
+            return []
+        return self.search_by_vector(get_query_embedding(query), top_k)
+
+    def search_by_vector(self, query_vector, top_k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Igual que search_similar pero con el embedding de la consulta ya calculado,
+        para reutilizar un mismo embedding en varias KBs.
+        """
+        return self.search_many([query_vector], top_k)[0]
+
+    @staticmethod
+    def _dense_search(snap: KBSnapshot, queries, top_k: int):
+        """(ids, puntajes) por consulta desde el índice vectorial."""
+        query_matrix = _normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if snap.matrix.size == 0:
+            return [(np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)) for _ in range(query_matrix.shape[0])]
+        return snap.index.search(query_matrix, top_k)
+
+    @staticmethod
+    def _results(snap: KBSnapshot, hits) -> List[List[Tuple[str, float]]]:
+        return [[(snap.chunks[idx], float(score)) for idx, score in zip(ids, scores)] for ids, scores in hits]
+
+    def search_many(self, queries, top_k: int = 5) -> List[List[Tuple[str, float]]]:
+        """
+        Busca varias consultas (vectores de embedding ya calculados) de una vez.
+        Devuelve una lista de resultados por consulta, en el mismo orden.
+        """
+        if len(queries) == 0:
+            return []
+        snap = self._snapshot
+        return self._results(snap, self._dense_search(snap, queries, top_k))
 
 
 # Inicializar base de conocimiento de Sura al arrancar la aplicación
 sura_kb = KnowledgeBase("sura")
 kb_registry: Dict[str, KnowledgeBase] = {}
 
-@app.before_request
-def initialize_kbs():
-    """Carga/Construye la KB de Sura y las KBs precargadas una sola vez al iniciar."""
+# KBs de PDFs subidos, identificadas por el hash de sus bytes y reutilizables vía kb_id
+upload_registry: Dict[str, KnowledgeBase] = {}
+_upload_locks: Dict[str, threading.Lock] = {}
+_upload_locks_guard = threading.Lock()
+upload_store = UploadKBStore(
+    KB_DIR,
+    prefix="upload_",
+    ttl_seconds=float(os.getenv("UPLOAD_KB_TTL_HOURS", "72")) * 3600,
+    quota_bytes=int(float(os.getenv("UPLOAD_KB_QUOTA_MB", "500")) * 1024 * 1024),
+    sweep_interval=float(os.getenv("UPLOAD_KB_SWEEP_SECONDS", "600")),
+    on_evict=lambda kb_id: upload_registry.pop(kb_id, None),
+)
+
+
+def get_upload_kb(kb_id: str) -> Optional[KnowledgeBase]:
+    """KB de una subida anterior (en memoria o en disco), o None si no existe o fue expulsada."""
+    if not re.fullmatch(r"[0-9a-f]{24}", kb_id):
+        return None
+    kb = upload_registry.get(kb_id)
+    if kb is None:
+        path = upload_store.path_for(kb_id)
+        if not path.exists():
+            return None
+        kb = KnowledgeBase(f"upload_{kb_id}")
+        try:
+            kb.load()
+        except IncompatibleEmbeddingsError:
+            # Construida con otro proveedor de embeddings: hay que volver a subirla
+            return None
+        upload_registry[kb_id] = kb
+    upload_store.touch(kb_id)
+    return kb
+
+
+def _upload_filename(file) -> str:
+    return secure_filename(file.filename) or "documento.pdf"
+
+
+def upload_kb_id(file) -> str:
+    """
+    Id de la KB de un PDF subido: hash de sus bytes y de los metadatos que se
+    infieren de su nombre (empresa, país, año). El mismo PDF subido con otro
+    nombre tiene su propia KB con sus metadatos; los chunks no se vuelven a
+    embeber (la caché de embeddings es por contenido).
+    """
+    pais, empresa, anio = infer_pdf_metadata(_upload_filename(file))
+    key = f"{upload_digest(file)}\x00{empresa}\x00{pais}\x00{anio}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+
+
+def _save_upload(file, kb_id: str) -> Path:
+    """
+    Guarda el PDF subido en un directorio propio bajo uploads/ (dos subidas
+    simultáneas del mismo archivo no se pisan), conservando su nombre:
+    read_pdf_text infiere los metadatos de él.
+    """
+    upload_dir = Path(tempfile.mkdtemp(prefix=f"{kb_id}-", dir=UPLOAD_DIR))
+    pdf_path = upload_dir / _upload_filename(file)
+    file.save(str(pdf_path))
+    return pdf_path
+
+
+def _build_upload_kb(kb_id: str, pdf_path: Path, **build_kwargs) -> KnowledgeBase:
+    """
+    Construye la KB del PDF guardado en `pdf_path` (salvo que otra petición ya
+    la haya construido) y borra el PDF al terminar.
+    """
+    with _upload_locks_guard:
+        lock = _upload_locks.setdefault(kb_id, threading.Lock())
+    try:
+        with lock:
+            kb = get_upload_kb(kb_id)
+            if kb is not None:
+                print(f"[UPLOADS] Reutilizando KB {kb_id}")
+                return kb
+            kb = KnowledgeBase(f"upload_{kb_id}")
+            kb.build_from_pdf(str(pdf_path), force_rebuild=True, **build_kwargs)
+            upload_registry[kb_id] = kb
+            return kb
+    finally:
+        shutil.rmtree(pdf_path.parent, ignore_errors=True)
+
+
+def kb_for_upload(file) -> Tuple[str, KnowledgeBase]:
+    """
+    Devuelve (kb_id, KB) para el PDF subido. Si ya se procesó un PDF con los
+    mismos bytes y el mismo nombre (metadatos), se reutiliza su KB; si no, se
+    construye y se guarda.
+    """
+    kb_id = upload_kb_id(file)
+    kb = get_upload_kb(kb_id)
+    if kb is not None:
+        print(f"[UPLOADS] Reutilizando KB {kb_id}")
+        return kb_id, kb
+    return kb_id, _build_upload_kb(kb_id, _save_upload(file, kb_id))
+
+
+# Ingesta en segundo plano: pocos hilos y poco paralelismo por trabajo, para
+# que construir KBs no deje sin CPU ni cuota de API a las preguntas
+ingest_jobs = IngestJobManager(
+    max_workers=int(os.getenv("INGEST_WORKERS", "1")),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", "8")),
+    ttl_seconds=float(os.getenv("INGEST_JOB_TTL_SECONDS", "3600")),
+)
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "2"))
+INGEST_PDF_WORKERS = int(os.getenv("INGEST_PDF_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // 2)
+
+
+def submit_upload_job(file) -> IngestJob:
+    """Encola la ingesta del PDF subido; si su KB ya existe devuelve un trabajo terminado."""
+    kb_id = upload_kb_id(file)
+    filename = file.filename
+    if get_upload_kb(kb_id) is not None:
+        return ingest_jobs.completed(kb_id, filename)
+    active = ingest_jobs.active_for(kb_id)
+    if active is not None:
+        return active
+    pdf_path = _save_upload(file, kb_id)
+
+    def run(job: IngestJob):
+        # Traza propia del trabajo (corre fuera de la petición); su id es el job_id
+        with telemetry.trace("ingest", job.id):
+            _build_upload_kb(
+                kb_id,
+                pdf_path,
+                on_progress=job.progress,
+                embed_workers=INGEST_EMBED_WORKERS,
+                pdf_workers=INGEST_PDF_WORKERS,
+            )
+
+    try:
+        job, created = ingest_jobs.submit(kb_id, filename, run)
+    except QueueFullError:
+        shutil.rmtree(pdf_path.parent, ignore_errors=True)
+        raise
+    if not created:
+        # Otra subida del mismo PDF encoló su trabajo entre active_for y submit:
+        # este `run` no se ejecutará y el PDF guardado no lo borraría nadie
+        shutil.rmtree(pdf_path.parent, ignore_errors=True)
+    return job
+
+
+# Estado de carga de las KBs (una sola vez por proceso)
+KB_READY_TIMEOUT = float(os.getenv("KB_READY_TIMEOUT", "0"))
+KB_ENDPOINTS = {"analyze", "analyze_stream", "analyze_multi", "financials", "rebuild_sura"}
+KB_LOADING_ERROR = "Bases de conocimiento cargándose, intenta de nuevo en unos segundos"
+# Cada cuánto se revisa si otro proceso reescribió las KBs en disco (0 = nunca)
+KB_REFRESH_SECONDS = float(os.getenv("KB_REFRESH_SECONDS", "2"))
+_kb_refresh_lock = threading.Lock()
+_kb_refreshed_at = 0.0
+kb_status: Dict[str, Dict] = {}
+_kb_warmup_lock = threading.Lock()
+_kb_warmup_started = False
+_kb_ready = threading.Event()
+
+
+def _load_kb(key: str, kb: KnowledgeBase, pdf_path: Optional[Path] = None, force_rebuild: bool = False) -> bool:
+    """
+    Carga/construye una KB y registra en `kb_status` si quedó cargada y cuánto tardó
+    (y, si se construyó, cuántos chunks se reutilizaron, agregaron y eliminaron).
+    Sin `pdf_path` solo se abre lo que ya está en disco (KBs del registro).
+    """
+    start = time.perf_counter()
+    try:
+        diff = None
+        if pdf_path is None:
+            kb.load()
+        else:
+            diff = kb.build_from_pdf(str(pdf_path), force_rebuild=force_rebuild)
+        kb_status[key] = {
+            "loaded": True,
+            "chunks": len(kb.chunks),
+            "index": kb.index.kind,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        if diff is not None:
+            kb_status[key]["rebuild"] = diff
+        return True
+    except Exception as e:
+        kb_status[key] = {
+            "loaded": False,
+            "error": str(e),
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return False
+
+
+def _open_registered_kbs():
+    """Abre las KBs de registry.json; las que falten se reportan, no se construyen."""
+    if "sura" not in kb_manifest["kbs"]:
+        kb_status["sura"] = {"loaded": False, "error": "SURA no está en el registro; ejecuta python ingest_kbs.py"}
+        print("[INIT][WARN] SURA no está en el registro de KBs")
+    for key, entry in kb_manifest["kbs"].items():
+        kb = sura_kb if key == "sura" else KnowledgeBase(entry["kb"])
+        if not _load_kb(key, kb):
+            print(f"[INIT][ERROR] KB '{key}' del registro: {kb_status[key]['error']}")
+            continue
+        if key != "sura":
+            kb_registry[key] = kb
+        print(f"[INIT] KB '{key}' (registro): {len(kb.chunks)} chunks ({kb_status[key]['seconds']}s)")
+
+
+def _build_preloaded_kbs():
+    """Sin registro: carga o construye la KB de Sura y las de PRELOADED_FILES."""
     # SURA
     if SURA_PDF_PATH.exists():
-        try:
-            sura_kb.build_from_pdf(str(SURA_PDF_PATH), force_rebuild=False)
-            print(f"[INIT] SURA KB: {len(sura_kb.chunks)} chunks")
-        except Exception as e:
-            print(f"[INIT][ERROR] SURA KB: {e}")
+        if _load_kb("sura", sura_kb, SURA_PDF_PATH):
+            print(f"[INIT] SURA KB: {len(sura_kb.chunks)} chunks ({kb_status['sura']['seconds']}s)")
+        else:
+            print(f"[INIT][ERROR] SURA KB: {kb_status['sura']['error']}")
     else:
+        kb_status["sura"] = {"loaded": False, "error": f"No se encontró {SURA_PDF_PATH.name}"}
         print(f"[INIT][WARN] No se encontró {SURA_PDF_PATH}")
 
     # PRESETS
     for key, path in PRELOADED_FILES.items():
-        try:
-            if not path.exists():
-                print(f"[INIT][WARN] No existe preset '{key}': {path}")
-                continue
-            kb = KnowledgeBase(f"preset_{key}")
-            kb.build_from_pdf(str(path), force_rebuild=False)
+        if not path.exists():
+            kb_status[key] = {"loaded": False, "error": f"No existe {path.name}"}
+            print(f"[INIT][WARN] No existe preset '{key}': {path}")
+            continue
+        kb = KnowledgeBase(f"preset_{key}")
+        if _load_kb(key, kb, path):
             kb_registry[key] = kb
-            print(f"[INIT] PRESET '{key}': {len(kb.chunks)} chunks")
-        except Exception as e:
-            print(f"[INIT][ERROR] PRESET '{key}': {e}")
+            print(f"[INIT] PRESET '{key}': {len(kb.chunks)} chunks ({kb_status[key]['seconds']}s)")
+        else:
+            print(f"[INIT][ERROR] PRESET '{key}': {kb_status[key]['error']}")
+
+
+def warm_up_kbs():
+    """
+    Carga/Construye la KB de Sura y las KBs precargadas una sola vez al iniciar.
+    Con registry.json solo se abren las KBs ya construidas por ingest_kbs.py.
+    """
+    try:
+        if kb_manifest is not None:
+            _open_registered_kbs()
+        else:
+            _build_preloaded_kbs()
+
+        # El tokenizador del modelo de chat (conteo de tokens del prompt en las trazas) se carga una vez aquí
+        if telemetry.ENABLED:
+            get_encoder(CHAT_MODEL)
+    finally:
+        _kb_ready.set()
+
+
+def refresh_kbs():
+    """
+    Recarga las KBs que otro proceso reescribió en disco (un stat del manifest
+    por KB, como mucho cada KB_REFRESH_SECONDS); así todos los workers sirven
+    la misma versión después de un /rebuild-sura.
+    """
+    global _kb_refreshed_at
+    if KB_REFRESH_SECONDS <= 0 or time.monotonic() - _kb_refreshed_at < KB_REFRESH_SECONDS:
+        return
+    if not _kb_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        _kb_refreshed_at = time.monotonic()
+        for kb in [sura_kb, *list(kb_registry.values())]:
+            kb.refresh()
+    finally:
+        _kb_refresh_lock.release()
+
+
+def kbs_ready() -> bool:
+    """
+    Espera hasta KB_READY_TIMEOUT segundos a que termine la carga de KBs; si
+    ya están listas, recarga las que otro proceso reescribió en disco.
+    """
+    if _kb_ready.is_set() or _kb_ready.wait(KB_READY_TIMEOUT):
+        refresh_kbs()
+        return True
+    return False
+
+
+def start_kb_warmup():
+    """
+    Lanza la carga de KBs y el barrido de subidas en segundo plano;
+    llamadas concurrentes los inician una sola vez.
+    """
+    global _kb_warmup_started
+    if _kb_warmup_started:
+        return
+    with _kb_warmup_lock:
+        if _kb_warmup_started:
+            return
+        _kb_warmup_started = True
+        threading.Thread(target=warm_up_kbs, name="kb-warmup", daemon=True).start()
+        upload_store.start_sweeper()
+
+
+# Endpoints con traza por petición (etapas, tokens y X-Request-ID en la respuesta)
+TRACED_ENDPOINTS = {"analyze", "analyze_stream", "analyze_multi", "create_upload", "rebuild_sura"}
+_REQUEST_ID = re.compile(r"[\w.:-]{1,64}")
+
+
+@app.before_request
+def start_request_trace():
+    """Abre la traza de la petición; respeta un X-Request-ID entrante válido."""
+    if request.endpoint not in TRACED_ENDPOINTS:
+        return None
+    g.trace_token = telemetry.start_trace(request.endpoint, valid_request_id(request.headers.get("X-Request-ID")))
+    return None
+
+
+def valid_request_id(value: Optional[str]) -> Optional[str]:
+    """El X-Request-ID entrante si es válido (se reutiliza en la traza y la respuesta); si no, None."""
+    return value if value and _REQUEST_ID.fullmatch(value) else None
+
+
+@app.after_request
+def add_request_id(response):
+    trace = telemetry.current_trace()
+    if trace is not None:
+        trace.status = response.status_code
+        response.headers["X-Request-ID"] = trace.id
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(exc):
+    # Con stream_with_context corre al terminar el stream, así que la traza incluye la generación
+    telemetry.finish_trace(g.pop("trace_token", None), status=500 if exc else None)
+
+
+@app.before_request
+def require_kbs_ready():
+    """
+    Inicia la carga de KBs con la primera petición. Los endpoints que usan KBs
+    esperan hasta KB_READY_TIMEOUT segundos y, si aún no están listas, responden 503.
+    """
+    start_kb_warmup()
+    if request.endpoint not in KB_ENDPOINTS or kbs_ready():
+        return None
+    response = jsonify({"ok": False, "error": KB_LOADING_ERROR})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+
+# Versión de la plantilla de generate_comparison_prompt: súbela al cambiar el
+# prompt para que la caché de respuestas no devuelva respuestas del anterior
+PROMPT_VERSION = "2"
 
 
 def generate_comparison_prompt(sura_context: List[str], other_context: List[str], 
-                               question: str, other_metadata: Dict) -> str:
+                               question: str, other_metadata: Dict, facts: Optional[List[str]] = None) -> str:
     """
     Genera un prompt optimizado para comparar políticas contables.
+    `facts`: ratios ya calculados de los estados financieros (financial_tables.py).
     """
     sura_text = "\n\n".join([f"[Fragmento {i+1}]: {chunk}" for i, chunk in enumerate(sura_context)])
     other_text = "\n\n".join([f"[Fragmento {i+1}]: {chunk}" for i, chunk in enumerate(other_context)])
+    facts_text = ""
+    if facts:
+        facts_text = "\n\n    === INDICADORES CALCULADOS (estados financieros) ===\n    " + "\n    ".join(facts) + \
+            "\n    Usa estos valores tal cual, sin recalcularlos."
     
     prompt = f"""Eres un experto analista financiero especializado en comparación de políticas contables.
 
@@ -293,7 +1039,7 @@ def generate_comparison_prompt(sura_context: List[str], other_context: List[str]
     {sura_text}
 
     === POLÍTICAS DE {other_metadata['empresa'].upper()} ===
-    {other_text}
+    {other_text}{facts_text}
 
     INSTRUCCIONES:
     1. Identifica las políticas contables relevantes a la pregunta en ambas empresas
@@ -313,6 +1059,33 @@ def generate_comparison_prompt(sura_context: List[str], other_context: List[str]
     return prompt
 
 
+def generate_merge_prompt(question: str, comparisons: List[Tuple[Dict, str]]) -> str:
+    """
+    Prompt de la pasada final de /analyze/multi: consolida las comparaciones
+    Sura vs. cada entidad en una sola tabla entre países.
+    """
+    sections = "\n\n".join(
+        f"=== SURA vs. {metadata['empresa']} ({metadata['pais']}, {metadata['anio']}) ===\n{answer}"
+        for metadata, answer in comparisons
+    )
+
+    return f"""Eres un experto analista financiero especializado en comparación de políticas contables.
+
+    TAREA: Consolidar en una sola vista regional las comparaciones entre SURA 2024 y {len(comparisons)} entidades sobre: {question}
+
+    COMPARACIONES INDIVIDUALES:
+
+    {sections}
+
+    INSTRUCCIONES:
+    1. Presenta una tabla con una fila por entidad (entidad, país, política, diferencia principal frente a SURA)
+    2. Usa solo la información de las comparaciones anteriores; no agregues datos nuevos
+    3. Indica "No disponible" cuando una comparación no tenga la información
+    4. Concluye con las diferencias regionales más relevantes
+
+    Responde de manera clara y profesional."""
+
+
 @app.route("/", methods=["GET"])
 def index():
     preset_options = []
@@ -322,101 +1095,744 @@ def index():
     return render_template("index.html", preset_options=preset_options)
 
 
-@app.route("/analyze", methods=["POST"])
-def analyze():
-    try:
-        question = (request.form.get("question") or "").strip()
-        preset_key = (request.form.get("preset_key") or "").strip()
-        file = request.files.get("pdf")
-
-        if not question:
-            return jsonify({"ok": False, "error": "La pregunta no puede estar vacía"}), 400
-        if not os.getenv("OPENAI_API_KEY"):
-            return jsonify({"ok": False, "error": "OPENAI_API_KEY no está configurada"}), 500
-        if not sura_kb.chunks:
-            return jsonify({"ok": False, "error": "Base de conocimiento de Sura no inicializada"}), 500
-
-        # Determinar la KB "otra" (preset o upload)
-        other_kb = None
-        temp_file_path = None
-
-        if preset_key:
-            other_kb = kb_registry.get(preset_key)
-            if other_kb is None:
-                return jsonify({"ok": False, "error": f"Preset '{preset_key}' no encontrado"}), 400
-        else:
-            # flujo de upload
-            if not file or file.filename == "":
-                return jsonify({"ok": False, "error": "Sube un PDF o selecciona un EEFF precargado"}), 400
-            if not allowed_file(file.filename):
-                return jsonify({"ok": False, "error": "Formato no permitido (solo .pdf)"}), 400
+class AnalyzeError(Exception):
+    """Error de validación de /analyze; se responde como JSON con `status`."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
 
-            filename = secure_filename(file.filename)
-            temp_file_path = UPLOAD_DIR / filename
-            file.save(str(temp_file_path))
+def _chat_messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "Eres un experto analista financiero."},
+        {"role": "user", "content": prompt}
+    ]
 
-            # KB temporal para el PDF subido
-            other_kb = KnowledgeBase(f"temp_{filename}")
-            other_kb.build_from_pdf(str(temp_file_path), force_rebuild=True)
 
-        # Recuperación de contextos
-        sura_results = sura_kb.search_similar(question, top_k=3)
-        other_results = other_kb.search_similar(question, top_k=3)
+def _analysis_target(form, files) -> Tuple[str, str, KnowledgeBase, Optional[str]]:
+    """
+    Valida el formulario de /analyze y resuelve la KB "otra" (preset, upload
+    o KB de una subida anterior). Devuelve (pregunta, modo, KB, kb_id).
+    """
+    question = (form.get("question") or "").strip()
+    preset_key = (form.get("preset_key") or "").strip()
+    request_kb_id = (form.get("kb_id") or "").strip()
+    mode = (form.get("mode") or RETRIEVAL_MODE).strip()
+    file = files.get("pdf")
+
+    if not question:
+        raise AnalyzeError("La pregunta no puede estar vacía")
+    if mode not in RETRIEVAL_MODES:
+        raise AnalyzeError(f"Modo de búsqueda no válido: {mode} (usa {', '.join(RETRIEVAL_MODES)})")
+    if not os.getenv("OPENAI_API_KEY"):
+        raise AnalyzeError("OPENAI_API_KEY no está configurada", 500)
+    if not sura_kb.chunks:
+        raise AnalyzeError("Base de conocimiento de Sura no inicializada", 500)
+
+    # Determinar la KB "otra" (preset, upload o KB de una subida anterior)
+    other_kb = None
+    kb_id = None
+
+    if preset_key:
+        other_kb = kb_registry.get(preset_key)
+        if other_kb is None:
+            raise AnalyzeError(f"Preset '{preset_key}' no encontrado")
+    elif file and file.filename:
+        # flujo de upload
+        if not allowed_file(file.filename):
+            raise AnalyzeError("Formato no permitido (solo .pdf)")
+        kb_id, other_kb = kb_for_upload(file)
+    elif request_kb_id:
+        other_kb = _require_upload_kb(request_kb_id)
+        kb_id = request_kb_id
+    else:
+        raise AnalyzeError("Sube un PDF o selecciona un EEFF precargado")
+    return question, mode, other_kb, kb_id
+
+
+def _prepare_analysis() -> Dict:
+    """
+    Valida el formulario de /analyze, resuelve la KB "otra" y recupera los
+    contextos de ambas KBs. Devuelve lo necesario para llamar al modelo.
+    """
+    question, mode, other_kb, kb_id = _analysis_target(request.form, request.files)
+
+    # Preguntas que solo piden ratios: se responden con las tablas, sin buscar ni llamar al modelo
+    analysis = _ratio_analysis(question, mode, other_kb, kb_id)
+    if analysis is not None:
+        return analysis
 
-        sura_context = [chunk for chunk, _ in sura_results]
-        other_context = [chunk for chunk, _ in other_results]
+    # Recuperación de contextos (la pregunta se embebe una sola vez para ambas KBs;
+    # en modo léxico no se embebe)
+    query_vector = get_query_embedding(question) if mode != "lexical" else None
+    sura_results = sura_kb.search(question, top_k=CONTEXT_TOP_K, mode=mode, query_vector=query_vector)
+    other_results = other_kb.search(question, top_k=CONTEXT_TOP_K, mode=mode, query_vector=query_vector)
+    analysis = _build_analysis(question, mode, query_vector, sura_results, other_kb, other_results, kb_id)
+    _dump_prompt(analysis)
+    return analysis
 
+
+def _dump_prompt(analysis: Dict):
+    saved_path = save_prompt_to_file(analysis["prompt"], "debug/prompt_dump.txt")
+    print(f"Prompt guardado en: {saved_path} (longitud: {len(analysis['prompt'])} caracteres)")
+
+
+async def _prepare_analysis_async(form, files) -> Dict:
+    """
+    Como _prepare_analysis, sin bloquear el event loop: la pregunta se embebe
+    con el cliente asíncrono y las búsquedas en ambas KBs corren a la vez en
+    hilos (numpy libera el GIL en el producto de matrices).
+    """
+    question, mode, other_kb, kb_id = await asyncio.to_thread(_analysis_target, form, files)
+    analysis = _ratio_analysis(question, mode, other_kb, kb_id)
+    if analysis is not None:
+        return analysis
+
+    query_vector = await get_query_embedding_async(question) if mode != "lexical" else None
+    sura_results, other_results = await asyncio.gather(
+        asyncio.to_thread(sura_kb.search, question, top_k=CONTEXT_TOP_K, mode=mode, query_vector=query_vector),
+        asyncio.to_thread(other_kb.search, question, top_k=CONTEXT_TOP_K, mode=mode, query_vector=query_vector),
+    )
+
+    def build() -> Dict:
+        analysis = _build_analysis(question, mode, query_vector, sura_results, other_kb, other_results, kb_id)
+        _dump_prompt(analysis)
+        return analysis
+
+    return await asyncio.to_thread(build)
+
+
+def _require_upload_kb(kb_id: str) -> KnowledgeBase:
+    """KB de una subida anterior; AnalyzeError 409 si aún se ingiere y 404 si ya no existe."""
+    kb = get_upload_kb(kb_id)
+    if kb is None and ingest_jobs.active_for(kb_id):
+        raise AnalyzeError("El documento aún se está procesando", 409)
+    if kb is None:
+        raise AnalyzeError("El documento ya no está disponible, súbelo de nuevo", 404)
+    return kb
+
+
+def _ratio_analysis(question: str, mode: str, other_kb: KnowledgeBase, kb_id: Optional[str] = None) -> Optional[Dict]:
+    """
+    Preguntas que solo piden ratios: la respuesta sale de las tablas de ambas
+    KBs, sin recuperación ni modelo. None si no aplica o si a alguna de las
+    dos le faltan las partidas de todos los ratios pedidos.
+    """
+    if not RATIO_DIRECT_ANSWERS or not is_direct_ratio_question(question):
+        return None
+    with telemetry.span("ratios", kb=other_kb.name) as span:
+        answer = ratio_table(question, [
+            ("SURA", sura_kb.financials),
+            (other_kb.metadata.get("empresa") or other_kb.name, other_kb.financials),
+        ])
+        span.set(direct=answer is not None)
+    if answer is None:
+        return None
+    return {
+        "kb_id": kb_id,
+        "question": question,
+        "query_vector": None,
+        "sura_results": [],
+        "other_results": [],
+        "metadata": other_kb.metadata,
+        "mode": mode,
+        "prompt": None,
+        "context": {"sura": None, "other": None},
+        "direct_answer": answer,
+    }
+
+
+def _pack_candidates(results: List[Tuple[str, float]]) -> Tuple[List[Tuple[str, float]], Optional[Dict]]:
+    """Fragmentos sin duplicados, en orden MMR, hasta CONTEXT_TOKEN_BUDGET tokens (ver context_packing.py)."""
+    if CONTEXT_TOKEN_BUDGET <= 0:
+        return results, None
+    with telemetry.span("pack") as span:
+        packed, stats = pack_context(results, budget=CONTEXT_TOKEN_BUDGET, count_tokens=count_prompt_tokens)
+        span.set(**stats.to_dict())
+    return packed, stats.to_dict()
+
+
+def _build_analysis(question: str, mode: str, query_vector, sura_results: List[Tuple[str, float]],
+                    other_kb: KnowledgeBase, other_results: List[Tuple[str, float]],
+                    kb_id: Optional[str] = None, sura_pack: Optional[Dict] = None) -> Dict:
+    """
+    Prompt y claves de caché de una comparación Sura vs. `other_kb` con los
+    candidatos ya recuperados (se empaquetan dentro del presupuesto de tokens).
+    Con `sura_pack` los fragmentos de Sura ya vienen empaquetados (/analyze/multi).
+    """
+    if sura_pack is None:
+        sura_results, sura_pack = _pack_candidates(sura_results)
+    other_results, other_pack = _pack_candidates(other_results)
+    sura_context = [chunk for chunk, _ in sura_results]
+    other_context = [chunk for chunk, _ in other_results]
+
+    # Ratios calculados de las tablas, como datos del prompt cuando la pregunta los menciona
+    ratio_keys = ratio_question(question)
+    facts = (ratio_facts("SURA", sura_kb.financials, ratio_keys)
+             + ratio_facts(other_kb.metadata.get("empresa") or other_kb.name, other_kb.financials, ratio_keys))
+
+    with telemetry.span("prompt", kb=other_kb.name) as span:
         prompt = generate_comparison_prompt(
             sura_context,
             other_context,
             question,
-            other_kb.metadata
+            other_kb.metadata,
+            facts=facts,
         )
+        if telemetry.ENABLED:
+            span.set(prompt_tokens=count_prompt_tokens(prompt), chars=len(prompt))
 
-        saved_path = save_prompt_to_file(prompt, "debug/prompt_dump.txt")
-        print(f"Prompt guardado en: {saved_path} (longitud: {len(prompt)} caracteres)")
+    # Clave de la caché de respuestas: mismos documentos, mismos fragmentos, misma pregunta
+    cache_scope = answer_scope(
+        [(sura_kb.name, sura_kb.version), (other_kb.name, other_kb.version)],
+        CHAT_MODEL, PROMPT_VERSION, embedding_provider.space,
+    )
+    cache_key = answer_key(
+        cache_scope, question,
+        [[chunk_id(chunk) for chunk in sura_context], [chunk_id(chunk) for chunk in other_context]],
+    )
+
+    return {
+        "kb_id": kb_id,
+        "question": question,
+        "query_vector": query_vector,
+        "sura_results": sura_results,
+        "other_results": other_results,
+        "metadata": other_kb.metadata,
+        "mode": mode,
+        "prompt": prompt,
+        "cache_scope": cache_scope,
+        "cache_key": cache_key,
+        "context": {"sura": sura_pack, "other": other_pack},
+    }
+
+
+def count_prompt_tokens(prompt: str) -> int:
+    """Tokens del prompt con el tokenizador del modelo de chat (tiktoken)."""
+    return len(get_encoder(CHAT_MODEL).encode(prompt, disallowed_special=()))
+
+
+def _usage_attrs(usage: Optional[Dict]) -> Dict:
+    usage = usage or {}
+    return {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens")}
+
+
+def _cached_answer(analysis: Dict) -> Optional[CachedAnswer]:
+    if answer_cache is None:
+        return None
+    return answer_cache.get(analysis["cache_key"], analysis["cache_scope"], analysis["query_vector"])
+
+
+def _store_answer(analysis: Dict, answer: str, usage: Optional[Dict]):
+    if answer_cache is None or not answer:
+        return
+    answer_cache.put(
+        analysis["cache_key"], analysis["cache_scope"], analysis["question"], answer,
+        tokens=(usage or {}).get("total_tokens") or 0, query_vector=analysis["query_vector"],
+    )
+
+
+def _cache_info(cached: CachedAnswer) -> Dict:
+    """Cómo se resolvió desde la caché (exacta o semántica) y cuántos tokens se ahorraron."""
+    info = {"match": cached.match, "saved_tokens": cached.tokens}
+    if cached.match == "semantic":
+        info.update(similarity=cached.similarity, question=cached.question)
+    return info
 
+
+def _complete(analysis: Dict) -> Dict:
+    """Respuesta (sin stream) de una comparación preparada: de las tablas, desde la caché o del modelo."""
+    if analysis.get("direct_answer"):
+        return {"answer": analysis["direct_answer"], "cached": False, "source": "financials", "usage": None}
+    cached = _cached_answer(analysis)
+    if cached:
+        return {"answer": cached.answer, "cached": True, "cache": _cache_info(cached), "usage": None}
+
+    with telemetry.span("completion", model=CHAT_MODEL, calls=1) as span:
         response = client.chat.completions.create(
-            model="gpt-5",
-            messages=[
-                {"role": "system", "content": "Eres un experto analista financiero."},
-                {"role": "user", "content": prompt}
-            ],
+            model=CHAT_MODEL,
+            messages=_chat_messages(analysis["prompt"]),
             temperature=0.1,
             max_tokens=2000
         )
         output_text = response.choices[0].message.content
+        usage = response.usage.model_dump() if response.usage else None
+        span.set(**_usage_attrs(usage))
+    telemetry.add_usage(usage)
+    _store_answer(analysis, output_text, usage)
+    return {"answer": output_text, "cached": False, "usage": usage}
+
+
+async def _complete_async(analysis: Dict) -> Dict:
+    """Como _complete, con la completion por el cliente asíncrono (plazo, reintentos y límite de concurrencia)."""
+    if analysis.get("direct_answer"):
+        return {"answer": analysis["direct_answer"], "cached": False, "source": "financials", "usage": None}
+    cached = await asyncio.to_thread(_cached_answer, analysis)
+    if cached:
+        return {"answer": cached.answer, "cached": True, "cache": _cache_info(cached), "usage": None}
+
+    with telemetry.span("completion", model=CHAT_MODEL, calls=1) as span:
+        response = await upstream.chat(
+            CHAT_MODEL,
+            _chat_messages(analysis["prompt"]),
+            temperature=0.1,
+            max_tokens=2000
+        )
+        output_text = response.choices[0].message.content
+        usage = response.usage.model_dump() if response.usage else None
+        span.set(**_usage_attrs(usage))
+    telemetry.add_usage(usage)
+    await asyncio.to_thread(_store_answer, analysis, output_text, usage)
+    return {"answer": output_text, "cached": False, "usage": usage}
 
-        # Limpieza si hubo archivo temporal
-        try:
-            if temp_file_path:
-                os.remove(temp_file_path)
-            # si creaste KB temporal, borra su pickle
-            if not preset_key and other_kb.embeddings_path.exists():
-                os.remove(other_kb.embeddings_path)
-        except:
-            pass
 
-        return jsonify({"ok": True, "answer": output_text}), 200
+def _analyze_payload(analysis: Dict, result: Dict) -> Dict:
+    payload = {"ok": True, "answer": result["answer"], "cached": result["cached"], "context": analysis["context"]}
+    if result.get("source"):
+        payload["source"] = result["source"]
+    if result["cached"]:
+        payload["cache"] = result["cache"]
+    if analysis["kb_id"]:
+        payload["kb_id"] = analysis["kb_id"]
+    return payload
 
+
+async def analyze_async(form, files) -> Tuple[Dict, int]:
+    """
+    /analyze en el event loop (asgi.py): mismo formulario y misma respuesta
+    que analyze(). Devuelve (payload, status); un plazo vencido es un 504.
+    """
+    try:
+        analysis = await _prepare_analysis_async(form, files)
+        return _analyze_payload(analysis, await _complete_async(analysis)), 200
+    except AnalyzeError as e:
+        return {"ok": False, "error": str(e)}, e.status
+    except UpstreamTimeoutError as e:
+        return {"ok": False, "error": f"El proveedor no respondió a tiempo ({e.stage})"}, 504
+    except Exception as e:
+        app.logger.exception("Error en /analyze (asgi)")
+        return {"ok": False, "error": f"Error interno: {str(e)}"}, 500
+
+
+@app.route("/analyze", methods=["POST"])
+def analyze():
+    try:
+        analysis = _prepare_analysis()
+
+        result = _complete(analysis)
+        return jsonify(_analyze_payload(analysis, result)), 200
+
+    except AnalyzeError as e:
+        return jsonify({"ok": False, "error": str(e)}), e.status
     except Exception as e:
         app.logger.exception("Error en /analyze")
         return jsonify({"ok": False, "error": f"Error interno: {str(e)}"}), 500
 
 
+def _sse(event: str, data: Dict) -> str:
+    """Un evento server-sent-events con `data` en JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+@app.route("/analyze/stream", methods=["POST"])
+def analyze_stream():
+    """
+    Variante de /analyze por server-sent events. Eventos, en orden:
+      retrieval  contextos recuperados de ambas KBs (y kb_id si hubo subida)
+      delta      fragmento de la respuesta ({"text": ...}), uno por token recibido
+      done       uso de tokens, finish_reason, tiempos (retrieval, primer token, total)
+                 y `cached` (si la respuesta vino de la caché o de las tablas
+                 financieras, `source: "financials"`, en un único delta)
+      error      si la generación falla a mitad del stream
+    Los errores de validación se responden como en /analyze (JSON, sin stream).
+    """
+    start = time.perf_counter()
+    try:
+        analysis = _prepare_analysis()
+    except AnalyzeError as e:
+        return jsonify({"ok": False, "error": str(e)}), e.status
+    except Exception as e:
+        app.logger.exception("Error en /analyze/stream")
+        return jsonify({"ok": False, "error": f"Error interno: {str(e)}"}), 500
+    timings = {"retrieval_ms": _elapsed_ms(start)}
+
+    def events() -> Iterator[str]:
+        yield _sse("retrieval", {
+            "kb_id": analysis["kb_id"],
+            "metadata": analysis["metadata"],
+            "mode": analysis["mode"],
+            "sura": [{"text": chunk, "score": score} for chunk, score in analysis["sura_results"]],
+            "other": [{"text": chunk, "score": score} for chunk, score in analysis["other_results"]],
+            "context": analysis["context"],
+            "timings": dict(timings),
+        })
+
+        if analysis.get("direct_answer"):
+            timings["ttft_ms"] = timings["total_ms"] = _elapsed_ms(start)
+            yield _sse("delta", {"text": analysis["direct_answer"]})
+            yield _sse("done", {"ok": True, "usage": None, "finish_reason": "stop", "timings": timings,
+                                "cached": False, "source": "financials"})
+            return
+
+        cached = _cached_answer(analysis)
+        if cached:
+            timings["ttft_ms"] = _elapsed_ms(start)
+            yield _sse("delta", {"text": cached.answer})
+            timings["total_ms"] = _elapsed_ms(start)
+            yield _sse("done", {"ok": True, "usage": None, "finish_reason": "stop", "timings": timings,
+                                "cached": True, "cache": _cache_info(cached)})
+            return
+
+        usage = None
+        finish_reason = None
+        parts: List[str] = []
+        try:
+            with telemetry.span("completion", model=CHAT_MODEL, stream=True, calls=1) as span:
+                stream = client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=_chat_messages(analysis["prompt"]),
+                    temperature=0.1,
+                    max_tokens=2000,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage.model_dump()
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    finish_reason = choice.finish_reason or finish_reason
+                    if choice.delta and choice.delta.content:
+                        if "ttft_ms" not in timings:
+                            timings["ttft_ms"] = _elapsed_ms(start)
+                        parts.append(choice.delta.content)
+                        yield _sse("delta", {"text": choice.delta.content})
+                span.set(ttft_ms=timings.get("ttft_ms"), **_usage_attrs(usage))
+        except Exception as e:
+            app.logger.exception("Error en /analyze/stream")
+            yield _sse("error", {"ok": False, "error": f"Error interno: {str(e)}"})
+            return
+        telemetry.add_usage(usage)
+
+        timings["total_ms"] = _elapsed_ms(start)
+        print(f"[STREAM] retrieval {timings['retrieval_ms']} ms, primer token "
+              f"{timings.get('ttft_ms')} ms, total {timings['total_ms']} ms")
+        _store_answer(analysis, "".join(parts), usage)
+        yield _sse("done", {"ok": True, "usage": usage, "finish_reason": finish_reason, "timings": timings,
+                            "cached": False})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# /analyze/multi: llamadas simultáneas al modelo (compartidas entre peticiones)
+# y hilos para buscar en todas las KBs a la vez
+MULTI_CONCURRENCY = int(os.getenv("MULTI_CONCURRENCY", "4"))
+MULTI_MAX_ENTITIES = int(os.getenv("MULTI_MAX_ENTITIES", "10"))
+_completion_pool = ThreadPoolExecutor(max_workers=max(1, MULTI_CONCURRENCY), thread_name_prefix="compare")
+_retrieval_pool = ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 1), thread_name_prefix="retrieve")
+
+
+def _form_list(field: str) -> List[str]:
+    """Valores de un campo repetido o separado por comas, sin duplicados y en orden."""
+    values = [v.strip() for raw in request.form.getlist(field) for v in raw.split(",")]
+    return list(dict.fromkeys(v for v in values if v))
+
+
+def _prepare_multi_analysis() -> Dict:
+    """
+    Valida el formulario de /analyze/multi, embebe la pregunta una sola vez y
+    recupera en paralelo los contextos de Sura y de todas las entidades.
+    Sin `preset_key` ni `kb_id` compara con todos los EEFF precargados.
+    """
+    question = (request.form.get("question") or "").strip()
+    mode = (request.form.get("mode") or RETRIEVAL_MODE).strip()
+    merge = request.form.get("merge", "0").lower() in ("1", "true", "on")
+    preset_keys = _form_list("preset_key")
+    kb_ids = _form_list("kb_id")
+
+    if not question:
+        raise AnalyzeError("La pregunta no puede estar vacía")
+    if mode not in RETRIEVAL_MODES:
+        raise AnalyzeError(f"Modo de búsqueda no válido: {mode} (usa {', '.join(RETRIEVAL_MODES)})")
+    if not os.getenv("OPENAI_API_KEY"):
+        raise AnalyzeError("OPENAI_API_KEY no está configurada", 500)
+    if not sura_kb.chunks:
+        raise AnalyzeError("Base de conocimiento de Sura no inicializada", 500)
+    if not preset_keys and not kb_ids:
+        preset_keys = [key for key in PRELOADED_FILES if key in kb_registry]
+    if len(preset_keys) + len(kb_ids) > MULTI_MAX_ENTITIES:
+        raise AnalyzeError(f"Máximo {MULTI_MAX_ENTITIES} entidades por consulta")
+
+    # (clave, kb_id de la subida o None, KB)
+    entities: List[Tuple[str, Optional[str], KnowledgeBase]] = []
+    for key in preset_keys:
+        kb = kb_registry.get(key)
+        if kb is None:
+            raise AnalyzeError(f"Preset '{key}' no encontrado")
+        entities.append((key, None, kb))
+    for kb_id in kb_ids:
+        entities.append((kb_id, kb_id, _require_upload_kb(kb_id)))
+    if not entities:
+        raise AnalyzeError("No hay entidades para comparar")
+
+    # Las entidades que se resuelven con sus tablas (preguntas de ratios) no se buscan
+    direct = {key: _ratio_analysis(question, mode, kb, kb_id) for key, kb_id, kb in entities}
+    pending = [(key, kb_id, kb) for key, kb_id, kb in entities if direct[key] is None]
+    sura_results, sura_pack, results = [], None, {}
+    if pending:
+        query_vector = get_query_embedding(question) if mode != "lexical" else None
+        kbs = [sura_kb] + [kb for _, _, kb in pending]
+        # Cada búsqueda corre en una copia del contexto de la petición (así sus etapas quedan en la traza)
+        contexts = [contextvars.copy_context() for _ in kbs]
+        found = list(_retrieval_pool.map(
+            lambda kb, context: context.run(kb.search, question, top_k=CONTEXT_TOP_K, mode=mode,
+                                            query_vector=query_vector),
+            kbs, contexts,
+        ))
+        # El contexto de Sura es el mismo para todas las entidades: se empaqueta una vez
+        sura_results, sura_pack = _pack_candidates(found[0])
+        results = {
+            key: _build_analysis(question, mode, query_vector, sura_results, kb, other_results, kb_id,
+                                 sura_pack=sura_pack)
+            for (key, kb_id, kb), other_results in zip(pending, found[1:])
+        }
+
+    return {
+        "question": question,
+        "mode": mode,
+        "merge": merge,
+        "sura_results": sura_results,
+        "sura_context": sura_pack,
+        "entities": [{"key": key, **(direct[key] or results[key])} for key, _, _ in entities],
+    }
+
+
+def _add_usage(total: Dict[str, int], usage: Optional[Dict]):
+    for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        total[field] += (usage or {}).get(field) or 0
+
+
+@app.route("/analyze/multi", methods=["POST"])
+def analyze_multi():
+    """
+    Compara Sura con varias entidades en una sola petición, por server-sent events.
+    Form-data: question, preset_key y/o kb_id (repetidos o separados por comas),
+    mode y merge=1 para la tabla consolidada. Eventos, en orden:
+      retrieval  fragmentos recuperados de Sura y de cada entidad
+      entity     comparación de una entidad, en cuanto termina (o su error)
+      merge      fragmento de la tabla consolidada entre países (solo con merge=1)
+      done       entidades completadas, uso total de tokens y tiempos
+    Las comparaciones corren en paralelo, con a lo sumo MULTI_CONCURRENCY a la vez.
+    """
+    start = time.perf_counter()
+    try:
+        multi = _prepare_multi_analysis()
+    except AnalyzeError as e:
+        return jsonify({"ok": False, "error": str(e)}), e.status
+    except Exception as e:
+        app.logger.exception("Error en /analyze/multi")
+        return jsonify({"ok": False, "error": f"Error interno: {str(e)}"}), 500
+    timings = {"retrieval_ms": _elapsed_ms(start)}
+    entities = multi["entities"]
+
+    def events() -> Iterator[str]:
+        yield _sse("retrieval", {
+            "mode": multi["mode"],
+            "sura": [{"text": chunk, "score": score} for chunk, score in multi["sura_results"]],
+            "sura_context": multi["sura_context"],
+            "entities": [
+                {
+                    "key": entity["key"],
+                    "kb_id": entity["kb_id"],
+                    "metadata": entity["metadata"],
+                    "other": [{"text": chunk, "score": score} for chunk, score in entity["other_results"]],
+                    "context": entity["context"]["other"],
+                }
+                for entity in entities
+            ],
+            "timings": dict(timings),
+        })
+
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        answers: Dict[str, str] = {}
+        futures = {
+            _completion_pool.submit(contextvars.copy_context().run, _complete, entity): entity
+            for entity in entities
+        }
+        for future in as_completed(futures):
+            entity = futures[future]
+            event = {"key": entity["key"], "kb_id": entity["kb_id"], "metadata": entity["metadata"]}
+            try:
+                result = future.result()
+            except Exception as e:
+                app.logger.exception("Error en /analyze/multi (%s)", entity["key"])
+                event.update(ok=False, error=f"Error interno: {str(e)}")
+            else:
+                answers[entity["key"]] = result["answer"]
+                _add_usage(usage, result["usage"])
+                event.update(ok=True, **result)
+            timings.setdefault("first_entity_ms", _elapsed_ms(start))
+            yield _sse("entity", {**event, "elapsed_ms": _elapsed_ms(start)})
+        timings["entities_ms"] = _elapsed_ms(start)
+
+        if multi["merge"] and len(answers) > 1:
+            # En el orden pedido, no en el de llegada
+            comparisons = [(e["metadata"], answers[e["key"]]) for e in entities if e["key"] in answers]
+            try:
+                with telemetry.span("completion", model=CHAT_MODEL, kind="merge", stream=True, calls=1) as span:
+                    stream = client.chat.completions.create(
+                        model=CHAT_MODEL,
+                        messages=_chat_messages(generate_merge_prompt(multi["question"], comparisons)),
+                        temperature=0.1,
+                        max_tokens=2000,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    for chunk in stream:
+                        if chunk.usage:
+                            merge_usage = chunk.usage.model_dump()
+                            _add_usage(usage, merge_usage)
+                            telemetry.add_usage(merge_usage)
+                            span.set(**_usage_attrs(merge_usage))
+                        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                            yield _sse("merge", {"text": chunk.choices[0].delta.content})
+            except Exception as e:
+                app.logger.exception("Error en /analyze/multi (consolidación)")
+                yield _sse("error", {"ok": False, "error": f"Error interno: {str(e)}"})
+                return
+            timings["merge_ms"] = _elapsed_ms(start)
+
+        timings["total_ms"] = _elapsed_ms(start)
+        print(f"[MULTI] {len(answers)}/{len(entities)} entidades, retrieval {timings['retrieval_ms']} ms, "
+              f"primera {timings.get('first_entity_ms')} ms, total {timings['total_ms']} ms")
+        yield _sse("done", {
+            "ok": True,
+            "entities": len(answers),
+            "failed": len(entities) - len(answers),
+            "usage": usage,
+            "timings": timings,
+        })
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """
+    Recibe un PDF y encola su ingesta. Responde 202 con el trabajo; al
+    terminar, las preguntas usan su `kb_id` en /analyze.
+    """
+    file = request.files.get("pdf")
+    if not file or not file.filename:
+        return jsonify({"ok": False, "error": "Sube un PDF"}), 400
+    if not allowed_file(file.filename):
+        return jsonify({"ok": False, "error": "Formato no permitido (solo .pdf)"}), 400
+    try:
+        job = submit_upload_job(file)
+    except QueueFullError as e:
+        response = jsonify({"ok": False, "error": f"{e}, intenta de nuevo en unos minutos"})
+        response.headers["Retry-After"] = "30"
+        return response, 429
+    return jsonify({"ok": True, **job.to_dict()}), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str):
+    """Etapa, porcentaje y ETA de un trabajo de ingesta."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Trabajo no encontrado"}), 404
+    return jsonify({"ok": True, **job.to_dict()}), 200
+
+
 @app.route("/rebuild-sura", methods=["POST"])
 def rebuild_sura():
-    """Endpoint para reconstruir la base de conocimiento de Sura."""
+    """
+    Endpoint para reconstruir la base de conocimiento de Sura. Solo se embeben
+    los chunks nuevos o modificados respecto de la versión guardada.
+    """
     try:
         if not SURA_PDF_PATH.exists():
             return jsonify({"ok": False, "error": "Archivo de Sura no encontrado"}), 404
         
-        sura_kb.build_from_pdf(str(SURA_PDF_PATH), force_rebuild=True)
-        return jsonify({"ok": True, "message": f"Base reconstruida con {len(sura_kb.chunks)} chunks"}), 200
+        if not _load_kb("sura", sura_kb, SURA_PDF_PATH, force_rebuild=True):
+            return jsonify({"ok": False, "error": kb_status["sura"]["error"]}), 500
+        status = kb_status["sura"]
+        return jsonify({
+            "ok": True,
+            "message": f"Base reconstruida con {len(sura_kb.chunks)} chunks",
+            "chunks": status["chunks"],
+            **status["rebuild"],
+            "seconds": status["seconds"],
+        }), 200
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
-    
+
+
+@app.route("/financials/<key>", methods=["GET"])
+def financials(key: str):
+    """Partidas de los estados financieros y ratios de una KB: "sura", un preset o el kb_id de una subida."""
+    kb = sura_kb if key == "sura" else kb_registry.get(key) or get_upload_kb(key)
+    if kb is None or not kb.chunks:
+        return jsonify({"ok": False, "error": f"Base de conocimiento '{key}' no encontrada"}), 404
+    table = kb.financials or FinancialTable([], [], np.empty((0, 0)))
+    return jsonify({"ok": True, "kb": kb.name, "metadata": kb.metadata, **table.to_dict()}), 200
+
+
+@app.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    """Contadores de las cachés del proceso (aciertos, fallos, tamaño)."""
+    return jsonify({
+        "ok": True,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "query_cache": query_cache.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+    }), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Métricas en formato Prometheus: duración por etapa y endpoint, tokens y llamadas a la API."""
+    return Response(telemetry.render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: el proceso responde, sin importar el estado de las KBs."""
+    return jsonify({"ok": True, "status": "alive"}), 200
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: 200 cuando terminó la carga inicial y la KB de Sura está disponible."""
+    ready = _kb_ready.is_set() and bool(sura_kb.chunks)
+    return jsonify({
+        "ok": ready,
+        "ready": ready,
+        "warmup_started": _kb_warmup_started,
+        "warmup_finished": _kb_ready.is_set(),
+        "kbs": kb_status,
+        "ingest": ingest_jobs.stats(),
+        "upstream": upstream.stats(),
+    }), (200 if ready else 503)
 
 
 if __name__ == "__main__":
+    # Con el reloader de debug, solo el proceso hijo (WERKZEUG_RUN_MAIN) sirve peticiones
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_kb_warmup()
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,187 @@
+# asgi.py
+"""
+Servidor ASGI de la app: /analyze asíncrono, todo lo demás con Flask.
+
+POST /analyze sobre un preset o un kb_id (sin PDF en el formulario) se
+atiende en el event loop con app.analyze_async: el embedding de la pregunta
+y la completion van por AsyncOpenAI (async_upstream.py) y las búsquedas en
+ambas KBs corren a la vez. Una petición esperando al modelo no ocupa un
+hilo, así que un proceso sostiene tantas como permita UPSTREAM_CONCURRENCY.
+
+El resto de las rutas (la UI, /analyze con PDF, /analyze/stream,
+/analyze/multi, /uploads, /metrics...) pasan a la app Flask de siempre, que
+corre en un pool de WSGI_THREADS hilos; las respuestas en stream (SSE) se
+envían chunk a chunk.
+
+Uso:
+    uvicorn asgi:application --port 5000
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from werkzeug.formparser import parse_form_data
+
+import app as sura_app
+import telemetry
+
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+_wsgi_pool = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+def _header(scope: Dict, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def _environ(scope: Dict, body: bytes) -> Dict:
+    """Environ WSGI de una petición HTTP ASGI con el cuerpo ya leído."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for key, value in scope.get("headers", []):
+        name = key.decode("latin-1").upper().replace("-", "_")
+        if name == "CONTENT_LENGTH":
+            continue
+        name = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        value = value.decode("latin-1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def _read_body(receive, limit: int) -> bytes:
+    """Cuerpo completo de la petición; ValueError si supera `limit` bytes."""
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        size += len(chunks[-1])
+        if size > limit:
+            raise ValueError("cuerpo demasiado grande")
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_json(send, status: int, payload: Dict, headers: List[Tuple[bytes, bytes]] = ()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _wsgi(scope: Dict, body: bytes, send):
+    """Atiende la petición con la app Flask en un hilo del pool, reenviando cada chunk de la respuesta."""
+    loop = asyncio.get_running_loop()
+
+    def send_from_thread(message: Dict):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        def send_start():
+            if started.get("sent"):
+                return
+            send_from_thread({"type": "http.response.start", "status": started["status"],
+                              "headers": started["headers"]})
+            started["sent"] = True
+
+        result = sura_app.app(_environ(scope, body), start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    send_start()
+                    send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+            send_start()
+            send_from_thread({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    await loop.run_in_executor(_wsgi_pool, run)
+
+
+async def _analyze(scope: Dict, form, files, send):
+    """POST /analyze sin PDF: espera de KBs, traza con X-Request-ID y app.analyze_async."""
+    sura_app.start_kb_warmup()
+    if not await asyncio.to_thread(sura_app.kbs_ready):
+        await _send_json(send, 503, {"ok": False, "error": sura_app.KB_LOADING_ERROR}, [(b"retry-after", b"5")])
+        return
+    token = telemetry.start_trace("analyze", sura_app.valid_request_id(_header(scope, b"x-request-id")))
+    status = 500
+    try:
+        payload, status = await sura_app.analyze_async(form, files)
+        trace = telemetry.current_trace()
+        headers = [(b"x-request-id", trace.id.encode())] if trace is not None else []
+        await _send_json(send, status, payload, headers)
+    finally:
+        telemetry.finish_trace(token, status=status)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            sura_app.start_kb_warmup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await sura_app.upstream.aclose()
+            _wsgi_pool.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return None
+
+    limit = sura_app.app.config["MAX_CONTENT_LENGTH"]
+    try:
+        body = await _read_body(receive, limit)
+    except ValueError:
+        await _send_json(send, 413, {"ok": False, "error": "El archivo supera el tamaño máximo permitido"})
+        return None
+
+    if scope["method"] == "POST" and scope["path"].rstrip("/") == "/analyze":
+        _, form, files = await asyncio.to_thread(parse_form_data, _environ(scope, body))
+        pdf = files.get("pdf")
+        if not (pdf and pdf.filename):
+            return await _analyze(scope, form, files, send)
+    return await _wsgi(scope, body, send)
@@ -0,0 +1,162 @@
+# async_upstream.py
+"""
+Llamadas asíncronas a OpenAI (embeddings de preguntas y chat) para el camino
+ASGI de /analyze (asgi.py).
+
+- Un AsyncOpenAI por event loop, con su pool de conexiones HTTP acotado y
+  keep-alive (UPSTREAM_MAX_CONNECTIONS, UPSTREAM_KEEPALIVE); el SDK no
+  reintenta por su cuenta.
+- Un semáforo global (UPSTREAM_CONCURRENCY) limita cuántas llamadas hay en
+  vuelo a la vez en el proceso; el resto espera su turno sin ocupar hilos.
+- Cada etapa tiene su plazo (EMBED_TIMEOUT, COMPLETION_TIMEOUT) que cubre la
+  espera del semáforo, los reintentos y la llamada; si se vence se lanza
+  UpstreamTimeoutError.
+- Reintentos acotados (UPSTREAM_MAX_RETRIES) de 429/5xx/errores de conexión,
+  con el mismo backoff exponencial + jitter (y Retry-After) que la ingesta.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import openai
+from openai import AsyncOpenAI
+
+from embedding_pipeline import is_retryable, retry_delay
+from embedding_providers import usage_tokens
+
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "64"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", str(UPSTREAM_CONCURRENCY)))
+UPSTREAM_KEEPALIVE = int(os.getenv("UPSTREAM_KEEPALIVE", str(UPSTREAM_MAX_CONNECTIONS)))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "10"))
+COMPLETION_TIMEOUT = float(os.getenv("COMPLETION_TIMEOUT", "120"))
+
+T = TypeVar("T")
+
+
+class UpstreamTimeoutError(TimeoutError):
+    """Una etapa (embed, completion) no terminó dentro de su plazo."""
+
+    def __init__(self, stage: str, seconds: float):
+        super().__init__(f"La etapa '{stage}' superó su plazo de {seconds:g}s")
+        self.stage = stage
+        self.seconds = seconds
+
+
+class AsyncUpstream:
+    """Cliente asíncrono compartido con límite de concurrencia, plazos y reintentos."""
+
+    def __init__(self, api_key: Optional[str] = None, concurrency: int = UPSTREAM_CONCURRENCY,
+                 max_connections: int = UPSTREAM_MAX_CONNECTIONS, keepalive: int = UPSTREAM_KEEPALIVE,
+                 max_retries: int = UPSTREAM_MAX_RETRIES):
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.max_connections = max_connections
+        self.keepalive = keepalive
+        self.max_retries = max_retries
+        self.calls = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self._loop = None
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    def _bind(self):
+        """Cliente y semáforo del event loop actual (se crean con la primera llamada)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._loop is not loop:
+                # httpx.Limits sin importar httpx: es dependencia del SDK y este lo reexporta
+                limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+                    max_connections=self.max_connections, max_keepalive_connections=self.keepalive,
+                )
+                self._client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    max_retries=0,
+                    http_client=openai.DefaultAsyncHttpxClient(
+                        limits=limits,
+                        timeout=openai.Timeout(COMPLETION_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+                    ),
+                )
+                self._semaphore = asyncio.Semaphore(self.concurrency)
+                self._loop = loop
+            return self._client, self._semaphore
+
+    async def call(self, stage: str, fn: Callable[[AsyncOpenAI], Awaitable[T]], timeout: float) -> T:
+        """`fn(cliente)` con turno en el semáforo, reintentos y un plazo total de `timeout` segundos."""
+        client, semaphore = self._bind()
+        try:
+            return await asyncio.wait_for(self._attempts(client, semaphore, fn), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise UpstreamTimeoutError(stage, timeout) from None
+
+    async def _attempts(self, client: AsyncOpenAI, semaphore: asyncio.Semaphore,
+                        fn: Callable[[AsyncOpenAI], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            self.waiting += 1
+            try:
+                await semaphore.acquire()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.calls += 1
+            try:
+                return await fn(client)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self.errors += 1
+                    raise
+                error = e
+            finally:
+                self.in_flight -= 1
+                semaphore.release()
+            # La espera del backoff no ocupa un turno del semáforo
+            self.retries += 1
+            await asyncio.sleep(retry_delay(error, attempt))
+            attempt += 1
+
+    async def embed(self, text: str, model: str,
+                    dimensions: Optional[int] = None) -> Tuple[Sequence[float], int]:
+        """(embedding, tokens) de una pregunta, como OpenAIEmbeddingProvider.embed_query_usage."""
+        extra = {"dimensions": dimensions} if dimensions else {}
+        response = await self.call(
+            "embed",
+            lambda client: client.embeddings.create(input=[text.replace("\n", " ")], model=model, **extra),
+            EMBED_TIMEOUT,
+        )
+        return response.data[0].embedding, usage_tokens(response)
+
+    async def chat(self, model: str, messages: List[Dict[str, str]], **kwargs):
+        """Chat completion sin stream; devuelve la respuesta del SDK."""
+        return await self.call(
+            "completion",
+            lambda client: client.chat.completions.create(model=model, messages=messages, **kwargs),
+            COMPLETION_TIMEOUT,
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+        self._client = self._semaphore = self._loop = None
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_connections": self.max_connections,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
@@ -0,0 +1,87 @@
+"""
+Benchmark de la caché de respuestas de /analyze contra el servidor falso de
+OpenAI: recorre las preguntas etiquetadas (benchmarks/data/questions.json)
+tres veces y reporta latencia, llamadas al modelo, tasa de aciertos y tokens
+ahorrados.
+
+  1. en frío       todas son fallos: se llama al modelo y se guarda la respuesta
+  2. repetidas     mismas preguntas, mismos fragmentos: aciertos exactos
+  3. reformateadas otras mayúsculas y espacios: la clave normaliza la pregunta
+
+La caché se crea en un directorio temporal; no toca embeddings/.
+
+Uso:
+    python benchmarks/bench_answer_cache.py
+    python benchmarks/bench_answer_cache.py --first-token-latency 2.0 --answer-tokens 600
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+QUESTIONS = Path(__file__).resolve().parent / "data" / "questions.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--first-token-latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=0.01, first_token_latency=args.first_token_latency,
+                              token_latency=args.token_latency, answer_tokens=args.answer_tokens).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["EMBEDDING_CACHE"] = "0"
+
+    import app as sura_app
+    from answer_cache import AnswerCache
+
+    for key in ("sura_rd_2024", "mex_038_2024_sim"):
+        kb = sura_app.KnowledgeBase(f"preset_{key}")
+        kb.load()
+        sura_app.kb_registry[key] = kb
+    sura_app.sura_kb = sura_app.kb_registry["sura_rd_2024"]
+    sura_app._kb_warmup_started = True
+    sura_app._kb_ready.set()
+
+    questions = [q["question"] for q in json.loads(QUESTIONS.read_text(encoding="utf-8"))]
+    http = sura_app.app.test_client()
+    with tempfile.TemporaryDirectory() as tmp:
+        sura_app.answer_cache = AnswerCache(Path(tmp) / "answer_cache.sqlite3")
+        rounds = [
+            ("en frío", questions),
+            ("repetidas", questions),
+            ("reformateadas", [f"  {q.upper()}  " for q in questions]),
+        ]
+        for label, batch in rounds:
+            chats = server.chats
+            latencies, cached = [], 0
+            for question in batch:
+                start = time.perf_counter()
+                payload = http.post("/analyze", data={"question": question, "preset_key": "mex_038_2024_sim"}).get_json()
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert payload["ok"], payload
+                cached += payload["cached"]
+            print(f"{label:>13} | {len(batch)} preguntas | {cached:2d} desde caché | "
+                  f"{server.chats - chats:2d} llamadas al modelo | "
+                  f"p50 {statistics.median(latencies):7.1f} ms, máx {max(latencies):7.1f} ms")
+        stats = sura_app.answer_cache.stats()
+        print(f"hit rate {stats['hit_rate']:.2f} | {stats['hits']} aciertos, {stats['misses']} fallos | "
+              f"{stats['saved_tokens']} tokens ahorrados | {stats['entries']} entradas")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Prueba de carga de /analyze: camino síncrono (Flask + OpenAI) frente al
+camino asíncrono (asgi.py + AsyncOpenAI), en un solo proceso.
+
+Contra el servidor falso de OpenAI, con latencias parecidas a las reales
+(embedding de la pregunta y completion de varios cientos de ms). Se
+construyen dos KBs de prueba desde los PDFs de mini/ y cada petición lleva
+una pregunta distinta, con la caché de respuestas desactivada, para que
+todas recorran el camino completo: embedding, búsqueda en ambas KBs,
+prompt y completion. El servidor falso corre en otro proceso para que su
+CPU y su GIL no cuenten contra el camino medido; además de req/s se
+reporta el CPU de este proceso por petición, que es el techo cuando la
+concurrencia deja de ser el límite.
+
+- sync: `--concurrency` hilos, cada uno con su petición en vuelo, como un
+  servidor WSGI con ese número de hilos (gunicorn --threads, flask threaded).
+- async: la aplicación ASGI con `--concurrency` peticiones en vuelo en un
+  solo event loop.
+
+Uso:
+    python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --concurrency 16 64 256 --requests 512
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlencode
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+DEFAULT_PDFS = [ROOT / "mini" / "sura-EEFF-2024-4t-Mini.pdf", ROOT / "mini" / "SIM_MEX_2024.pdf"]
+QUESTIONS = [
+    "¿Cómo se reconocen los ingresos por primas?",
+    "¿Qué se considera efectivo y equivalentes de efectivo?",
+    "Políticas de arrendamientos NIIF 16",
+    "¿Cómo se miden las reservas técnicas de seguros?",
+]
+
+
+def question(i: int) -> str:
+    return f"{QUESTIONS[i % len(QUESTIONS)]} (consulta {i})"
+
+
+def start_fake_server(args):
+    """Servidor falso de OpenAI en otro proceso; devuelve (proceso, base_url)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve().parent / "fake_openai.py"), "--port", str(port),
+         "--latency", str(args.embed_latency), "--first-token-latency", str(args.first_token_latency),
+         "--token-latency", str(args.token_latency)],
+        stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.1):
+            break
+        time.sleep(0.1)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def summary(name: str, concurrency: int, elapsed: float, cpu: float, latencies, statuses, threads: int) -> str:
+    latencies = sorted(latencies)
+    ok = sum(status == 200 for status in statuses)
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+    return (f"{name:>5} | {concurrency:4d} en vuelo | {ok / elapsed:7.1f} req/s | "
+            f"p50 {statistics.median(latencies):6.2f}s | p95 {p95:6.2f}s | "
+            f"CPU {cpu * 1000 / max(ok, 1):5.1f} ms/petición | errores {len(statuses) - ok:3d} | hilos {threads:4d}")
+
+
+def run_sync(app_module, concurrency: int, requests: int, offset: int):
+    local = threading.local()
+    peak = [threading.active_count()]
+
+    def one(i: int):
+        if not hasattr(local, "client"):
+            local.client = app_module.app.test_client()
+        start = time.perf_counter()
+        response = local.client.post("/analyze", data={"question": question(offset + i), "preset_key": "bench"})
+        peak[0] = max(peak[0], threading.active_count())
+        return time.perf_counter() - start, response.status_code
+
+    start, cpu = time.perf_counter(), time.process_time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    return elapsed, cpu, [r[0] for r in results], [r[1] for r in results], peak[0]
+
+
+async def _asgi_post(application, body: bytes):
+    """Una petición POST /analyze a la aplicación ASGI; devuelve el status."""
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/analyze", "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/x-www-form-urlencoded"),
+                    (b"content-length", str(len(body)).encode())],
+        "server": ("127.0.0.1", 5000), "client": ("127.0.0.1", 40000),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.Event().wait()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def run_async(app_module, application, concurrency: int, requests: int, offset: int):
+    async def main():
+        limit = asyncio.Semaphore(concurrency)
+        peak = threading.active_count()
+
+        async def one(i: int):
+            nonlocal peak
+            body = urlencode({"question": question(offset + i), "preset_key": "bench"}).encode()
+            async with limit:
+                start = time.perf_counter()
+                status = await _asgi_post(application, body)
+                peak = max(peak, threading.active_count())
+                return time.perf_counter() - start, status
+
+        start, cpu = time.perf_counter(), time.process_time()
+        results = await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+        # Cada corrida tiene su event loop: el cliente se cierra con el suyo
+        await app_module.upstream.aclose()
+        return elapsed, cpu, [r[0] for r in results], [r[1] for r in results], peak
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=Path, nargs=2, default=DEFAULT_PDFS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--requests", type=int, default=0, help="Peticiones por corrida (0 = 4 x concurrencia)")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Segundos por embedding")
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="Segundos hasta el primer token")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Segundos por token de respuesta")
+    parser.add_argument("--upstream-concurrency", type=int, default=256, help="UPSTREAM_CONCURRENCY del camino async")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(args)
+    workdir = Path(tempfile.mkdtemp(prefix="bench_async_"))
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "sk-fake",
+        "ANSWER_CACHE": "0",
+        "TRACE_LOG": "",
+        "UPSTREAM_CONCURRENCY": str(args.upstream_concurrency),
+    })
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+        import asgi
+
+        app.sura_kb.path = workdir / "sura"
+        app.sura_kb.build_from_pdf(str(args.pdfs[0]), force_rebuild=True)
+        other = app.KnowledgeBase("bench")
+        other.path = workdir / "bench"
+        other.build_from_pdf(str(args.pdfs[1]), force_rebuild=True)
+        app.kb_registry["bench"] = other
+        # Las KBs ya están listas: sin warm-up de las KBs reales
+        app._kb_warmup_started = True
+        app._kb_ready.set()
+    per_request = args.embed_latency + args.first_token_latency + args.token_latency * 200
+    print(f"KBs: {len(app.sura_kb.chunks)} / {len(other.chunks)} chunks; "
+          f"latencia del proveedor ~{per_request:.2f}s por petición (embedding + completion)")
+
+    offset = 0
+    for concurrency in args.concurrency:
+        requests = args.requests or concurrency * 4
+        for name in ("sync", "async"):
+            with contextlib.redirect_stdout(io.StringIO()):
+                if name == "sync":
+                    result = run_sync(app, concurrency, requests, offset)
+                else:
+                    result = run_async(app, asgi.application, concurrency, requests, offset)
+            offset += requests
+            print(summary(name, concurrency, *result))
+    print(f"Cliente async: {app.upstream.stats()}")
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark del chunker: versión original (decode + recodificar cada ventana y
+recortar la lista de tokens) frente a chunking.chunk_document.
+Verifica además que ambos produzcan exactamente los mismos chunks.
+
+Uso:
+    python benchmarks/bench_chunking.py
+    python benchmarks/bench_chunking.py sura-EEFF-2024-4t.pdf mini/*.pdf --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app import read_pdf_text  # noqa: E402
+from chunking import CHUNK_MODEL, chunk_document, get_encoder  # noqa: E402
+
+DEFAULT_PDFS = [ROOT / "sura-EEFF-2024-4t.pdf", *sorted((ROOT / "mini").glob("*.pdf"))]
+
+
+def legacy_chunk_tokens(document: str, token_limit: int = 500):
+    """Copia de chunk_tokens original (con el tokenizador ya resuelto)."""
+    enc = get_encoder(CHUNK_MODEL)
+    chunks = []
+    tokens = enc.encode(document, disallowed_special=())
+    while tokens:
+        chunk = tokens[:token_limit]
+        chunk_text = enc.decode(chunk)
+        last_punctuation = max(
+            chunk_text.rfind("."),
+            chunk_text.rfind("?"),
+            chunk_text.rfind("!"),
+            chunk_text.rfind("\n"),
+        )
+        if last_punctuation != -1 and len(tokens) > token_limit:
+            chunk_text = chunk_text[:last_punctuation + 1]
+        cleaned_text = chunk_text.replace("\n", " ").strip()
+        if cleaned_text and (not cleaned_text.isspace()):
+            chunks.append(cleaned_text)
+        tokens = tokens[len(enc.encode(chunk_text, disallowed_special=())):]
+    return chunks
+
+
+def best_of(fn, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", type=Path, default=DEFAULT_PDFS)
+    parser.add_argument("--token-limit", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    enc = get_encoder(CHUNK_MODEL)
+    print(f"Tokenizador: {enc.name}")
+    for pdf in args.pdfs:
+        text = read_pdf_text(str(pdf))[0]
+        n_tokens = len(enc.encode(text, disallowed_special=()))
+        legacy_s, legacy = best_of(lambda: legacy_chunk_tokens(text, args.token_limit), args.repeat)
+        new_s, new = best_of(lambda: chunk_document(text, args.token_limit), args.repeat)
+        same = legacy == [c.text for c in new]
+        print(
+            f"{pdf.name[:45]:<45} {n_tokens:>8} tokens {len(new):>5} chunks | "
+            f"anterior {legacy_s * 1000:8.1f} ms | nuevo {new_s * 1000:8.1f} ms "
+            f"({n_tokens / new_s / 1e6:.2f} M tokens/s) | x{legacy_s / new_s:.1f} | "
+            f"{'idénticos' if same else 'DIFERENTES'}"
+        )
+        if not same:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
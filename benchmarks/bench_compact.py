@@ -0,0 +1,82 @@
+"""
+Benchmark de vectores compactos (CompactIndex, KB_INDEX=compact): memoria,
+latencia y recall@k frente a la búsqueda exacta en float32 (FlatIndex).
+
+Para cada combinación de dimensiones (las primeras N, renormalizadas, como
+`dimensions` en text-embedding-3) y cuantización (float32 o int8 con escala
+por vector), con y sin re-puntuar en float32 los mejores candidatos.
+
+Por defecto usa las KBs guardadas en embeddings/ (los presets) y, como
+consultas, chunks de cada KB con ruido; además una KB sintética grande para
+ver memoria y latencia a escala. El recall de los recortes de dimensiones
+solo es representativo en las KBs reales: text-embedding-3 concentra la
+información en las primeras componentes y los vectores sintéticos no.
+
+Uso:
+    python benchmarks/bench_compact.py
+    python benchmarks/bench_compact.py --kbs embeddings/preset_sura_rd_2024 --dims 0 768 256 --rescore 50
+    python benchmarks/bench_compact.py --kbs --sizes 100000
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_index import from_kb, latency_ms, recall, synthetic  # noqa: E402
+from kb_store import is_kb_dir  # noqa: E402
+from vector_index import CompactIndex, FlatIndex  # noqa: E402
+
+DEFAULT_KBS = sorted(path for path in (ROOT / "embeddings").iterdir() if is_kb_dir(path))
+
+
+def run(label, matrix, queries, top_k, dims, quantizations, rescore):
+    flat = FlatIndex(matrix)
+    flat_ms, exact = latency_ms(flat, queries, top_k)
+    full_bytes = matrix.nbytes
+    print(f"{label}: {matrix.shape[0]} vectores, dim {matrix.shape[1]}, {len(queries)} consultas")
+    print(f"  {'float32 ' + str(matrix.shape[1]):>22} | {full_bytes / matrix.shape[0]:6.0f} B/chunk "
+          f"{full_bytes / 2**20:8.2f} MB | recall@{top_k} 1.000 | {flat_ms:7.3f} ms/consulta")
+    for dim in dims:
+        for quantization in quantizations:
+            if dim in (0, matrix.shape[1]) and quantization == "none":
+                continue
+            index = CompactIndex.build(matrix, dim=dim, quantization=quantization)
+            nbytes = index.stats()["bytes"]
+            dtype = "int8" if quantization == "int8" else "float32"
+            for candidates in sorted({0, rescore}):
+                index.rescore = candidates
+                ms, approx = latency_ms(index, queries, top_k)
+                name = f"{dtype} {index.dim}" + (f" +{candidates}" if candidates else "")
+                print(f"  {name:>22} | {nbytes / matrix.shape[0]:6.0f} B/chunk {nbytes / 2**20:8.2f} MB "
+                      f"(x{full_bytes / nbytes:4.1f}) | recall@{top_k} {recall(exact, approx, top_k):.3f} | "
+                      f"{ms:7.3f} ms/consulta")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kbs", type=Path, nargs="*", default=DEFAULT_KBS, help="Directorios de KBs guardadas")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[50_000], help="KBs sintéticas (0 = ninguna)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=8, help="Por defecto CONTEXT_CANDIDATES")
+    parser.add_argument("--dims", type=int, nargs="+", default=[0, 512, 256], help="0 = todas las dimensiones")
+    parser.add_argument("--quantization", nargs="+", default=["none", "int8"], choices=CompactIndex.QUANTIZATIONS)
+    parser.add_argument("--rescore", type=int, default=32, help="Candidatos re-puntuados en float32 (0 = no)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for path in args.kbs:
+        matrix, queries = from_kb(path, args.queries, rng)
+        run(path.name, matrix, queries, args.top_k, args.dims, args.quantization, args.rescore)
+    for size in args.sizes:
+        if size > 0:
+            matrix, queries = synthetic(size, args.queries, rng)
+            run("sintético", matrix, queries, args.top_k, args.dims, args.quantization, args.rescore)
+
+
+if __name__ == "__main__":
+    main()
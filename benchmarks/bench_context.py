@@ -0,0 +1,107 @@
+"""
+Compara el contexto de los prompts de comparación: los 3 primeros fragmentos
+(como antes) frente al empaquetado con presupuesto de tokens de
+context_packing.py (más candidatos, sin duplicados, MMR), sobre las preguntas
+etiquetadas de benchmarks/data/questions.json.
+
+Por configuración se reporta: tokens de contexto por lado (tiktoken),
+grounding (preguntas con al menos un fragmento relevante en el contexto),
+fragmentos relevantes distintos por pregunta, duplicados descartados y el
+tiempo de empaquetar.
+
+Por defecto usa búsqueda lexical (sin red); --fake o una OPENAI_API_KEY real
+permiten dense/hybrid (con --fake el grounding de dense no significa nada).
+
+Uso:
+    python benchmarks/bench_context.py
+    python benchmarks/bench_context.py --budgets 600 1200 2000 --candidates 8 12
+    OPENAI_API_KEY=sk-... python benchmarks/bench_context.py --mode hybrid
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+QUESTIONS = Path(__file__).resolve().parent / "data" / "questions.json"
+
+
+def measure(label, questions, kbs, retrieve, labels_of, count_tokens, pack=None):
+    tokens, grounded, relevant_count, duplicates, pack_ms = [], 0, [], 0, []
+    for q in questions:
+        results = retrieve(q)
+        if pack is not None:
+            start = time.perf_counter()
+            results, stats = pack(results)
+            pack_ms.append((time.perf_counter() - start) * 1000)
+            duplicates += stats.duplicates
+        texts = [chunk for chunk, _ in results]
+        tokens.append(sum(count_tokens(t) for t in texts))
+        hits = [t for t in texts if any(label in labels_of(t) for label in q["labels"])]
+        grounded += bool(hits)
+        relevant_count.append(len(set(hits)))
+    line = (f"{label:>26} | tokens {statistics.mean(tokens):7.1f} (máx {max(tokens):5d}) | "
+            f"grounding {grounded / len(questions):.2f} | relevantes {statistics.mean(relevant_count):.2f}")
+    if pack is not None:
+        line += f" | duplicados {duplicates:3d} | empaquetar {statistics.mean(pack_ms):6.2f} ms"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="lexical", help="lexical, dense o hybrid")
+    parser.add_argument("--questions", type=Path, default=QUESTIONS)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[600, 1200, 2000])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[8])
+    parser.add_argument("--fake", action="store_true", help="Embeddings del servidor falso (sin red)")
+    args = parser.parse_args()
+
+    if args.fake:
+        from fake_openai import FakeOpenAIServer
+        server = FakeOpenAIServer(latency=0.0).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+    import app as sura_app
+    from context_packing import pack_context
+    from lexical_index import fold
+
+    questions = json.loads(args.questions.read_text(encoding="utf-8"))
+    for q in questions:
+        q["labels"] = [fold(label) for label in q["relevant"]]
+    kbs = {}
+    for key in sorted({q["kb"] for q in questions}):
+        kb = sura_app.KnowledgeBase(f"preset_{key}")
+        kb.load()
+        kbs[key] = kb
+    vectors = {}
+    if args.mode != "lexical":
+        vectors = {q["question"]: sura_app.get_query_embedding(q["question"]) for q in questions}
+
+    count_tokens = sura_app.count_prompt_tokens
+    print(f"{len(questions)} preguntas, modo {args.mode}, "
+          f"{', '.join(f'{k} ({len(kb.chunks)} chunks)' for k, kb in kbs.items())}")
+
+    def retriever(top_k):
+        def retrieve(q):
+            return kbs[q["kb"]].search(q["question"], top_k=top_k, mode=args.mode,
+                                       query_vector=vectors.get(q["question"]))
+        return retrieve
+
+    measure("top-3 (antes)", questions, kbs, retriever(3), fold, count_tokens)
+    for candidates in args.candidates:
+        for budget in args.budgets:
+            measure(f"{candidates} cand. / {budget} tokens", questions, kbs, retriever(candidates), fold,
+                    count_tokens, pack=lambda results, b=budget: pack_context(results, budget=b,
+                                                                              count_tokens=count_tokens))
+
+
+if __name__ == "__main__":
+    main()
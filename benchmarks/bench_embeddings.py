@@ -0,0 +1,66 @@
+"""
+Benchmark de generación de embeddings contra el servidor falso local:
+una llamada por chunk (camino anterior) frente a embed_texts (lotes + hilos).
+
+Uso:
+    python benchmarks/bench_embeddings.py
+    python benchmarks/bench_embeddings.py --chunks 2000 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from openai import OpenAI
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from embedding_pipeline import embed_texts  # noqa: E402
+from fake_openai import FakeOpenAIServer, fake_embedding  # noqa: E402
+
+
+def synthetic_chunks(n: int):
+    words = ("activos pasivos patrimonio arrendamiento efectivo equivalentes reserva "
+             "siniestros primas costo amortizado deterioro instrumentos financieros").split()
+    rng = np.random.default_rng(0)
+    return [f"Chunk {i}: " + " ".join(rng.choice(words, size=350)) for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia por petición (s)")
+    parser.add_argument("--per-input-latency", type=float, default=0.001, help="Latencia por input (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-inputs", type=int, default=128)
+    parser.add_argument("--sequential-max", type=int, default=200,
+                        help="Chunks a medir con el camino de una llamada por chunk")
+    args = parser.parse_args()
+
+    texts = synthetic_chunks(args.chunks)
+    with FakeOpenAIServer(latency=args.latency, per_input_latency=args.per_input_latency,
+                          error_rate=args.error_rate) as server:
+        client = OpenAI(api_key="sk-fake", base_url=server.base_url)
+
+        sample = texts[:args.sequential_max]
+        start = time.perf_counter()
+        for text in sample:
+            client.embeddings.create(input=[text], model="text-embedding-3-small")
+        seq_rate = len(sample) / (time.perf_counter() - start)
+        print(f"Una llamada por chunk : {seq_rate:8.1f} chunks/s ({len(sample)} chunks)")
+
+        embeddings, stats = embed_texts(client, texts, max_workers=args.workers, max_inputs=args.batch_inputs)
+        print(f"embed_texts           : {stats.chunks_per_sec:8.1f} chunks/s "
+              f"({stats.chunks} chunks, {stats.batches} lotes, {stats.retries} reintentos, "
+              f"{server.errors} errores inyectados) -> x{stats.chunks_per_sec / seq_rate:.1f}")
+
+        # El orden debe coincidir con el de los chunks
+        expected = np.stack([fake_embedding(t.replace("\n", " ")) for t in texts])
+        assert np.allclose(np.asarray(embeddings, dtype=np.float32), expected, atol=1e-6), "Orden incorrecto"
+        print("Orden de embeddings verificado")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Extracción de tablas financieras y ratios locales (financial_tables.py).
+
+Por PDF: tiempo de extraer las partidas del texto (sin contar la lectura del
+PDF), partidas y períodos encontrados, y tiempo de calcular todos los ratios.
+Para las preguntas de ratios se compara la respuesta local con lo que
+costaría el camino del modelo: tokens del prompt de comparación que se
+dejan de enviar (la latencia de la completion no se puede medir sin red).
+
+Uso:
+    python benchmarks/bench_financials.py
+    python benchmarks/bench_financials.py "EEFF_cargados/Final EFs Seguros Sura S. A 2024 Dominicana.pdf"
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from financial_tables import FinancialTable, ratio_table  # noqa: E402
+from pdf_extract import extract_pdf_text  # noqa: E402
+
+DEFAULT_PDFS = [ROOT / "sura-EEFF-2024-4t.pdf", *sorted((ROOT / "EEFF_cargados").glob("*.pdf"))]
+QUESTIONS = [
+    "¿Cuál es el ROE?",
+    "¿Cuál es el nivel de endeudamiento (Debt/Equity)?",
+    "Compara los indicadores financieros de ambas entidades",
+]
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", type=Path, default=DEFAULT_PDFS)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tables = {}
+    for pdf in args.pdfs:
+        text = extract_pdf_text(pdf)
+        table, extract_ms = timed(lambda: FinancialTable.from_text(text, default_year=2024), args.repeat)
+        _, ratios_ms = timed(table.ratios, args.repeat * 20)
+        tables[pdf.stem] = table
+        print(f"{pdf.name[:40]:>40} | {len(text):8d} caracteres | extracción {extract_ms:7.1f} ms | "
+              f"{len(table.items):2d} partidas x {len(table.periods)} períodos | ratios {ratios_ms:.3f} ms")
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    from app import count_prompt_tokens, generate_comparison_prompt
+    from chunking import chunk_document
+
+    sura_name = args.pdfs[0].stem
+    for name, table in list(tables.items())[1:]:
+        if table.empty:
+            continue
+        for question in QUESTIONS:
+            answer, answer_ms = timed(lambda: ratio_table(question, [("SURA", tables[sura_name]), (name, table)]),
+                                      args.repeat)
+            if answer is None:
+                print(f"  {question[:50]:>50} | sin ratios: responde el modelo")
+                continue
+            # El prompt que se hubiera enviado: 3 chunks por lado, como antes del empaquetado
+            sample = [c.text for c in chunk_document(extract_pdf_text(args.pdfs[0]))[:3]]
+            prompt = generate_comparison_prompt(sample, sample, question,
+                                                {"empresa": name, "pais": "-", "anio": 2024})
+            print(f"  {question[:50]:>50} | local {answer_ms:6.2f} ms | "
+                  f"~{count_prompt_tokens(prompt)} tokens de prompt evitados")
+
+
+if __name__ == "__main__":
+    main()
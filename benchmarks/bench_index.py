@@ -0,0 +1,103 @@
+"""
+Benchmark de índices: recall@k y latencia de IVFIndex frente a la búsqueda
+exacta (FlatIndex), para varios valores de nprobe.
+
+Por defecto usa vectores sintéticos agrupados (los embeddings reales de
+documentos forman grupos por tema); con --kb se usan los vectores de una KB
+guardada y, como consultas, chunks de la misma KB con ruido.
+
+Uso:
+    python benchmarks/bench_index.py
+    python benchmarks/bench_index.py --sizes 20000 100000 --nprobe 1 4 8 16 32
+    python benchmarks/bench_index.py --kb embeddings/preset_mex_038_2024_sim --nlist 8
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from kb_store import load_kb_dir  # noqa: E402
+from vector_index import FlatIndex, IVFIndex  # noqa: E402
+
+DIM = 1536
+
+
+def normalize(matrix):
+    return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+
+def synthetic(size, n_queries, rng, topics=None, spread=0.6):
+    """Mezcla de `topics` grupos en la esfera; las consultas caen cerca de algún grupo."""
+    topics = topics or max(8, size // 200)
+    centers = normalize(rng.standard_normal((topics, DIM), dtype=np.float32))
+    labels = rng.integers(0, topics, size)
+    matrix = normalize(centers[labels] + spread / np.sqrt(DIM) * rng.standard_normal((size, DIM), dtype=np.float32))
+    q_labels = rng.integers(0, topics, n_queries)
+    queries = normalize(centers[q_labels] + spread / np.sqrt(DIM) * rng.standard_normal((n_queries, DIM), dtype=np.float32))
+    return matrix, queries
+
+
+def from_kb(path, n_queries, rng, noise=0.3):
+    _, matrix, _ = load_kb_dir(path)
+    matrix = np.asarray(matrix)
+    picks = rng.integers(0, matrix.shape[0], n_queries)
+    queries = normalize(matrix[picks] + noise / np.sqrt(matrix.shape[1]) * rng.standard_normal((n_queries, matrix.shape[1]), dtype=np.float32))
+    return matrix, queries
+
+
+def latency_ms(index, queries, top_k, **kwargs):
+    start = time.perf_counter()
+    results = [index.search(q[None, :], top_k, **kwargs)[0] for q in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def recall(exact, approx, top_k):
+    hits = sum(len(set(e[0][:top_k]) & set(a[0][:top_k])) for e, a in zip(exact, approx))
+    return hits / (len(exact) * top_k)
+
+
+def run(label, matrix, queries, top_k, nprobes, nlist):
+    flat = FlatIndex(matrix)
+    flat_ms, exact = latency_ms(flat, queries, top_k)
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(matrix, nlist=nlist)
+    build_s = time.perf_counter() - start
+
+    print(f"{label}: {matrix.shape[0]} vectores, dim {matrix.shape[1]}, "
+          f"IVF {ivf.nlist} listas construido en {build_s:.1f}s")
+    print(f"  {'exacto':>12} | recall@{top_k} 1.000 | {flat_ms:7.3f} ms/consulta")
+    for nprobe in nprobes:
+        if nprobe > ivf.nlist:
+            continue
+        ivf_ms, approx = latency_ms(ivf, queries, top_k, nprobe=nprobe)
+        print(f"  {'nprobe ' + str(nprobe):>12} | recall@{top_k} {recall(exact, approx, top_k):.3f} | "
+              f"{ivf_ms:7.3f} ms/consulta (x{flat_ms / ivf_ms:.1f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--kb", type=Path, help="Directorio de una KB guardada en lugar de datos sintéticos")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--nlist", type=int, default=0, help="0 = automático (~sqrt(n))")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.kb:
+        matrix, queries = from_kb(args.kb, args.queries, rng)
+        run(args.kb.name, matrix, queries, args.top_k, args.nprobe, args.nlist)
+        return
+    for size in args.sizes:
+        matrix, queries = synthetic(size, args.queries, rng)
+        run("sintético", matrix, queries, args.top_k, args.nprobe, args.nlist)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark de /analyze/multi frente a llamar /analyze una vez por entidad,
+contra el servidor falso de OpenAI: tiempo hasta la primera entidad, tiempo
+total y llamadas al modelo, con y sin la pasada de consolidación.
+
+Solo hay dos presets guardados en embeddings/: uno hace de "Sura" y el otro
+se registra bajo varias claves para simular N entidades. La caché de
+respuestas se desactiva para que cada comparación llegue al modelo.
+
+Uso:
+    python benchmarks/bench_multi.py
+    python benchmarks/bench_multi.py --entities 8 --concurrency 4 --first-token-latency 1.0
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_stream import parse_sse  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--first-token-latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=0.01, first_token_latency=args.first_token_latency,
+                              token_latency=args.token_latency, answer_tokens=args.answer_tokens).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["EMBEDDING_CACHE"] = "0"
+    os.environ["ANSWER_CACHE"] = "0"
+    os.environ["MULTI_CONCURRENCY"] = str(args.concurrency)
+
+    import app as sura_app
+
+    sura_app.sura_kb = sura_app.KnowledgeBase("preset_sura_rd_2024")
+    sura_app.sura_kb.load()
+    keys = [f"entidad_{i + 1}" for i in range(args.entities)]
+    for key in keys:
+        kb = sura_app.KnowledgeBase("preset_mex_038_2024_sim")
+        kb.load()
+        sura_app.kb_registry[key] = kb
+    sura_app._kb_warmup_started = True
+    sura_app._kb_ready.set()
+
+    http = sura_app.app.test_client()
+    question = "¿Cómo se reconocen los arrendamientos?"
+
+    chats = server.chats
+    start = time.perf_counter()
+    first = None
+    for key in keys:
+        assert http.post("/analyze", data={"question": question, "preset_key": key}).get_json()["ok"]
+        first = first or time.perf_counter()
+    sequential_s = time.perf_counter() - start
+    print(f"{'secuencial':>16} | {args.entities} entidades | primera {(first - start) * 1000:7.0f} ms | "
+          f"total {sequential_s * 1000:7.0f} ms | {server.chats - chats} llamadas al modelo")
+
+    for merge in ("0", "1"):
+        chats = server.chats
+        start = time.perf_counter()
+        first, done, entities = None, None, 0
+        response = http.post("/analyze/multi", data={"question": question, "preset_key": ",".join(keys),
+                                                     "merge": merge}, buffered=False)
+        for event, data, at in parse_sse(response.response):
+            if event == "entity":
+                assert data["ok"], data
+                first = first or at
+                entities += 1
+            elif event == "done":
+                done = data
+            elif event == "error":
+                raise SystemExit(f"error en el stream: {data}")
+        total_s = time.perf_counter() - start
+        label = "multi + merge" if merge == "1" else "multi"
+        print(f"{label:>16} | {entities} entidades | primera {(first - start) * 1000:7.0f} ms | "
+              f"total {total_s * 1000:7.0f} ms | {server.chats - chats} llamadas al modelo | "
+              f"{total_s / sequential_s:.2f}x del secuencial | {done['usage']['total_tokens']} tokens")
+    print(f"  concurrencia {args.concurrency}; la consolidación agrega una llamada con stream al final")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark de extracción de texto: lectura serial original con PyPDF2 frente a
+pdf_extract (pool de procesos en frío y caché de páginas en caliente).
+Verifica que el texto resultante sea idéntico.
+
+Uso:
+    python benchmarks/bench_pdf.py
+    python benchmarks/bench_pdf.py --workers 4 sura-EEFF-2024-4t.pdf
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import PyPDF2
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from pdf_extract import EXTRACT_WORKERS, extract_pdf_text  # noqa: E402
+
+DEFAULT_PDFS = [ROOT / "sura-EEFF-2024-4t.pdf", *sorted((ROOT / "mini").glob("*.pdf"))]
+
+
+def legacy_extract(file_path):
+    """Copia de la lectura original de read_pdf_text."""
+    text_parts = []
+    with open(file_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        if getattr(reader, "is_encrypted", False):
+            try:
+                reader.decrypt("")
+            except Exception:
+                pass
+        for page in reader.pages:
+            t = page.extract_text()
+            if t:
+                text_parts.append(t)
+    return "\n".join(text_parts).strip()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", type=Path, default=DEFAULT_PDFS)
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS)
+    args = parser.parse_args()
+
+    print(f"Procesos: {args.workers} (CPUs: {os.cpu_count()})")
+    for pdf in args.pdfs:
+        pages = len(PyPDF2.PdfReader(str(pdf)).pages)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            legacy_s, legacy = timed(lambda: legacy_extract(pdf))
+            cold_s, cold = timed(lambda: extract_pdf_text(pdf, workers=args.workers, cache_dir=Path(cache_dir)))
+            warm_s, warm = timed(lambda: extract_pdf_text(pdf, workers=args.workers, cache_dir=Path(cache_dir)))
+        same = legacy == cold == warm
+        print(
+            f"{pdf.name[:45]:<45} {pages:>4} págs | serial {pages / legacy_s:7.1f} págs/s | "
+            f"pool {pages / cold_s:7.1f} págs/s (x{legacy_s / cold_s:.1f}) | "
+            f"caché {pages / warm_s:9.1f} págs/s (x{legacy_s / warm_s:.0f}) | "
+            f"{'idéntico' if same else 'DIFERENTE'}"
+        )
+        if not same:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Comparación de proveedores de embeddings: throughput de ingesta (chunks/s),
+latencia por pregunta y, para el proveedor local, recall sobre las preguntas
+etiquetadas de benchmarks/data/questions.json.
+
+- local: TF-IDF con hashing + SVD (se ajusta en un directorio temporal).
+- openai: embed_texts contra el servidor falso con latencia configurable
+  (o contra la API real con --real y OPENAI_API_KEY).
+
+Uso:
+    python benchmarks/bench_providers.py
+    python benchmarks/bench_providers.py --latency 0.5 --per-input-latency 0.002
+    OPENAI_API_KEY=sk-... python benchmarks/bench_providers.py --real
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from chunking import chunk_document  # noqa: E402
+from embedding_providers import LocalEmbeddingProvider, OpenAIEmbeddingProvider  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from kb_store import load_kb_dir  # noqa: E402
+from lexical_index import BM25Index, fold, reciprocal_rank_fusion  # noqa: E402
+from pdf_extract import extract_pdf_text  # noqa: E402
+from vector_index import top_k_indices  # noqa: E402
+
+DEFAULT_PDFS = [ROOT / "sura-EEFF-2024-4t.pdf", *sorted((ROOT / "EEFF_cargados").glob("*.pdf"))]
+QUESTIONS = Path(__file__).resolve().parent / "data" / "questions.json"
+
+
+def throughput(label, provider, chunks, questions):
+    start = time.perf_counter()
+    vectors, stats = provider.embed_documents(chunks)
+    ingest_s = time.perf_counter() - start
+    query_ms = []
+    for q in questions:
+        start = time.perf_counter()
+        provider.embed_query(q["question"])
+        query_ms.append((time.perf_counter() - start) * 1000)
+    dim = len(vectors[0])
+    print(f"{label:>8} | {len(chunks)} chunks en {ingest_s:6.2f}s = {len(chunks) / ingest_s:8.1f} chunks/s | "
+          f"{stats.batches} lotes | dim {dim} | pregunta {statistics.median(query_ms):6.2f} ms (p50)")
+
+
+def local_recall(provider, questions, ks=(1, 3, 5)):
+    """Recall de dense e hybrid con vectores locales sobre los chunks de los presets guardados."""
+    kbs = {}
+    for key in sorted({q["kb"] for q in questions}):
+        chunks, _, _ = load_kb_dir(ROOT / "embeddings" / f"preset_{key}")
+        chunks = list(chunks)
+        vectors, _ = provider.embed_documents(chunks)
+        kbs[key] = (chunks, np.asarray(vectors, dtype=np.float32), BM25Index.build(chunks))
+
+    for mode in ("dense", "hybrid"):
+        hits = {k: 0 for k in ks}
+        for q in questions:
+            chunks, matrix, lexical = kbs[q["kb"]]
+            scores = matrix @ np.asarray(provider.embed_query(q["question"]), dtype=np.float32)
+            dense_ids = top_k_indices(scores, 20)
+            if mode == "dense":
+                ranking = list(dense_ids)
+            else:
+                lexical_ids, _ = lexical.search(q["question"], 20)
+                ranking = [doc for doc, _ in reciprocal_rank_fusion([dense_ids, lexical_ids], max(ks))]
+            labels = [fold(label) for label in q["relevant"]]
+            relevant = [any(label in fold(chunks[i]) for label in labels) for i in ranking[:max(ks)]]
+            first = relevant.index(True) + 1 if True in relevant else None
+            for k in ks:
+                hits[k] += bool(first and first <= k)
+        recall = " ".join(f"R@{k} {hits[k] / len(questions):.2f}" for k in ks)
+        print(f"  local {mode:>6} | {recall}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", type=Path, default=DEFAULT_PDFS)
+    parser.add_argument("--latency", type=float, default=0.3, help="Segundos por petición del servidor falso")
+    parser.add_argument("--per-input-latency", type=float, default=0.001)
+    parser.add_argument("--real", action="store_true", help="Usar la API real de OpenAI")
+    args = parser.parse_args()
+
+    chunks = []
+    for pdf in args.pdfs:
+        chunks.extend(c.text for c in chunk_document(extract_pdf_text(pdf)))
+    questions = json.loads(QUESTIONS.read_text(encoding="utf-8"))
+    print(f"{len(chunks)} chunks de {len(args.pdfs)} PDFs")
+
+    from openai import OpenAI
+    with tempfile.TemporaryDirectory() as model_dir:
+        local = LocalEmbeddingProvider(model_dir=Path(model_dir))
+        local.fit(chunks)  # ajuste único; aparte del throughput de ingesta
+        throughput("local", local, chunks, questions)
+        local_recall(local, questions)
+
+    if args.real:
+        throughput("openai", OpenAIEmbeddingProvider(OpenAI()), chunks, questions)
+    else:
+        with FakeOpenAIServer(latency=args.latency, per_input_latency=args.per_input_latency) as server:
+            client = OpenAI(api_key="sk-fake", base_url=server.base_url)
+            throughput("openai*", OpenAIEmbeddingProvider(client), chunks, questions)
+        print(f"  * servidor falso: {args.latency}s por petición + {args.per_input_latency}s por input")
+
+
+if __name__ == "__main__":
+    main()
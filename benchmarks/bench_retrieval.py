@@ -0,0 +1,100 @@
+"""
+Compara los modos de búsqueda (lexical, dense, hybrid) sobre un conjunto
+etiquetado de preguntas de los EEFF precargados (benchmarks/data/questions.json).
+
+Un chunk es relevante si contiene alguna de las frases de `relevant` (sin
+tildes ni mayúsculas). Se reporta recall@k (preguntas con al menos un chunk
+relevante entre los k primeros), MRR y latencia de búsqueda; para dense e
+hybrid se reporta aparte el tiempo de embeber las preguntas.
+
+Los modos dense e hybrid necesitan la API de embeddings (OPENAI_API_KEY). Con
+--fake se usan embeddings del servidor falso: sirve para medir latencia, pero
+el recall de esos modos no significa nada.
+
+Uso:
+    python benchmarks/bench_retrieval.py                    # solo lexical si no hay API key
+    OPENAI_API_KEY=sk-... python benchmarks/bench_retrieval.py
+    python benchmarks/bench_retrieval.py --fake --modes lexical dense hybrid
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+QUESTIONS = Path(__file__).resolve().parent / "data" / "questions.json"
+HAS_API_KEY = bool(os.getenv("OPENAI_API_KEY"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=None, help="lexical, dense, hybrid")
+    parser.add_argument("--questions", type=Path, default=QUESTIONS)
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--repeat", type=int, default=20, help="Repeticiones para medir la latencia")
+    parser.add_argument("--fake", action="store_true", help="Embeddings del servidor falso (sin red)")
+    args = parser.parse_args()
+
+    if args.fake:
+        from fake_openai import FakeOpenAIServer
+        server = FakeOpenAIServer(latency=0.0).start()
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ["OPENAI_API_KEY"] = "sk-fake"
+    modes = args.modes or (["lexical", "dense", "hybrid"] if HAS_API_KEY or args.fake else ["lexical"])
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+    import app as sura_app
+    from lexical_index import fold
+
+    questions = json.loads(args.questions.read_text(encoding="utf-8"))
+    kbs = {}
+    for key in sorted({q["kb"] for q in questions}):
+        kb = sura_app.KnowledgeBase(f"preset_{key}")
+        kb.load()
+        kbs[key] = kb
+    top_k = max(args.ks)
+
+    print(f"{len(questions)} preguntas sobre {', '.join(f'{k} ({len(kb.chunks)} chunks)' for k, kb in kbs.items())}")
+    if not HAS_API_KEY and not args.fake:
+        print("Sin OPENAI_API_KEY: solo modo lexical (usa --fake para medir latencia de dense/hybrid)")
+
+    # Las preguntas se embeben una sola vez (es la llamada de red que lexical evita)
+    vectors = {}
+    if any(mode != "lexical" for mode in modes):
+        start = time.perf_counter()
+        vectors = {q["question"]: sura_app.get_query_embedding(q["question"]) for q in questions}
+        print(f"Embedding de las preguntas: {(time.perf_counter() - start) * 1000 / len(questions):.1f} ms por pregunta")
+
+    for mode in modes:
+        hits = {k: 0 for k in args.ks}
+        reciprocal_ranks = []
+        search_ms = []
+        for q in questions:
+            kb = kbs[q["kb"]]
+            labels = [fold(label) for label in q["relevant"]]
+            vector = vectors.get(q["question"]) if mode != "lexical" else None
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                results = kb.search(q["question"], top_k=top_k, mode=mode, query_vector=vector)
+            search_ms.append((time.perf_counter() - start) / args.repeat * 1000)
+
+            relevant = [any(label in fold(chunk) for label in labels) for chunk, _ in results]
+            first = relevant.index(True) + 1 if True in relevant else None
+            reciprocal_ranks.append(1 / first if first else 0.0)
+            for k in args.ks:
+                hits[k] += bool(first and first <= k)
+
+        recall = " ".join(f"R@{k} {hits[k] / len(questions):.2f}" for k in args.ks)
+        print(f"{mode:>8} | {recall} | MRR {statistics.mean(reciprocal_ranks):.2f} | "
+              f"búsqueda {statistics.mean(search_ms):.3f} ms (p50 {statistics.median(search_ms):.3f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark de búsqueda: implementación anterior (cosine_similarity por chunk)
+frente a la matriz float32 normalizada de KnowledgeBase.
+
+Uso:
+    python benchmarks/bench_search.py
+    python benchmarks/bench_search.py --sizes 1000 10000 --queries 20
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from app import KnowledgeBase  # noqa: E402
+
+DIM = 1536
+# Listas únicas para el camino anterior; se reutilizan para no ocupar GBs de floats
+LEGACY_UNIQUE_ROWS = 1000
+
+
+def legacy_search(chunks, embeddings, query_embedding, top_k):
+    """Copia del search_similar original (sin la llamada de embedding)."""
+    similarities = []
+    for embedding in embeddings:
+        sim = cosine_similarity(
+            np.array(query_embedding).reshape(1, -1),
+            np.array(embedding).reshape(1, -1)
+        )[0][0]
+        similarities.append(sim)
+    top_indices = np.argsort(similarities)[-top_k:][::-1]
+    return [(chunks[idx], similarities[idx]) for idx in top_indices]
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(size, n_queries, top_k, legacy_max, rng):
+    base = rng.standard_normal((min(size, LEGACY_UNIQUE_ROWS), DIM)).astype(np.float32)
+    matrix = base[np.arange(size) % base.shape[0]] + 0.01 * rng.standard_normal((size, DIM), dtype=np.float32)
+    queries = rng.standard_normal((n_queries, DIM)).astype(np.float32)
+
+    kb = KnowledgeBase(f"bench_{size}")
+    kb.chunks = [f"chunk {i}" for i in range(size)]
+    t0 = time.perf_counter()
+    kb.set_vectors(matrix)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    q = queries[0]
+    new_ms = timed(lambda: kb.search_by_vector(q, top_k), 20)
+    many_ms = timed(lambda: kb.search_many(queries, top_k), 5) / n_queries
+
+    legacy_ms = None
+    if size <= legacy_max:
+        legacy_rows = [row.tolist() for row in matrix[:LEGACY_UNIQUE_ROWS]]
+        legacy_embeddings = [legacy_rows[i % len(legacy_rows)] for i in range(size)]
+        query_list = q.tolist()
+        legacy_ms = timed(lambda: legacy_search(kb.chunks, legacy_embeddings, query_list, top_k), 1)
+
+    print(
+        f"{size:>7} chunks | build {build_ms:8.1f} ms | "
+        f"anterior {('%10.1f ms' % legacy_ms) if legacy_ms is not None else '      n/a   '} | "
+        f"matriz {new_ms:7.3f} ms | search_many {many_ms:7.3f} ms/consulta"
+        + (f" | x{legacy_ms / new_ms:,.0f}" if legacy_ms else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=16, help="Consultas para search_many")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--legacy-max", type=int, default=100_000,
+                        help="Tamaño máximo en el que se mide el camino anterior (es lento)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        run(size, args.queries, args.top_k, args.legacy_max, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark de /analyze/stream frente a /analyze contra el servidor falso de
+OpenAI: tiempo hasta el primer token (visto por el cliente y reportado en el
+evento `done`) y tiempo total. Verifica además que la respuesta reconstruida
+a partir de los eventos `delta` sea idéntica a la de /analyze.
+
+No escribe KBs ni cachés: usa dos presets ya guardados en embeddings/.
+
+Uso:
+    python benchmarks/bench_stream.py
+    python benchmarks/bench_stream.py --first-token-latency 1.0 --token-latency 0.02 --answer-tokens 400
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def parse_sse(lines):
+    """Convierte el cuerpo SSE (iterable de bytes) en pares (evento, datos, instante)."""
+    buffer = b""
+    for piece in lines:
+        buffer += piece
+        while b"\n\n" in buffer:
+            raw, buffer = buffer.split(b"\n\n", 1)
+            event, data = "message", ""
+            for line in raw.decode("utf-8").splitlines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    data += line[6:]
+            yield event, json.loads(data), time.perf_counter()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--first-token-latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--preset", default="sura_rd_2024")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=0.01, first_token_latency=args.first_token_latency,
+                              token_latency=args.token_latency, answer_tokens=args.answer_tokens).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["EMBEDDING_CACHE"] = "0"
+    os.environ["ANSWER_CACHE"] = "0"  # cada petición debe llegar al modelo
+
+    import app as sura_app
+
+    # KBs de solo lectura: un preset hace de "Sura" y otro de entidad a comparar
+    for key in ("sura_rd_2024", "mex_038_2024_sim"):
+        kb = sura_app.KnowledgeBase(f"preset_{key}")
+        kb.load()
+        sura_app.kb_registry[key] = kb
+    sura_app.sura_kb = sura_app.kb_registry["mex_038_2024_sim"]
+    sura_app._kb_warmup_started = True
+    sura_app._kb_ready.set()
+
+    http = sura_app.app.test_client()
+    form = {"question": "¿Cómo se reconocen los arrendamientos?", "preset_key": args.preset}
+
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        blocking = http.post("/analyze", data=form).get_json()
+        blocking_s = time.perf_counter() - start
+        assert blocking["ok"], blocking
+
+        start = time.perf_counter()
+        response = http.post("/analyze/stream", data=form, buffered=False)
+        assert response.mimetype == "text/event-stream", response.data
+        first_token = None
+        text = []
+        events = []
+        for event, data, at in parse_sse(response.response):
+            events.append(event)
+            if event == "delta":
+                first_token = first_token or at
+                text.append(data["text"])
+            elif event == "done":
+                done = data
+            elif event == "error":
+                raise SystemExit(f"error en el stream: {data}")
+        stream_s = time.perf_counter() - start
+
+        assert events[0] == "retrieval" and events[-1] == "done", events[:3]
+        same = "".join(text) == blocking["answer"]
+        print(
+            f"#{i + 1} /analyze total {blocking_s * 1000:7.0f} ms | "
+            f"/analyze/stream primer token {(first_token - start) * 1000:6.0f} ms "
+            f"(servidor {done['timings']['ttft_ms']:6.0f} ms), total {stream_s * 1000:7.0f} ms | "
+            f"{done['usage']['completion_tokens']} tokens | {'idéntico' if same else 'DIFERENTE'}"
+        )
+        if not same:
+            sys.exit(1)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Servidor local que imita las APIs de embeddings y chat completions de
+OpenAI, para pruebas y benchmarks sin red ni cuota.
+
+- Vectores deterministas por texto (mismo texto -> mismo vector).
+- Latencia configurable por petición y por input.
+- Chat completions con respuesta fija en markdown, con o sin `stream=True`
+  (SSE como la API real, incluido el chunk final de `usage`), con latencia
+  configurable hasta el primer token y entre tokens.
+- Tasa de errores configurable (429 con Retry-After o 500).
+
+Uso como proceso aparte:
+    python benchmarks/fake_openai.py --port 8001 --latency 0.2 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=sk-fake python app.py
+
+Uso desde Python:
+    with FakeOpenAIServer(latency=0.1) as server:
+        client = OpenAI(api_key="sk-fake", base_url=server.base_url)
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def fake_embedding(text: str, dim: int = 1536) -> np.ndarray:
+    """Vector unitario float32 determinista a partir del hash del texto."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+    # Keep-alive como la API real, para que el pool de conexiones del cliente cuente
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _maybe_fail(self) -> bool:
+        fake = self.server.fake
+        if fake.error_rate <= 0 or fake.rng.random() >= fake.error_rate:
+            return False
+        with fake.lock:
+            fake.errors += 1
+        if fake.rng.random() < 0.5:
+            self._send_json(429, {"error": {"message": "Rate limit (fake)", "type": "rate_limit_error"}},
+                            headers={"Retry-After": "0"})
+        else:
+            self._send_json(500, {"error": {"message": "Internal error (fake)", "type": "server_error"}})
+        return True
+
+    def do_POST(self):
+        fake = self.server.fake
+        with fake.lock:
+            fake.requests += 1
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            return self._embeddings(self._read_json())
+        if path.endswith("/chat/completions"):
+            return self._chat(self._read_json())
+        self._send_json(404, {"error": {"message": f"Ruta no soportada: {self.path}"}})
+
+    def _embeddings(self, body: dict):
+        fake = self.server.fake
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(fake.latency + fake.per_input_latency * len(inputs))
+        if self._maybe_fail():
+            return
+        dim = int(body.get("dimensions") or fake.dim)
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, dim)
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii") if as_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        with fake.lock:
+            fake.inputs += len(inputs)
+        # La API real no garantiza el orden; se devuelve invertido para ejercitar el reordenamiento
+        data.reverse()
+        tokens = sum(len(t.split()) for t in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+    def _chat(self, body: dict):
+        fake = self.server.fake
+        time.sleep(fake.first_token_latency)
+        if self._maybe_fail():
+            return
+        with fake.lock:
+            fake.chats += 1
+        tokens = fake_answer_tokens(fake.answer_tokens)
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages") or [])
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model")}
+
+        if not body.get("stream"):
+            time.sleep(fake.token_latency * len(tokens))
+            return self._send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def send(payload):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        chunk = {**base, "object": "chat.completion.chunk"}
+        send({**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+        for token in tokens:
+            send({**chunk, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+            time.sleep(fake.token_latency)
+        send({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send({**chunk, "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+FAKE_ANSWER = (
+    "## Comparación (respuesta simulada)\n\n"
+    "| Aspecto | SURA | Otra entidad |\n"
+    "|---|---|---|\n"
+    "| Efectivo y equivalentes | Alineado | Alineado |\n"
+    "| Arrendamientos | NIIF 16 | NIIF 16 |\n\n"
+    "**Conclusión:** las políticas son consistentes en los puntos revisados. "
+)
+
+
+class _Server(ThreadingHTTPServer):
+    # Cola de conexiones amplia: las pruebas de carga abren cientos a la vez
+    request_queue_size = 1024
+
+
+def fake_answer_tokens(count: int) -> list:
+    """Respuesta fija en markdown partida en `count` tokens (palabras con su espacio)."""
+    words = re.findall(r"\S+\s*", FAKE_ANSWER)
+    filler = re.findall(r"\S+\s*", "Texto de relleno para simular una respuesta larga del modelo. ")
+    tokens = words[:count]
+    while len(tokens) < count:
+        tokens.append(filler[len(tokens) % len(filler)])
+    return tokens
+
+
+class FakeOpenAIServer:
+    """Servidor falso en un hilo de fondo; `base_url` sirve para `OpenAI(base_url=...)`."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 per_input_latency: float = 0.0, error_rate: float = 0.0, dim: int = 1536, seed: int = 0,
+                 first_token_latency: float = 0.3, token_latency: float = 0.01, answer_tokens: int = 200):
+        self.latency = latency
+        self.per_input_latency = per_input_latency
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.dim = dim
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.inputs = 0
+        self.errors = 0
+        self.chats = 0
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos por petición")
+    parser.add_argument("--per-input-latency", type=float, default=0.0, help="Segundos extra por input")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que fallan (429/500)")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="Segundos hasta el primer token (chat)")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Segundos entre tokens (chat)")
+    parser.add_argument("--answer-tokens", type=int, default=200, help="Tokens de cada respuesta (chat)")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, args.latency, args.per_input_latency, args.error_rate, args.dim,
+                              first_token_latency=args.first_token_latency, token_latency=args.token_latency,
+                              answer_tokens=args.answer_tokens)
+    print(f"Fake OpenAI escuchando en {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
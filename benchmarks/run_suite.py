@@ -0,0 +1,333 @@
+"""
+Suite de benchmarks reproducible, sin red: todo corre contra el servidor falso
+de OpenAI (embeddings y chat) con latencia y tasa de errores configurables.
+
+Mide, sobre los PDFs de mini/ y un PDF sintético grande (páginas de mini/
+repetidas hasta --synthetic-pages):
+
+  pdf       read_pdf_text en frío (sin caché de páginas): páginas/s
+  chunking  chunk_tokens: tokens/s
+  build     KnowledgeBase.build_from_pdf de punta a punta: chunks/s
+  search    search_similar frente al tamaño de la KB (embedding de la pregunta en caché)
+  analyze   /analyze por HTTP con N clientes concurrentes: p50/p95/p99 y peticiones/s
+
+Los resultados se guardan en JSON (commit, configuración y métricas) para
+comparar entre commits; --compare marca las métricas que empeoraron más que
+--threshold y termina con código 1 si hay alguna.
+
+Uso:
+    python benchmarks/run_suite.py
+    python benchmarks/run_suite.py --only pdf chunking --output base.json
+    python benchmarks/run_suite.py --error-rate 0.05 --concurrency 1 8 32
+    python benchmarks/run_suite.py --compare base.json benchmarks/results/20261017-120000-abc1234.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai import FakeOpenAIServer  # noqa: E402
+
+MINI_PDFS = sorted((ROOT / "mini").glob("*.pdf"))
+QUESTIONS = Path(__file__).resolve().parent / "data" / "questions.json"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SECTIONS = ("pdf", "chunking", "build", "search", "analyze")
+# Sufijo de la métrica -> True si más alto es mejor
+DIRECTIONS = {"_per_sec": True, "_rps": True, "_ms": False, "_seconds": False}
+
+
+def percentiles(values_ms):
+    values = np.asarray(values_ms, dtype=np.float64)
+    return {
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silencia los prints de progreso de la app mientras se mide."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def git_revision():
+    def run(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": run("rev-parse", "--short", "HEAD") or None,
+            "dirty": bool(run("status", "--porcelain", "--untracked-files=no"))}
+
+
+def synthetic_pdf(sources, pages: int, path: Path) -> Path:
+    """PDF grande con las páginas de `sources` repetidas en ciclo."""
+    import PyPDF2
+
+    all_pages = [page for source in sources for page in PyPDF2.PdfReader(str(source)).pages]
+    writer = PyPDF2.PdfWriter()
+    for i in range(pages):
+        writer.add_page(all_pages[i % len(all_pages)])
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+def bench_pdf(sura_app, pdfs, repeat):
+    from pdf_extract import _page_count
+
+    results, texts = {}, {}
+    for pdf in pdfs:
+        pages = _page_count(str(pdf))
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with quiet():
+                text, _, _, _ = sura_app.read_pdf_text(str(pdf), cache_dir=None)
+            times.append(time.perf_counter() - start)
+        texts[pdf.name] = text
+        seconds = min(times)
+        results[pdf.name] = {"pages": pages, "best_seconds": round(seconds, 4),
+                             "pages_per_sec": round(pages / seconds, 2)}
+        print(f"  pdf      {pdf.name[:40]:<40} {pages:5d} páginas  {pages / seconds:9.1f} páginas/s")
+    return results, texts
+
+
+def bench_chunking(sura_app, texts, repeat):
+    from chunking import CHUNK_MODEL, get_encoder
+
+    encoder = get_encoder(CHUNK_MODEL)
+    results = {}
+    for name, text in texts.items():
+        tokens = len(encoder.encode(text, disallowed_special=()))
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            chunks = sura_app.chunk_tokens(text, token_limit=500)
+            times.append(time.perf_counter() - start)
+        seconds = min(times)
+        results[name] = {"tokens": tokens, "chunks": len(chunks), "best_seconds": round(seconds, 4),
+                         "tokens_per_sec": round(tokens / seconds, 1)}
+        print(f"  chunking {name[:40]:<40} {tokens:7d} tokens  {tokens / seconds:11.0f} tokens/s")
+    return results
+
+
+def bench_build(sura_app, pdfs, workdir: Path):
+    results = {}
+    for pdf in pdfs:
+        kb = sura_app.KnowledgeBase(f"bench_{pdf.stem}")
+        kb.path = workdir / "kbs" / kb.name
+        start = time.perf_counter()
+        with quiet():
+            kb.build_from_pdf(str(pdf), force_rebuild=True)
+        seconds = time.perf_counter() - start
+        results[pdf.name] = {"chunks": len(kb.chunks), "seconds": round(seconds, 3),
+                             "chunks_per_sec": round(len(kb.chunks) / seconds, 2)}
+        print(f"  build    {pdf.name[:40]:<40} {len(kb.chunks):5d} chunks   {len(kb.chunks) / seconds:9.1f} chunks/s")
+    return results
+
+
+def bench_search(sura_app, sizes, queries, dim):
+    rng = np.random.default_rng(0)
+    question = "¿Qué se considera efectivo y equivalentes de efectivo?"
+    sura_app.get_query_embedding(question)  # a la caché: se mide solo la búsqueda
+    results = {}
+    for size in sizes:
+        kb = sura_app.KnowledgeBase(f"bench_search_{size}")
+        kb.chunks = [f"chunk {i}" for i in range(size)]
+        kb.set_vectors(rng.standard_normal((size, dim), dtype=np.float32))
+        kb.search_similar(question, top_k=5)
+        times = []
+        for _ in range(queries):
+            start = time.perf_counter()
+            kb.search_similar(question, top_k=5)
+            times.append((time.perf_counter() - start) * 1000)
+        results[f"n{size}"] = {"chunks": size, **percentiles(times)}
+        print(f"  search   {size:>8} chunks  p50 {results[f'n{size}']['p50_ms']:8.3f} ms  "
+              f"p95 {results[f'n{size}']['p95_ms']:8.3f} ms")
+    return results
+
+
+def bench_analyze(sura_app, concurrency_levels, n_requests):
+    import requests
+    from werkzeug.serving import make_server
+
+    # Presets guardados: uno hace de "Sura" y el otro de entidad a comparar
+    for key in ("sura_rd_2024", "mex_038_2024_sim"):
+        kb = sura_app.KnowledgeBase(f"preset_{key}")
+        kb.load()
+        sura_app.kb_registry[key] = kb
+    sura_app.sura_kb = sura_app.kb_registry["sura_rd_2024"]
+    sura_app._kb_warmup_started = True
+    sura_app._kb_ready.set()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # sin una línea por petición
+    httpd = make_server("127.0.0.1", 0, sura_app.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{httpd.server_port}/analyze"
+    questions = [q["question"] for q in json.loads(QUESTIONS.read_text(encoding="utf-8"))]
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, "session", None) or requests.Session()
+        local.session = session
+        start = time.perf_counter()
+        response = session.post(url, data={"question": questions[i % len(questions)],
+                                           "preset_key": "mex_038_2024_sim"}, timeout=300)
+        ok = response.status_code == 200 and response.json().get("ok")
+        return (time.perf_counter() - start) * 1000, bool(ok)
+
+    results = {}
+    try:
+        for concurrency in concurrency_levels:
+            start = time.perf_counter()
+            with quiet(), ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(one, range(n_requests)))
+            wall = time.perf_counter() - start
+            latencies = [ms for ms, ok in outcomes if ok]
+            errors = sum(not ok for _, ok in outcomes)
+            results[f"c{concurrency}"] = {
+                "concurrency": concurrency,
+                "requests": n_requests,
+                "errors": errors,
+                **(percentiles(latencies) if latencies else {}),
+                "throughput_rps": round(len(latencies) / wall, 3),
+            }
+            r = results[f"c{concurrency}"]
+            print(f"  analyze  concurrencia {concurrency:3d}  p50 {r.get('p50_ms', 0):8.1f} ms  "
+                  f"p95 {r.get('p95_ms', 0):8.1f} ms  p99 {r.get('p99_ms', 0):8.1f} ms  "
+                  f"{r['throughput_rps']:6.2f} pet/s  {errors} errores")
+    finally:
+        httpd.shutdown()
+    return results
+
+
+def flatten(results, prefix=""):
+    """Métricas comparables ("seccion.clave.metrica" -> valor) de un resultado."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and any(name.endswith(s) for s in DIRECTIONS):
+            flat[name] = float(value)
+    return flat
+
+
+def compare(base_path: Path, new_path: Path, threshold: float) -> int:
+    base = json.loads(base_path.read_text(encoding="utf-8"))
+    new = json.loads(new_path.read_text(encoding="utf-8"))
+    print(f"base {base['meta'].get('commit')} ({base_path.name}) -> nuevo {new['meta'].get('commit')} ({new_path.name})")
+    old_metrics = flatten(base["results"])
+    new_metrics = flatten(new["results"])
+    regressions = 0
+    for name in sorted(old_metrics.keys() & new_metrics.keys()):
+        old, current = old_metrics[name], new_metrics[name]
+        if old == 0:
+            continue
+        higher_is_better = next(better for suffix, better in DIRECTIONS.items() if name.endswith(suffix))
+        change = (current - old) / old
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > threshold:
+            flag, regressions = "  <-- REGRESIÓN", regressions + 1
+        elif worse < -threshold:
+            flag = "  mejora"
+        print(f"{name:<70} {old:12.3f} -> {current:12.3f} ({change:+7.1%}){flag}")
+    print(f"{regressions} regresiones (umbral {threshold:.0%})")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument("--output", type=Path, default=None, help="Por defecto benchmarks/results/<fecha>-<commit>.json")
+    parser.add_argument("--synthetic-pages", type=int, default=300, help="Páginas del PDF sintético (0 = sin él)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de pdf y chunking (se toma la mejor)")
+    parser.add_argument("--search-sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--search-queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=48, help="Peticiones a /analyze por nivel de concurrencia")
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos por petición de embeddings")
+    parser.add_argument("--per-input-latency", type=float, default=0.0005, help="Segundos extra por input embebido")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="Segundos hasta el primer token (chat)")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Segundos entre tokens (chat)")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que fallan (429/500)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("BASE", "NUEVO"))
+    parser.add_argument("--threshold", type=float, default=0.10, help="Empeoramiento relativo tolerado en --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    server = FakeOpenAIServer(latency=args.latency, per_input_latency=args.per_input_latency,
+                              error_rate=args.error_rate, first_token_latency=args.first_token_latency,
+                              token_latency=args.token_latency, answer_tokens=args.answer_tokens).start()
+    workdir = Path(tempfile.mkdtemp(prefix="sura-bench-"))
+    # Sin cachés persistentes: cada corrida parte de cero y no toca embeddings/ ni cache/
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["EMBEDDING_CACHE"] = "0"
+    os.environ["ANSWER_CACHE"] = "0"
+    os.environ["PDF_PAGE_CACHE_DIR"] = str(workdir / "pages")
+
+    import app as sura_app
+
+    pdfs = list(MINI_PDFS)
+    if args.synthetic_pages:
+        pdfs.append(synthetic_pdf(MINI_PDFS, args.synthetic_pages, workdir / f"sintetico_{args.synthetic_pages}p.pdf"))
+
+    meta = {
+        **git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+    }
+    print(f"Suite en {meta['commit']}{' (con cambios)' if meta['dirty'] else ''}: {', '.join(args.only)}")
+    results = {}
+    texts = {}
+    if "pdf" in args.only or "chunking" in args.only:
+        results["pdf"], texts = bench_pdf(sura_app, pdfs, args.repeat)
+        if "pdf" not in args.only:
+            del results["pdf"]
+    if "chunking" in args.only:
+        results["chunking"] = bench_chunking(sura_app, texts, args.repeat)
+    if "build" in args.only:
+        results["build"] = bench_build(sura_app, pdfs, workdir)
+    if "search" in args.only:
+        results["search"] = bench_search(sura_app, args.search_sizes, args.search_queries, server.dim)
+    if "analyze" in args.only:
+        results["analyze"] = bench_analyze(sura_app, args.concurrency, args.requests)
+    server.stop()
+    meta["fake_server"] = {"requests": server.requests, "chats": server.chats, "errors": server.errors}
+
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{meta['commit'] or 'sin-git'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"meta": meta, "results": results}, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
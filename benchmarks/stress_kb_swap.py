@@ -0,0 +1,256 @@
+"""
+Prueba de estrés del intercambio atómico de las KBs (KnowledgeBase / KBSnapshot).
+
+Un hilo reconstruye una KB alternando dos PDFs, igual que /rebuild-sura.
+Mientras tanto, varios hilos buscan sin parar en modo lexical, dense e
+hybrid y verifican que cada respuesta sea coherente:
+- todos los chunks son de una misma versión de la KB;
+- en dense, cada puntaje es el coseno entre la pregunta y el vector de ese chunk.
+
+Además hay procesos aparte que abren la misma KB, como los workers de
+gunicorn. Buscan, la recargan con refresh() cuando cambia en disco y
+reportan cuánta memoria de vectors.npy es compartida: Pss frente a Rss en
+/proc/self/smaps, solo en Linux. Otros procesos la cargan en frío una y otra
+vez (un worker que arranca durante una reconstrucción): ninguna carga puede
+fallar ni mezclar versiones. Al terminar quedan en disco como mucho
+KB_KEEP_VERSIONS versiones.
+
+Sin red: usa los embeddings del servidor falso. Sale con código 1 si hubo
+alguna respuesta incoherente o algún error.
+
+Uso:
+    python benchmarks/stress_kb_swap.py
+    python benchmarks/stress_kb_swap.py --rebuilds 20 --readers 8 --processes 4 --cold-loaders 2
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+DEFAULT_PDFS = [ROOT / "mini" / "sura-EEFF-2024-4t-Mini.pdf", ROOT / "mini" / "SIM_MEX_2024.pdf"]
+QUESTIONS = [
+    "¿Cómo se reconocen los ingresos por primas?",
+    "¿Qué se considera efectivo y equivalentes de efectivo?",
+    "Políticas de arrendamientos NIIF 16",
+    "reservas técnicas de seguros",
+]
+MODES = ("lexical", "dense", "hybrid")
+
+
+def check(results, versions, vectors=None, query=None) -> bool:
+    """Los chunks son de una sola versión y, con `vectors`, los puntajes son los cosenos esperados."""
+    texts = {text for text, _ in results}
+    if not any(texts <= version for version in versions):
+        return False
+    if vectors is not None:
+        return all(abs(float(vectors[text] @ query) - score) < 1e-4 for text, score in results)
+    return True
+
+
+def shared_memory(marker: str):
+    """(Rss, Pss) en KB de los mapeos de vectors.npy bajo `marker`, o None fuera de Linux."""
+    smaps = Path("/proc/self/smaps")
+    if not smaps.exists():
+        return None
+    rss = pss = 0
+    current = False
+    for line in smaps.read_text().splitlines():
+        if not line[:1].isupper() or ":" not in line.split()[0]:
+            current = marker in line and "vectors.npy" in line and "(deleted)" not in line
+        elif current and line.startswith("Rss:"):
+            rss += int(line.split()[1])
+        elif current and line.startswith("Pss:"):
+            pss += int(line.split()[1])
+    return rss, pss
+
+
+def reader_process(kb_path: str, versions, stop_file: str, queries, ready_dir: str):
+    """Worker aparte: busca en la KB, la recarga cuando cambia en disco y mide su memoria compartida."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+
+        kb = app.KnowledgeBase("stress")
+        kb.path = Path(kb_path)
+        kb.load()
+    (Path(ready_dir) / f"ready-{os.getpid()}").touch()
+    searches = inconsistent = reloads = errors = 0
+    while not os.path.exists(stop_file):
+        with contextlib.redirect_stdout(io.StringIO()):
+            reloads += kb.refresh()
+        for question, vector in queries:
+            try:
+                results = kb.search(question, top_k=5, mode="dense", query_vector=vector)
+                inconsistent += not check(results, versions)
+            except Exception:
+                errors += 1
+            searches += 1
+    # Se recorre toda la matriz para que sus páginas estén residentes al medir
+    float(np.asarray(kb.matrix).sum())
+    return {"pid": os.getpid(), "searches": searches, "inconsistent": inconsistent, "errors": errors,
+            "reloads": reloads, "memory": shared_memory(str(Path(kb_path).parent))}
+
+
+def cold_loader_process(kb_path: str, versions, stop_file: str, ready_dir: str):
+    """Worker que arranca una y otra vez: abre la KB desde cero y comprueba que esté completa."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    (Path(ready_dir) / f"ready-{os.getpid()}").touch()
+    loads = inconsistent = 0
+    errors = {}
+    while not os.path.exists(stop_file):
+        kb = app.KnowledgeBase("stress")
+        kb.path = Path(kb_path)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                kb.load()
+            inconsistent += set(kb.chunks) not in versions
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+        loads += 1
+    return {"pid": os.getpid(), "loads": loads, "inconsistent": inconsistent, "errors": errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=Path, nargs=2, default=DEFAULT_PDFS)
+    parser.add_argument("--rebuilds", type=int, default=10)
+    parser.add_argument("--readers", type=int, default=4, help="Hilos de búsqueda en este proceso")
+    parser.add_argument("--processes", type=int, default=2, help="Procesos lectores aparte (0 = ninguno)")
+    parser.add_argument("--cold-loaders", type=int, default=2, help="Procesos que cargan la KB en frío sin parar")
+    args = parser.parse_args()
+
+    from fake_openai import FakeOpenAIServer
+
+    server = FakeOpenAIServer(latency=0.0).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    workdir = Path(tempfile.mkdtemp(prefix="stress_kb_"))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+        import kb_store
+
+        kb = app.KnowledgeBase("stress")
+        kb.path = workdir / "kbs" / "stress"
+        # Referencia de cada versión: chunks y vector de cada chunk
+        versions, vectors = [], {}
+        for pdf in args.pdfs:
+            kb.build_from_pdf(str(pdf), force_rebuild=True)
+            versions.append(set(kb.chunks))
+            vectors.update(zip(kb.chunks, np.asarray(kb.matrix)))
+        queries = []
+        for question in QUESTIONS:
+            vector = np.asarray(app.get_query_embedding(question), dtype=np.float32)
+            queries.append((question, vector / np.linalg.norm(vector)))
+    print(f"KB de prueba: {len(versions[0])} / {len(versions[1])} chunks, {args.rebuilds} reconstrucciones, "
+          f"{args.readers} hilos y {args.processes} procesos lectores")
+
+    stop = threading.Event()
+    counts = {"searches": 0, "inconsistent": 0, "errors": 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def reader():
+        local = {"searches": 0, "inconsistent": 0, "errors": 0}
+        times = []
+        while not stop.is_set():
+            for question, vector in queries:
+                for mode in MODES:
+                    start = time.perf_counter()
+                    try:
+                        results = kb.search(question, top_k=5, mode=mode, query_vector=vector)
+                        ok = check(results, versions, vectors if mode == "dense" else None, vector)
+                        local["inconsistent"] += not ok
+                    except Exception:
+                        local["errors"] += 1
+                    times.append((time.perf_counter() - start) * 1000)
+                    local["searches"] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+            latencies.extend(times)
+
+    stop_file = workdir / "stop"
+    pool = None
+    futures = []
+    cold_futures = []
+    processes = args.processes + args.cold_loaders
+    if processes:
+        pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        futures = [pool.submit(reader_process, str(kb.path), versions, str(stop_file), queries, str(workdir))
+                   for _ in range(args.processes)]
+        cold_futures = [pool.submit(cold_loader_process, str(kb.path), versions, str(stop_file), str(workdir))
+                        for _ in range(args.cold_loaders)]
+        # Las reconstrucciones empiezan cuando todos los procesos abrieron la KB
+        while len(list(workdir.glob("ready-*"))) < processes:
+            time.sleep(0.1)
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+
+    build_times = []
+    start = time.perf_counter()
+    for i in range(args.rebuilds):
+        build_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            kb.build_from_pdf(str(args.pdfs[i % 2]), force_rebuild=True)
+        build_times.append(time.perf_counter() - build_start)
+        # Pausa breve entre reconstrucciones para que los procesos lectores noten cada cambio
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Antes de liberar a los procesos, que siguen mapeando la misma versión
+    parent = shared_memory(str(workdir))
+    stop_file.touch()
+    workers = [future.result() for future in futures]
+    cold = [future.result() for future in cold_futures]
+    if pool is not None:
+        pool.shutdown()
+    server.stop()
+    # Con los demás procesos cerrados, las versiones viejas se pueden borrar todas
+    kb_store.collect_versions(kb.path)
+    on_disk = kb_store.versions(kb.path)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+    print(f"Reconstrucciones: {args.rebuilds} en {elapsed:.1f}s (mediana {np.median(build_times):.2f}s)")
+    print(f"Búsquedas en hilos: {counts['searches']} ({counts['searches'] / elapsed:.0f}/s, p99 {p99:.2f} ms), "
+          f"incoherentes {counts['inconsistent']}, errores {counts['errors']}")
+    bad = counts["inconsistent"] + counts["errors"]
+    for worker in workers:
+        memory = worker["memory"]
+        shared = f"vectors.npy Rss {memory[0]} KB / Pss {memory[1]} KB" if memory else "memoria: n/d"
+        print(f"Proceso {worker['pid']}: {worker['searches']} búsquedas, {worker['reloads']} recargas, "
+              f"incoherentes {worker['inconsistent']}, errores {worker['errors']}, {shared}")
+        bad += worker["inconsistent"] + worker["errors"]
+    if parent:
+        print(f"Este proceso: vectors.npy Rss {parent[0]} KB / Pss {parent[1]} KB")
+    for worker in cold:
+        failed = sum(worker["errors"].values())
+        print(f"Proceso {worker['pid']}: {worker['loads']} cargas en frío, incoherentes {worker['inconsistent']}, "
+              f"fallidas {failed} {worker['errors'] or ''}")
+        bad += worker["inconsistent"] + failed
+    print(f"Versiones en disco al terminar: {len(on_disk)} (KB_KEEP_VERSIONS={kb_store.KEEP_VERSIONS})")
+    bad += len(on_disk) > kb_store.KEEP_VERSIONS
+    print("OK" if bad == 0 else f"FALLÓ: {bad} respuestas incoherentes o con error")
+    return 0 if bad == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# chunking.py
+"""
+División de documentos en chunks por tokens.
+
+El documento se codifica una sola vez; los cortes se buscan sobre los bytes
+de los tokens (offsets acumulados) en lugar de decodificar y recodificar
+cada ventana. Con overlap=0 produce los mismos chunks que la versión
+original de `chunk_tokens`.
+"""
+from __future__ import annotations
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+import tiktoken
+
+CHUNK_MODEL = "gpt-5"
+# Caracteres de corte natural (todos ASCII: nunca forman parte de un carácter multibyte)
+BREAK_BYTES = (b".", b"?", b"!", b"\n")
+
+
+@dataclass
+class Chunk:
+    """Chunk con su posición en el documento original."""
+    text: str
+    start: int         # offset (caracteres) de inicio en el documento
+    end: int           # offset (caracteres) de fin en el documento
+    token_start: int   # índice del primer token del chunk
+    token_end: int     # índice siguiente al último token consumido
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model: str = CHUNK_MODEL):
+    """
+    Tokenizador del modelo, cacheado a nivel de módulo.
+    Si la versión de tiktoken no conoce el modelo, cae a o200k_base / cl100k_base.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except ValueError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def _token_byte_lengths(encoding_name: str) -> np.ndarray:
+    """Longitud en bytes de cada token del vocabulario (se calcula una vez por tokenizador)."""
+    enc = tiktoken.get_encoding(encoding_name)
+    lengths = np.zeros(enc.n_vocab, dtype=np.int64)
+    for token in range(enc.n_vocab):
+        try:
+            lengths[token] = len(enc.decode_single_token_bytes(token))
+        except KeyError:
+            pass
+    return lengths
+
+
+def _token_offsets(enc, document: str, tokens: List[int]):
+    """
+    Devuelve (bytes del documento, offsets en bytes del inicio de cada token).
+    Evita decodificar token por token usando la tabla de longitudes del vocabulario.
+    """
+    cum = np.concatenate(([0], np.cumsum(_token_byte_lengths(enc.name)[tokens])))
+    data = document.encode("utf-8", errors="surrogatepass")
+    if len(data) != cum[-1]:
+        # Texto con caracteres que tiktoken tuvo que reemplazar: usar los bytes reales de los tokens
+        token_bytes = enc.decode_tokens_bytes(tokens)
+        data = b"".join(token_bytes)
+        cum = np.concatenate(([0], np.cumsum([len(b) for b in token_bytes])))
+    return data, cum.tolist()
+
+
+def _char_offsets(data: bytes) -> np.ndarray:
+    """Para cada offset de bytes (0..len), cuántos caracteres UTF-8 empiezan antes."""
+    starts = (np.frombuffer(data, dtype=np.uint8) & 0xC0) != 0x80
+    return np.concatenate(([0], np.cumsum(starts)))
+
+
+def chunk_document(document: str, token_limit: int = 500, overlap: int = 0,
+                   model: str = CHUNK_MODEL) -> List[Chunk]:
+    """
+    Divide el documento en chunks de hasta `token_limit` tokens, cortando en el
+    último punto, signo de interrogación/exclamación o salto de línea de cada ventana.
+    `overlap` repite los últimos N tokens de un chunk al inicio del siguiente.
+    """
+    if overlap < 0 or overlap >= token_limit:
+        raise ValueError("overlap debe estar entre 0 y token_limit - 1")
+
+    enc = get_encoder(model)
+    tokens = enc.encode(document, disallowed_special=())
+    # cum[i] = offset en bytes donde empieza el token i (cum[n] = len(data))
+    data, cum = _token_offsets(enc, document, tokens)
+    chars = _char_offsets(data)
+    n = len(tokens)
+
+    chunks: List[Chunk] = []
+    pos = 0
+    while pos < n:
+        end_tok = min(pos + token_limit, n)
+        b0, b1 = cum[pos], cum[end_tok]
+        window = data[b0:b1]
+        cut = max(window.rfind(c) for c in BREAK_BYTES)
+
+        if cut != -1 and n - pos > token_limit:
+            text_end = b0 + cut + 1
+            # Tokens completos antes del corte; el token partido se recodifica por separado
+            j = bisect_right(cum, text_end, pos, end_tok + 1) - 1
+            consumed = j - pos
+            if cum[j] < text_end:
+                partial = data[cum[j]:text_end].decode("utf-8", errors="replace")
+                consumed += len(enc.encode(partial, disallowed_special=()))
+        else:
+            text_end = b1
+            consumed = end_tok - pos
+        consumed = max(consumed, 1)
+
+        cleaned = data[b0:text_end].decode("utf-8", errors="replace").replace("\n", " ").strip()
+        if cleaned:
+            chunks.append(Chunk(cleaned, int(chars[b0]), int(chars[text_end]), pos, pos + consumed))
+
+        next_pos = pos + consumed
+        if overlap and next_pos < n:
+            next_pos = max(next_pos - overlap, pos + 1)
+        pos = next_pos
+
+    return chunks
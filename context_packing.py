@@ -0,0 +1,172 @@
+# context_packing.py
+"""
+Armado del contexto de los prompts con un presupuesto de tokens.
+
+Entre la recuperación y el prompt: de una lista de candidatos (más que los
+que caben) se descartan los fragmentos casi duplicados o solapados, se
+ordenan por MMR (relevancia frente a redundancia con lo ya elegido) y se
+empaquetan los de más valor hasta llenar el presupuesto, contado con tiktoken.
+
+- Duplicados / solapes: contención de shingles de 5 palabras (la fracción del
+  fragmento más corto que aparece en el otro) >= `dedup_threshold`. Detecta
+  tanto copias (encabezados, notas repetidas) como chunks con overlap.
+- Redundancia para MMR: coseno entre bolsas de términos (mismo tokenizador
+  que BM25), así funciona en los tres modos de búsqueda.
+- Relevancia: el puntaje de la búsqueda normalizado entre los candidatos.
+
+`pack_document` aplica lo mismo a un documento entero (rankeado con BM25
+frente a la pregunta) para los prompts de prompts.py.
+"""
+from __future__ import annotations
+
+import math
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from chunking import CHUNK_MODEL, chunk_document, get_encoder
+from lexical_index import BM25Index, fold, tokenize
+
+# Presupuesto de tokens de contexto por lado del prompt de comparación
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Candidatos recuperados por KB antes de empaquetar
+CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+SHINGLE = 5
+
+
+@dataclass
+class PackStats:
+    candidates: int = 0
+    duplicates: int = 0
+    over_budget: int = 0
+    selected: int = 0
+    tokens: int = 0
+    budget: int = 0
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+@dataclass
+class _Candidate:
+    index: int
+    text: str
+    score: float
+    tokens: int
+    shingles: frozenset
+    terms: Counter = field(repr=False)
+    norm: float = 0.0
+
+
+def _shingles(folded: str) -> frozenset:
+    words = folded.split()
+    if len(words) < SHINGLE:
+        return frozenset([" ".join(words)]) if words else frozenset()
+    return frozenset(" ".join(words[i:i + SHINGLE]) for i in range(len(words) - SHINGLE + 1))
+
+
+def containment(a: frozenset, b: frozenset) -> float:
+    """Fracción del conjunto más chico contenida en el otro (1.0 = uno está dentro del otro)."""
+    if not a or not b:
+        return 0.0
+    small, large = (a, b) if len(a) <= len(b) else (b, a)
+    return len(small & large) / len(small)
+
+
+def _cosine(a: _Candidate, b: _Candidate) -> float:
+    if not a.norm or not b.norm:
+        return 0.0
+    if len(a.terms) > len(b.terms):
+        a, b = b, a
+    return sum(freq * b.terms.get(term, 0) for term, freq in a.terms.items()) / (a.norm * b.norm)
+
+
+def _token_counter(model: str) -> Callable[[str], int]:
+    encoder = get_encoder(model)
+    return lambda text: len(encoder.encode(text, disallowed_special=()))
+
+
+def pack_context(candidates: Sequence[Tuple[str, float]], budget: int = TOKEN_BUDGET,
+                 mmr_lambda: float = MMR_LAMBDA, dedup_threshold: float = DEDUP_THRESHOLD,
+                 count_tokens: Optional[Callable[[str], int]] = None,
+                 model: str = CHUNK_MODEL) -> Tuple[List[Tuple[str, float]], PackStats]:
+    """
+    Elige de `candidates` ((texto, puntaje), mejor primero) los fragmentos que
+    entran en `budget` tokens: sin duplicados, en orden MMR. Devuelve los
+    elegidos (en ese orden, con su puntaje original) y estadísticas.
+    Si ni el mejor fragmento cabe, se devuelve solo ese: sin contexto no hay respuesta.
+    """
+    count_tokens = count_tokens or _token_counter(model)
+    stats = PackStats(candidates=len(candidates), budget=budget)
+    if not candidates:
+        return [], stats
+
+    scores = [float(score) for _, score in candidates]
+    low, high = min(scores), max(scores)
+    pool: List[_Candidate] = []
+    for i, (text, score) in enumerate(candidates):
+        folded = fold(text)
+        terms = Counter(tokenize(folded, folded=True))
+        pool.append(_Candidate(
+            index=i, text=text, score=(score - low) / (high - low) if high > low else 1.0,
+            tokens=count_tokens(text), shingles=_shingles(folded), terms=terms,
+            norm=math.sqrt(sum(f * f for f in terms.values())),
+        ))
+
+    selected: List[_Candidate] = []
+    used = 0
+    # Máxima similitud de cada candidato con lo ya elegido (se actualiza con cada elección)
+    redundancy = [0.0] * len(pool)
+    while pool:
+        best = max(pool, key=lambda c: mmr_lambda * c.score - (1 - mmr_lambda) * redundancy[c.index])
+        pool.remove(best)
+        if any(containment(best.shingles, s.shingles) >= dedup_threshold for s in selected):
+            stats.duplicates += 1
+            continue
+        if used + best.tokens > budget and selected:
+            stats.over_budget += 1
+            continue
+        selected.append(best)
+        used += best.tokens
+        for candidate in pool:
+            redundancy[candidate.index] = max(redundancy[candidate.index], _cosine(candidate, best))
+        if pool and budget - used < min(c.tokens for c in pool):
+            stats.over_budget += len(pool)
+            break
+
+    stats.selected, stats.tokens = len(selected), used
+    return [(c.text, candidates[c.index][1]) for c in selected], stats
+
+
+def pack_document(text: str, question: str, budget: int, chunk_tokens: int = 400,
+                  model: str = CHUNK_MODEL) -> Tuple[str, PackStats]:
+    """
+    Recorta un documento entero a `budget` tokens conservando lo relevante a
+    la pregunta: chunks rankeados con BM25, empaquetados con pack_context y
+    devueltos en el orden del documento. Si el texto ya cabe, se devuelve igual.
+    """
+    count_tokens = _token_counter(model)
+    total = count_tokens(text)
+    if total <= budget:
+        return text, PackStats(candidates=1, selected=1, tokens=total, budget=budget)
+
+    chunks = [c.text for c in chunk_document(text, token_limit=chunk_tokens, model=model)]
+    ids, scores = BM25Index.build(chunks).search(question, len(chunks))
+    ranked = [(int(i), float(s)) for i, s in zip(ids, scores)]
+    # Sin coincidencias léxicas se prefiere el inicio del documento
+    ranked_ids = {i for i, _ in ranked}
+    ranked += [(i, 0.0) for i in range(len(chunks)) if i not in ranked_ids]
+
+    # Solo los mejores candidatos compiten por el presupuesto (unas 3 veces lo que cabe)
+    ranked = ranked[:max(1, 3 * budget // chunk_tokens)]
+
+    by_text = {}
+    for i, _ in ranked:
+        by_text.setdefault(chunks[i], i)
+    packed, stats = pack_context([(chunks[i], s) for i, s in ranked], budget=budget,
+                                 count_tokens=count_tokens)
+    order = sorted(by_text[chunk] for chunk, _ in packed)
+    return "\n\n[...]\n\n".join(chunks[i] for i in order), stats
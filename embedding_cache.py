@@ -0,0 +1,219 @@
+# embedding_cache.py
+"""
+Caché persistente de embeddings direccionada por contenido.
+
+La clave es (modelo, sha256 del texto normalizado), así que el mismo chunk
+no se vuelve a embeber aunque aparezca en otra KB, en un PDF subido dos
+veces o en una reconstrucción. Se guarda en SQLite (vectores float32 como
+BLOB) con un tope de entradas y expulsión LRU.
+
+También incluye la caché LRU de embeddings de preguntas (QueryEmbeddingCache).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza espacios para que diferencias de formato no cambien la clave."""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Caché compartida por todas las KnowledgeBase del proceso (y entre procesos,
+    vía el archivo SQLite). `max_entries` acota el tamaño; al superarlo se
+    expulsan las entradas usadas hace más tiempo.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 100_000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " dim INTEGER NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Devuelve el embedding de cada texto, o None si no está en caché."""
+        keys = [cache_key(model, t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # SQLite limita el número de parámetros por consulta
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(now, key) for key in found],
+                    )
+            results = [found.get(key) for key in keys]
+            hits = sum(r is not None for r in results)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return results
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Guarda los embeddings y expulsa por LRU si se supera max_entries."""
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            array = np.asarray(vector, dtype=np.float32)
+            rows.append((cache_key(model, text), model, array.shape[0], array.tobytes(), now))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def normalize_question(question: str) -> str:
+    """Normaliza una pregunta (espacios y mayúsculas) para usarla como clave."""
+    return normalize_text(question).casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    LRU en memoria, acotado, de embeddings de preguntas: una misma pregunta se
+    embebe una sola vez aunque se busque en varias KBs o se repita durante el día.
+    Con `store` (otra EmbeddingCache) persiste en disco entre reinicios.
+    """
+
+    def __init__(self, max_entries: int = 2048, store: Optional[EmbeddingCache] = None):
+        self.max_entries = max_entries
+        self.store = store
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, model: str, question: str,
+                       compute: Callable[[str], Sequence[float]]) -> np.ndarray:
+        """
+        Embedding float32 de la pregunta; `compute(texto)` solo se llama en un
+        fallo. La forma normalizada (sin mayúsculas) es solo la clave: se embebe
+        la pregunta tal como llegó, con sus siglas (NIIF, IBNR...).
+        """
+        key = normalize_question(question)
+        vector = self._recent((model, key))
+        if vector is not None:
+            return vector
+
+        stored = self.store.get_many(model, [key])[0] if self.store else None
+        if stored is not None:
+            vector = np.asarray(stored, dtype=np.float32)
+        else:
+            vector = np.asarray(compute(normalize_text(question)), dtype=np.float32)
+            if self.store:
+                self.store.put_many(model, [key], [vector])
+        self._remember((model, key), vector, from_disk=stored is not None)
+        return vector
+
+    async def get_or_compute_async(self, model: str, question: str,
+                                   compute: Callable[[str], Awaitable[Sequence[float]]]) -> np.ndarray:
+        """Como get_or_compute con un `compute` asíncrono; el SQLite se consulta en un hilo."""
+        key = normalize_question(question)
+        vector = self._recent((model, key))
+        if vector is not None:
+            return vector
+
+        stored = (await asyncio.to_thread(self.store.get_many, model, [key]))[0] if self.store else None
+        if stored is not None:
+            vector = np.asarray(stored, dtype=np.float32)
+        else:
+            vector = np.asarray(await compute(normalize_text(question)), dtype=np.float32)
+            if self.store:
+                await asyncio.to_thread(self.store.put_many, model, [key], [vector])
+        self._remember((model, key), vector, from_disk=stored is not None)
+        return vector
+
+    def _recent(self, key: Tuple[str, str]) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return vector
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray, from_disk: bool):
+        with self._lock:
+            if from_disk:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "persistent": self.store is not None,
+            }
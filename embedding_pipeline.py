@@ -0,0 +1,182 @@
+# embedding_pipeline.py
+"""
+Generación de embeddings por lotes y en paralelo.
+
+- Agrupa muchos chunks por llamada a `embeddings.create`, respetando el
+  límite de tokens e inputs por petición.
+- Ejecuta un número acotado de lotes a la vez en un ThreadPoolExecutor.
+- Reintenta 429/5xx/errores de conexión con backoff exponencial + jitter.
+- Devuelve los embeddings en el mismo orden de los chunks.
+"""
+from __future__ import annotations
+
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import openai
+
+from chunking import get_encoder
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Límites del proveedor: 300k tokens sumados y 2048 inputs por petición.
+# Se deja margen en tokens porque el conteo local puede diferir levemente, y
+# se usan lotes de 128 inputs para que un documento grande genere varios
+# lotes que puedan ir en paralelo.
+MAX_TOKENS_PER_REQUEST = int(os.getenv("EMBEDDING_BATCH_TOKENS", "250000"))
+MAX_INPUTS_PER_REQUEST = int(os.getenv("EMBEDDING_BATCH_INPUTS", "128"))
+MAX_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "4"))
+MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+@dataclass
+class EmbeddingStats:
+    """Resumen de una corrida del pipeline."""
+    chunks: int = 0
+    cached: int = 0
+    tokens: int = 0
+    batches: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.seconds if self.seconds > 0 else 0.0
+
+
+def count_tokens(texts: Sequence[str], model: str = EMBEDDING_MODEL) -> List[int]:
+    """Cuenta los tokens de cada texto con el tokenizador del modelo de embeddings."""
+    enc = get_encoder(model)
+    return [len(t) for t in enc.encode_batch(list(texts), disallowed_special=())]
+
+
+def plan_batches(token_counts: Sequence[int],
+                 max_tokens: int = MAX_TOKENS_PER_REQUEST,
+                 max_inputs: int = MAX_INPUTS_PER_REQUEST) -> List[Tuple[int, int]]:
+    """
+    Agrupa índices consecutivos en lotes [inicio, fin) sin superar
+    max_tokens ni max_inputs. Un texto que por sí solo supera el límite
+    queda en un lote propio (y será el proveedor quien lo rechace).
+    """
+    batches = []
+    start, tokens = 0, 0
+    for i, n in enumerate(token_counts):
+        if i > start and (tokens + n > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+def retry_delay(exc: Exception, attempt: int) -> float:
+    """Respeta Retry-After si el proveedor lo envía; si no, backoff exponencial con jitter."""
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def _embed_batch(client, texts: List[str], model: str, max_retries: int,
+                 dimensions: Optional[int] = None) -> Tuple[List[List[float]], int]:
+    """Embebe un lote con reintentos. Devuelve (embeddings en orden, reintentos usados)."""
+    extra = {"dimensions": dimensions} if dimensions else {}
+    attempt = 0
+    while True:
+        try:
+            response = client.embeddings.create(input=texts, model=model, **extra)
+            data = sorted(response.data, key=lambda d: d.index)
+            return [d.embedding for d in data], attempt
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            time.sleep(retry_delay(e, attempt))
+            attempt += 1
+
+
+def embed_texts(client,
+                texts: Sequence[str],
+                model: str = EMBEDDING_MODEL,
+                max_workers: int = MAX_WORKERS,
+                max_tokens: int = MAX_TOKENS_PER_REQUEST,
+                max_inputs: int = MAX_INPUTS_PER_REQUEST,
+                max_retries: int = MAX_RETRIES,
+                on_progress: Optional[Callable[[int, int], None]] = None,
+                cache=None,
+                dimensions: Optional[int] = None,
+                cache_model: Optional[str] = None,
+                ) -> Tuple[List[List[float]], EmbeddingStats]:
+    """
+    Genera los embeddings de `texts` por lotes y en paralelo.
+    Devuelve (embeddings en el orden de `texts`, estadísticas de la corrida).
+    `on_progress(hechos, total)` se llama cada vez que termina un lote.
+    Si se pasa `cache` (EmbeddingCache), solo se llama a la API para los textos
+    que no están en caché, y los nuevos embeddings se guardan en ella, bajo
+    `cache_model` (por defecto `model`; debe distinguir también `dimensions`).
+    """
+    cache_model = cache_model or model
+    start = time.perf_counter()
+    texts = [t.replace("\n", " ") for t in texts]
+    stats = EmbeddingStats(chunks=len(texts))
+    if not texts:
+        return [], stats
+
+    results: List[Optional[List[float]]] = cache.get_many(cache_model, texts) if cache else [None] * len(texts)
+    pending = [i for i, r in enumerate(results) if r is None]
+    stats.cached = len(texts) - len(pending)
+    done = stats.cached
+    if on_progress and done:
+        on_progress(done, len(texts))
+
+    pending_texts = [texts[i] for i in pending]
+    token_counts = count_tokens(pending_texts, model)
+    stats.tokens = sum(token_counts)
+    batches = plan_batches(token_counts, max_tokens, max_inputs)
+    stats.batches = len(batches)
+
+    # Los reintentos los maneja el pipeline; el cliente no debe reintentar por su cuenta
+    batch_client = client.with_options(max_retries=0)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="embed") as pool:
+        futures = {
+            pool.submit(_embed_batch, batch_client, pending_texts[lo:hi], model, max_retries, dimensions): (lo, hi)
+            for lo, hi in batches
+        }
+        try:
+            for future in as_completed(futures):
+                lo, hi = futures[future]
+                embeddings, retries = future.result()
+                if len(embeddings) != hi - lo:
+                    raise RuntimeError(f"El proveedor devolvió {len(embeddings)} embeddings para {hi - lo} textos")
+                for i, embedding in zip(pending[lo:hi], embeddings):
+                    results[i] = embedding
+                if cache:
+                    cache.put_many(cache_model, pending_texts[lo:hi], embeddings)
+                stats.retries += retries
+                done += hi - lo
+                if on_progress:
+                    on_progress(done, len(texts))
+        except BaseException:
+            # No seguir gastando llamadas si un lote falló definitivamente
+            for future in futures:
+                future.cancel()
+            raise
+
+    stats.seconds = time.perf_counter() - start
+    return results, stats
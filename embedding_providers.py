@@ -0,0 +1,276 @@
+# embedding_providers.py
+"""
+Proveedores de embeddings intercambiables para las KBs y las preguntas.
+
+- OpenAIEmbeddingProvider: la API de OpenAI vía embedding_pipeline (lotes,
+  hilos, reintentos, caché) y el parámetro `dimensions` opcional.
+- LocalEmbeddingProvider: 100% local en CPU, sin red. TF-IDF sobre n-gramas
+  de palabras con hashing (sin vocabulario que guardar) y proyección SVD a
+  `dimensions`. El modelo (idf + componentes) se ajusta una vez sobre un
+  corpus y se guarda en disco; su id incluye un hash de los pesos.
+
+Cada KB registra en su manifest el proveedor, el modelo y la dimensión con
+los que se construyó; `check_manifest` impide mezclar vectores de espacios
+distintos (p. ej. consultar con el modelo local una KB de OpenAI).
+
+Ajustar el modelo local con PDFs concretos (si no, se ajusta con el primer
+documento que se ingiera):
+    python embedding_providers.py fit sura-EEFF-2024-4t.pdf EEFF_cargados/*.pdf
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_pipeline import EMBEDDING_MODEL, MAX_WORKERS, EmbeddingStats, embed_texts
+
+# "openai" o "local"
+PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+# Dimensión pedida a la API de OpenAI (0 = la del modelo)
+OPENAI_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+LOCAL_MODEL_DIR = Path(os.getenv("LOCAL_EMBEDDING_DIR", Path(__file__).resolve().parent / "models" / "local_embeddings"))
+LOCAL_DIMENSIONS = int(os.getenv("LOCAL_EMBEDDING_DIM", "256"))
+LOCAL_FEATURES = 2 ** 15
+LOCAL_BATCH = 512
+
+
+class IncompatibleEmbeddingsError(ValueError):
+    """La KB se construyó en otro espacio de embeddings (proveedor, modelo o dimensión)."""
+
+
+def usage_tokens(response) -> int:
+    """Tokens del `usage` de una respuesta de embeddings (0 si no lo trae)."""
+    usage = getattr(response, "usage", None)
+    return int(getattr(usage, "total_tokens", 0) or 0)
+
+
+class EmbeddingProvider:
+    """Interfaz común: embeber documentos por lotes y preguntas sueltas."""
+
+    name = ""
+
+    @property
+    def model(self) -> str:
+        raise NotImplementedError
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        return None
+
+    @property
+    def space(self) -> str:
+        """Identificador del espacio de vectores (clave de las cachés de embeddings)."""
+        return f"{self.name}/{self.model}"
+
+    def describe(self) -> Dict:
+        """Lo que se registra en el manifest de la KB."""
+        return {"provider": self.name, "model": self.model, "dimensions": self.dimensions}
+
+    def check_manifest(self, manifest: Dict):
+        """Lanza IncompatibleEmbeddingsError si la KB no está en el espacio de este proveedor."""
+        # Los manifests anteriores a los proveedores son todos de OpenAI
+        provider = manifest.get("provider", "openai")
+        model = manifest.get("model")
+        dim = manifest.get("dimensions") or manifest.get("dim")
+        if provider != self.name or model != self.model or (self.dimensions and dim and dim != self.dimensions):
+            raise IncompatibleEmbeddingsError(
+                f"La KB usa {provider}/{model} ({dim} dims) y el proveedor activo es "
+                f"{self.name}/{self.model} ({self.dimensions or '?'} dims)"
+            )
+
+    def embed_documents(self, texts: Sequence[str], max_workers: int = MAX_WORKERS,
+                        on_progress: Optional[Callable[[int, int], None]] = None,
+                        cache=None) -> Tuple[List[Sequence[float]], EmbeddingStats]:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> Sequence[float]:
+        return self.embed_query_usage(text)[0]
+
+    def embed_query_usage(self, text: str) -> Tuple[Sequence[float], int]:
+        """(embedding de la pregunta, tokens facturados por el proveedor; 0 si no cobra)."""
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, client, model: str = EMBEDDING_MODEL, dimensions: Optional[int] = OPENAI_DIMENSIONS):
+        self.client = client
+        self._model = model
+        self._dimensions = dimensions
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        return self._dimensions
+
+    @property
+    def space(self) -> str:
+        # Sin `dimensions` la clave es la de siempre, para no invalidar la caché existente
+        return f"{self._model}@{self._dimensions}" if self._dimensions else self._model
+
+    def embed_documents(self, texts, max_workers=MAX_WORKERS, on_progress=None, cache=None):
+        return embed_texts(
+            self.client, texts, model=self._model, max_workers=max_workers, on_progress=on_progress,
+            cache=cache, dimensions=self._dimensions, cache_model=self.space,
+        )
+
+    def embed_query_usage(self, text: str) -> Tuple[Sequence[float], int]:
+        extra = {"dimensions": self._dimensions} if self._dimensions else {}
+        response = self.client.embeddings.create(input=[text.replace("\n", " ")], model=self._model, **extra)
+        return response.data[0].embedding, usage_tokens(response)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """TF-IDF con hashing + SVD, ajustado una vez y guardado en `model_dir`."""
+
+    name = "local"
+    FILENAME = "tfidf_svd.npz"
+
+    def __init__(self, model_dir: Path = LOCAL_MODEL_DIR, dimensions: int = LOCAL_DIMENSIONS,
+                 n_features: int = LOCAL_FEATURES):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        from lexical_index import tokenize
+
+        self.model_dir = Path(model_dir)
+        self.target_dimensions = dimensions
+        self.n_features = n_features
+        # Sin estado: solo hace falta guardar idf y componentes
+        self._vectorizer = HashingVectorizer(
+            n_features=n_features, tokenizer=tokenize, preprocessor=None, lowercase=False,
+            token_pattern=None, ngram_range=(1, 2), alternate_sign=False, norm=None,
+        )
+        self._lock = threading.Lock()
+        self._idf: Optional[np.ndarray] = None
+        self._components: Optional[np.ndarray] = None
+        self._model_id: Optional[str] = None
+        self._load()
+
+    @property
+    def fitted(self) -> bool:
+        return self._components is not None
+
+    @property
+    def model(self) -> str:
+        return self._model_id or "tfidf-svd-sin-ajustar"
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        return int(self._components.shape[0]) if self.fitted else None
+
+    def _load(self):
+        path = self.model_dir / self.FILENAME
+        if not path.exists():
+            return
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["n_features"]) != self.n_features:
+                print(f"[EMBED][WARN] {path} usa otro n_features; se ignora")
+                return
+            self._idf = data["idf"]
+            self._components = data["components"]
+            self._model_id = str(data["model_id"])
+
+    def _tfidf(self, texts: Sequence[str]):
+        from sklearn.preprocessing import normalize
+
+        counts = self._vectorizer.transform(texts).tocsr().astype(np.float32)
+        counts.data = 1.0 + np.log(counts.data)  # tf sublineal
+        return normalize(counts.multiply(self._idf).tocsr(), copy=False)
+
+    def fit(self, texts: Sequence[str]):
+        """Ajusta idf y la proyección SVD sobre `texts` y guarda el modelo."""
+        from sklearn.decomposition import TruncatedSVD
+
+        start = time.perf_counter()
+        texts = list(texts)
+        counts = self._vectorizer.transform(texts).tocsr()
+        df = np.bincount(counts.indices, minlength=self.n_features)
+        self._idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        tfidf = self._tfidf(texts)
+        n_components = max(1, min(self.target_dimensions, len(texts) - 1))
+        svd = TruncatedSVD(n_components=n_components, algorithm="randomized", random_state=0)
+        svd.fit(tfidf)
+        self._components = svd.components_.astype(np.float32)
+        digest = hashlib.sha256(self._idf.tobytes() + self._components.tobytes()).hexdigest()[:10]
+        self._model_id = f"tfidf-svd-{n_components}-{digest}"
+
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        path = self.model_dir / self.FILENAME
+        tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}.npz")
+        np.savez(tmp, idf=self._idf, components=self._components, model_id=self._model_id,
+                 n_features=self.n_features)
+        os.replace(tmp, path)
+        print(f"[EMBED] Modelo local {self._model_id} ajustado con {len(texts)} textos "
+              f"({time.perf_counter() - start:.1f}s)")
+
+    def _embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.asarray(self._tfidf(texts) @ self._components.T, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def embed_documents(self, texts, max_workers=MAX_WORKERS, on_progress=None, cache=None):
+        # Local y barato: no usa la caché de embeddings ni hilos
+        start = time.perf_counter()
+        texts = list(texts)
+        stats = EmbeddingStats(chunks=len(texts))
+        with self._lock:
+            if not self.fitted and texts:
+                self.fit(texts)
+        results: List[np.ndarray] = []
+        for lo in range(0, len(texts), LOCAL_BATCH):
+            results.extend(self._embed(texts[lo:lo + LOCAL_BATCH]))
+            stats.batches += 1
+            if on_progress:
+                on_progress(len(results), len(texts))
+        stats.seconds = time.perf_counter() - start
+        return results, stats
+
+    def embed_query_usage(self, text: str) -> Tuple[Sequence[float], int]:
+        if not self.fitted:
+            raise RuntimeError("El modelo de embeddings local no está ajustado: construye una KB "
+                               "o ejecuta `python embedding_providers.py fit <pdfs>`")
+        return self._embed([text])[0], 0
+
+
+def create_provider(client=None, name: str = PROVIDER) -> EmbeddingProvider:
+    """Proveedor configurado por EMBEDDING_PROVIDER."""
+    if name == "openai":
+        return OpenAIEmbeddingProvider(client)
+    if name == "local":
+        return LocalEmbeddingProvider()
+    raise ValueError(f"Proveedor de embeddings desconocido: {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit = sub.add_parser("fit", help="Ajusta el modelo local con los chunks de los PDFs dados")
+    fit.add_argument("pdfs", nargs="+", type=Path)
+    fit.add_argument("--dim", type=int, default=LOCAL_DIMENSIONS)
+    args = parser.parse_args()
+
+    from chunking import chunk_document
+    from pdf_extract import extract_pdf_text
+
+    chunks = []
+    for pdf in args.pdfs:
+        document_chunks = [c.text for c in chunk_document(extract_pdf_text(pdf))]
+        print(f"{pdf.name}: {len(document_chunks)} chunks")
+        chunks.extend(document_chunks)
+    LocalEmbeddingProvider(dimensions=args.dim).fit(chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+# financial_tables.py
+"""
+Partidas de los estados financieros extraídas del texto de PyPDF2 y ratios
+calculados localmente.
+
+Durante la ingesta se recorren las líneas del documento buscando los
+estados principales (situación financiera / balance general y resultados /
+beneficios) y, dentro de ellos, los encabezados de período ("2024 2023") y
+las partidas estándar (total activos, pasivos corrientes, patrimonio,
+utilidad neta...). Los importes se interpretan con separadores de miles y
+decimales en español o en inglés, paréntesis para negativos, "-" = cero, y se
+reparan los números que PyPDF2 parte con espacios ("705,403,8 50").
+
+El resultado es una tabla columnar por KB (`financials.npz`: partidas x
+períodos en float64, NaN = sin dato) y los ratios de prompts.py se calculan
+con NumPy sobre todos los períodos a la vez:
+
+    current_ratio      Activos corrientes / Pasivos corrientes
+    debt_to_equity     Pasivo total / Patrimonio
+    roe                Resultado neto / Patrimonio promedio
+    operating_margin   Utilidad operativa / Ingresos
+    interest_coverage  EBIT / Gastos financieros
+
+Solo se toman partidas dentro de los estados principales: las cifras de las
+notas (segmentos, subsidiarias) no son las de la entidad y darían ratios
+equivocados.
+"""
+from __future__ import annotations
+
+import math
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lexical_index import fold
+
+# Partida estándar -> etiqueta (texto plegado, sin notas ni puntuación final)
+ITEM_PATTERNS: Dict[str, str] = {
+    "total_assets": r"total (de )?(los )?activos?|activos? totale?s?",
+    "current_assets": r"total (de )?(los )?activos? corrientes?|activos? corrientes? totale?s?",
+    "total_liabilities": r"total (de )?(los )?pasivos?|pasivos? totale?s?",
+    "current_liabilities": r"total (de )?(los )?pasivos? corrientes?|pasivos? corrientes? totale?s?",
+    "equity": r"total (del |de )?(patrimonio|capital contable)( neto| de los accionistas)?"
+              r"|patrimonio total|total capital, reservas y beneficios acumulados",
+    "liabilities_and_equity": r"total (del )?pasivos? y (patrimonio|capital contable)( de los accionistas)?",
+    "revenue": r"total (de )?ingresos( operacionales| de operacion| de actividades ordinarias)?"
+               r"|ingresos (totales|operacionales|de actividades ordinarias)",
+    "operating_income": r"(utilidad|ganancia|resultado|beneficio)( \(perdida\))? (operativ[ao]|operacional|de operacion)",
+    "pre_tax_income": r"(utilidad|ganancia|resultado|beneficio)( \(perdida\))?,? antes de(l)? impuestos?.*",
+    "financial_expenses": r"(gastos|costos) (financieros|por intereses)|intereses (pagados|causados)",
+    "net_income": r"(\(perdida\) )?(utilidad|ganancia|resultado|beneficio)( \(perdida\))? "
+                  r"(neta|neto|del (ejercicio|periodo|ano))|\(perdida\) neta|perdida neta",
+}
+_ITEM_RES = {item: re.compile(pattern) for item, pattern in ITEM_PATTERNS.items()}
+
+ITEM_LABELS = {
+    "total_assets": "Total activos",
+    "current_assets": "Activos corrientes",
+    "total_liabilities": "Pasivo total",
+    "current_liabilities": "Pasivos corrientes",
+    "equity": "Patrimonio",
+    "liabilities_and_equity": "Total pasivo y patrimonio",
+    "revenue": "Ingresos",
+    "operating_income": "Utilidad operativa",
+    "pre_tax_income": "Resultado antes de impuestos",
+    "financial_expenses": "Gastos financieros",
+    "net_income": "Resultado neto",
+}
+
+# Ratio -> (nombre, fórmula), los de prompts.py
+RATIOS: Dict[str, Tuple[str, str]] = {
+    "current_ratio": ("Razón corriente", "Activos corrientes / Pasivos corrientes"),
+    "debt_to_equity": ("Deuda / Patrimonio", "Pasivo total / Patrimonio"),
+    "roe": ("ROE", "Resultado neto / Patrimonio promedio"),
+    "operating_margin": ("Margen operativo", "Utilidad operativa / Ingresos"),
+    "interest_coverage": ("Cobertura de intereses", "EBIT / Gastos financieros"),
+}
+PERCENT_RATIOS = {"roe", "operating_margin"}
+
+# Preguntas sobre ratios (texto plegado) y palabras que piden algo más que la cifra.
+# Solo nombres explícitos del ratio: "liquidez" a secas o "capital de trabajo"
+# (activos corrientes - pasivos corrientes, no su cociente) van al modelo, y
+# también "razón de endeudamiento", que suele ser pasivo total / activo total
+RATIO_QUESTION_PATTERNS: Dict[str, str] = {
+    "current_ratio": r"razon corriente|current ratio|(razon|indice) de liquidez|liquidez corriente",
+    "debt_to_equity": (r"apalancamiento|endeudamiento patrimonial|debt ?/ ?equity|debt to equity|"
+                       r"deuda ?/ ?patrimonio|deuda sobre (el )?patrimonio"),
+    "roe": r"\broe\b|rentabilidad (sobre|del) (el )?patrimonio|retorno sobre (el )?patrimonio",
+    "operating_margin": r"margen operativo|margen operacional|margen de operacion",
+    "interest_coverage": r"cobertura de intereses|interest coverage",
+}
+ALL_RATIOS_PATTERN = r"\b(ratios|indicadores|razones) financier[oa]s\b|\btodos los (ratios|indicadores)\b"
+NON_RATIO_WORDS = re.compile(
+    r"\b(politica|politicas|contabiliza|reconoce|reconocen|registra|mide|miden|norma|niif|nic|tratamiento|"
+    r"nota|notas|explica|por que|riesgo|riesgos|recomend\w*|impacto|causa|causas|"
+    r"compara\w*|industria|sector|tendencia|evolucion)\b"
+)
+
+_BALANCE_HEADER = re.compile(
+    r"(estados? (consolidados? |separados? )?de (situacion|posicion) financiera|estados? de situacion|"
+    r"balances? generales?)( consolidad[oa]s?| separad[oa]s?)?( [-–].*)?"
+)
+_INCOME_HEADER = re.compile(
+    r"estados? (consolidados? |separados? )?(de|del) (resultados?|ganancias|perdidas|beneficios|"
+    r"resultado integral)\b(?!.*segmento).*"
+)
+# Líneas que se leen tras el encabezado de un estado (uno ocupa una o dos páginas)
+STATEMENT_MAX_LINES = 150
+_OTHER_HEADER = re.compile(
+    r"estados? (consolidados? |separados? )?de (flujos?|cambios|valuacion)\b.*|notas? a los estados financieros.*"
+)
+_CURRENCY = re.compile(r"(?:RD|US|MX|COP|CLP|USD)?\$|€")
+# Token de la cola numérica de una línea: importe, pedazo de importe o "-"
+_AMOUNT_TOKEN = re.compile(r"\(?-?[\d.,]*\d[\d.,]*\)?|[.,]\d+\)?|[-—–]")
+_NOTE_REFS = re.compile(r"\s+\d{1,2}(?:\.\d{1,2})?(?:\s*(?:,|y)\s*\d{1,2}(?:\.\d{1,2})?)*\s*(?:,|y)?$")
+_UNIT = re.compile(r"\b(miles|millones)\b")
+
+
+def parse_amount(token: str) -> Optional[float]:
+    """
+    Importe de un token: "1,234,567", "1.234.567,89", "(70,516,046)", "-" (cero).
+    None si no es un número.
+    """
+    token = _CURRENCY.sub("", token).strip()
+    if token in ("-", "—", "–"):
+        return 0.0
+    negative = token.startswith("(") and token.endswith(")")
+    token = token.strip("()").strip()
+    if token.startswith("-"):
+        negative, token = True, token[1:]
+    if not token or not re.fullmatch(r"[\d.,]+", token) or not re.search(r"\d", token):
+        return None
+
+    if "," in token and "." in token:
+        # El último separador es el decimal
+        decimal = "," if token.rfind(",") > token.rfind(".") else "."
+        thousands = "." if decimal == "," else ","
+        number = token.replace(thousands, "").replace(decimal, ".")
+    else:
+        sep = "," if "," in token else "." if "." in token else None
+        if sep is None:
+            number = token
+        else:
+            groups = token.split(sep)
+            if len(groups) > 1 and all(len(g) == 3 for g in groups[1:]) and groups[0]:
+                number = "".join(groups)  # separador de miles
+            elif len(groups) == 2:
+                number = groups[0] + "." + groups[1]  # separador decimal
+            else:
+                return None
+    try:
+        value = float(number)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def _last_group(token: str) -> Optional[str]:
+    digits = token.strip("()")
+    if "," not in digits and "." not in digits:
+        return None
+    return re.split(r"[.,]", digits)[-1]
+
+
+def _merge_fragments(tokens: List[str]) -> List[str]:
+    """Une los pedazos de un número que PyPDF2 separa con espacios: "705,403,8 50", "7,475,187, 528"."""
+    merged: List[str] = []
+    for token in tokens:
+        if merged:
+            previous = merged[-1]
+            group = _last_group(previous)
+            lead = re.match(r"\d+", token)
+            if (previous.endswith((",", ".")) and token[:1].isdigit()) or (token[:1] in ",." and previous[-1:].isdigit()):
+                merged[-1] = previous + token
+                continue
+            if (group is not None and len(group) < 3 and lead
+                    and not previous.endswith(")") and len(group) + len(lead.group(0)) == 3):
+                merged[-1] = previous + token
+                continue
+        merged.append(token)
+    return merged
+
+
+def parse_line(line: str) -> Optional[Tuple[str, List[float]]]:
+    """(etiqueta, importes) de una línea de tabla, o None si no termina en importes."""
+    tokens = _CURRENCY.sub(" ", line).split()
+    start = len(tokens)
+    while start > 0 and _AMOUNT_TOKEN.fullmatch(tokens[start - 1]):
+        start -= 1
+    if start == 0 or start == len(tokens):
+        return None
+    label = _NOTE_REFS.sub("", " ".join(tokens[:start])).strip(" :.-")
+    if not re.search(r"[^\W\d_]", label):
+        return None
+    values = [parse_amount(t) for t in _merge_fragments(tokens[start:])]
+    if not label or not values or any(v is None for v in values):
+        return None
+    return label, values
+
+
+def _note_like(value: float) -> bool:
+    return value.is_integer() and 0 < value < 100
+
+
+def _item_for(label: str) -> Optional[str]:
+    folded = re.sub(r"\s+", " ", fold(label)).strip(" :.,")
+    for item, regex in _ITEM_RES.items():
+        if regex.fullmatch(folded):
+            return item
+    return None
+
+
+class FinancialTable:
+    """Partidas estándar x períodos (float64, NaN = sin dato), con la línea de origen de cada partida."""
+
+    FILENAME = "financials.npz"
+
+    def __init__(self, items: Sequence[str], periods: Sequence[str], values: np.ndarray,
+                 sources: Sequence[str] = (), unit: str = ""):
+        self.items = list(items)
+        self.periods = list(periods)
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.items), len(self.periods))
+        self.sources = list(sources) or [""] * len(self.items)
+        self.unit = unit
+        self._rows = {item: i for i, item in enumerate(self.items)}
+
+    @property
+    def empty(self) -> bool:
+        return not self.items
+
+    @classmethod
+    def from_text(cls, text: str, default_year: Optional[int] = None) -> "FinancialTable":
+        """Recorre las líneas del documento y toma la primera aparición de cada partida en los estados principales."""
+        found: Dict[str, Tuple[List[str], List[float], str]] = {}
+        remaining = 0  # líneas que faltan del estado actual (0 = fuera de los estados)
+        periods: List[str] = []
+        unit = ""
+        pending = ""
+        for raw in text.splitlines():
+            line = re.sub(r"\s+", " ", raw).strip()
+            if not line:
+                continue
+            folded = fold(line)
+            if _BALANCE_HEADER.fullmatch(folded) or _INCOME_HEADER.fullmatch(folded):
+                remaining, periods, pending = STATEMENT_MAX_LINES, [], ""
+                continue
+            if _OTHER_HEADER.fullmatch(folded):
+                remaining, pending = 0, ""
+                continue
+            if remaining == 0:
+                continue
+            remaining -= 1
+            if not unit and (m := _UNIT.search(folded)) and ("cifras" in folded or "expresad" in folded):
+                unit = m.group(1)
+
+            years = [m.group(0)[-4:] for t in line.split() if (m := re.search(r"(?:19|20)\d{2}(?=\W*$)", t))]
+            if len(years) >= 2 and len(line) < 80 and len(set(years)) == len(years):
+                periods = years
+                pending = ""
+                continue
+
+            parsed = parse_line(line)
+            if parsed is None:
+                # Etiqueta partida en dos líneas: "Total capital, reservas y beneficios" / "acumulados 2,424,..."
+                pending = line if not line.endswith(":") and len(line) < 80 else ""
+                continue
+            label, values = parsed
+            source = line
+            if pending and label[:1].islower():
+                label, source = f"{pending} {label}", f"{pending} {line}"
+            pending = ""
+
+            item = _item_for(label)
+            if item is None or item in found:
+                continue
+            cols = periods or ([str(int(default_year) - i) for i in range(2)] if default_year else [])
+            if not cols:
+                continue
+            # Referencias a notas antes de los importes ("Total activos 4 1,520,293,222 ...")
+            while len(values) > len(cols) and _note_like(values[0]):
+                values = values[1:]
+            if len(values) != len(cols):
+                continue  # más columnas que períodos: tabla por segmentos o por subsidiaria
+            found[item] = (cols, values, source)
+
+        all_periods: List[str] = []
+        for cols, _, _ in found.values():
+            all_periods += [p for p in cols if p not in all_periods]
+        all_periods.sort(reverse=True)
+        items = [item for item in ITEM_PATTERNS if item in found]
+        matrix = np.full((len(items), len(all_periods)), np.nan)
+        for row, item in enumerate(items):
+            cols, values, _ = found[item]
+            for period, value in zip(cols, values):
+                matrix[row, all_periods.index(period)] = value
+        return cls(items, all_periods, matrix, [found[item][2] for item in items], unit)
+
+    def get(self, item: str) -> np.ndarray:
+        """Valores de la partida por período (NaN si no se encontró)."""
+        row = self._rows.get(item)
+        if row is None:
+            return np.full(len(self.periods), np.nan)
+        return self.values[row]
+
+    def ratios(self) -> Dict[str, np.ndarray]:
+        """Los ratios de RATIOS por período, calculados sobre toda la tabla a la vez (NaN = no calculable)."""
+        get = self.get
+        equity = get("equity")
+        liabilities = get("total_liabilities")
+        # Derivadas cuando el estado no trae la partida explícita
+        equity = np.where(np.isnan(equity), get("total_assets") - liabilities, equity)
+        liabilities = np.where(np.isnan(liabilities), get("liabilities_and_equity") - equity, liabilities)
+        ebit = get("operating_income")
+        ebit = np.where(np.isnan(ebit), get("pre_tax_income") + np.abs(get("financial_expenses")), ebit)
+        # Patrimonio promedio: el del período y el anterior (columnas de más reciente a más antiguo)
+        previous = np.append(equity[1:], np.nan)
+        average_equity = np.where(np.isnan(previous), equity, (equity + previous) / 2)
+
+        def divide(num, den):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where((den != 0) & ~np.isnan(den), num / den, np.nan)
+
+        return {
+            "current_ratio": divide(get("current_assets"), get("current_liabilities")),
+            "debt_to_equity": divide(liabilities, equity),
+            "roe": divide(get("net_income"), average_equity),
+            "operating_margin": divide(get("operating_income"), get("revenue")),
+            "interest_coverage": divide(ebit, np.abs(get("financial_expenses"))),
+        }
+
+    def to_dict(self) -> Dict:
+        """Partidas y ratios en JSON (sin NaN)."""
+        def clean(row):
+            return {p: (None if math.isnan(v) else round(float(v), 4)) for p, v in zip(self.periods, row)}
+
+        return {
+            "periods": self.periods,
+            "unit": self.unit,
+            "items": {item: {"label": ITEM_LABELS[item], "values": clean(self.get(item)), "source": source}
+                      for item, source in zip(self.items, self.sources)},
+            "ratios": {key: {"label": RATIOS[key][0], "formula": RATIOS[key][1], "values": clean(values)}
+                       for key, values in self.ratios().items()},
+        }
+
+    def save(self, directory: Path):
+        """Guarda la tabla junto a la KB (escritura atómica)."""
+        path = Path(directory) / self.FILENAME
+        tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}.npz")
+        np.savez(tmp, items=np.array(self.items, dtype=str), periods=np.array(self.periods, dtype=str),
+                 values=self.values, sources=np.array(self.sources, dtype=str), unit=np.array(self.unit))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["FinancialTable"]:
+        """Carga la tabla guardada; None si la KB es anterior a la extracción."""
+        path = Path(directory) / cls.FILENAME
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["items"].tolist(), data["periods"].tolist(), data["values"],
+                       data["sources"].tolist(), str(data["unit"]))
+
+
+def ratio_question(question: str) -> List[str]:
+    """Ratios que menciona la pregunta (en el orden de RATIOS); vacío si no pide ninguno."""
+    folded = fold(question)
+    if re.search(ALL_RATIOS_PATTERN, folded):
+        return list(RATIOS)
+    return [key for key, pattern in RATIO_QUESTION_PATTERNS.items() if re.search(pattern, folded)]
+
+
+def is_direct_ratio_question(question: str) -> bool:
+    """La pregunta pide solo cifras de ratios (sin políticas, explicaciones ni riesgos)."""
+    return bool(ratio_question(question)) and not NON_RATIO_WORDS.search(fold(question))
+
+
+def format_ratio(key: str, value: Optional[float]) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "No disponible"
+    if key in PERCENT_RATIOS:
+        return f"{value * 100:.2f}%"
+    return f"{value:.2f}x"
+
+
+def ratio_facts(name: str, table: Optional[FinancialTable], keys: Iterable[str] = RATIOS) -> List[str]:
+    """Líneas "- Nombre (período): valor  [fórmula]" con los ratios calculables de `table`."""
+    if table is None or table.empty:
+        return []
+    ratios = table.ratios()
+    lines = []
+    for key in keys:
+        for period, value in zip(table.periods, ratios[key]):
+            if not math.isnan(value):
+                lines.append(f"- {name}, {RATIOS[key][0]} {period}: {format_ratio(key, value)} "
+                             f"({RATIOS[key][1]})")
+    return lines
+
+
+def ratio_table(question: str, columns: Sequence[Tuple[str, Optional[FinancialTable]]]) -> Optional[str]:
+    """
+    Respuesta en Markdown a una pregunta de ratios, calculada sin el modelo:
+    una fila por ratio y período, una columna por entidad. None si alguna
+    entidad no tiene ninguno de los ratios pedidos (p. ej. sus estados no se
+    pudieron leer): entonces responde el modelo, con las cifras calculadas
+    como datos del prompt y los fragmentos de las notas.
+    """
+    keys = ratio_question(question)
+    computed = [(name, table, table.ratios() if table is not None and not table.empty else {})
+                for name, table in columns]
+    periods = sorted({p for _, table, _ in computed if table is not None for p in table.periods}, reverse=True)
+    rows = []
+    for key in keys:
+        for period in periods:
+            cells = []
+            for _, table, ratios in computed:
+                value = None
+                if ratios and period in table.periods:
+                    value = float(ratios[key][table.periods.index(period)])
+                cells.append(value)
+            if any(v is not None and not math.isnan(v) for v in cells):
+                rows.append((key, period, cells))
+    available = [any(cells[i] is not None and not math.isnan(cells[i]) for _, _, cells in rows)
+                 for i in range(len(columns))]
+    if not rows or not all(available):
+        return None
+    missing = [RATIOS[key][0] for key in keys if not any(k == key for k, _, _ in rows)]
+
+    header = "| Indicador | Período | " + " | ".join(name for name, _ in columns) + " | Fórmula |"
+    lines = [header, "|" + " --- |" * (len(columns) + 3)]
+    for key, period, cells in rows:
+        lines.append(f"| {RATIOS[key][0]} | {period} | "
+                     + " | ".join(format_ratio(key, v) for v in cells) + f" | {RATIOS[key][1]} |")
+    units = {table.unit for _, table, _ in computed if table is not None and table.unit}
+    lines.append("")
+    lines.append("Calculado a partir de las partidas de los estados financieros extraídas del PDF"
+                 + (f" (cifras en {', '.join(sorted(units))})" if units else "")
+                 + ". \"No disponible\": la partida no aparece en los estados principales del documento.")
+    if missing:
+        lines.append(f"Sin las partidas necesarias en ningún documento: {', '.join(missing)}.")
+    return "\n".join(lines)
@@ -0,0 +1,160 @@
+# ingest_jobs.py
+"""
+Trabajos de ingesta en segundo plano (extraer -> chunkear -> embeber -> guardar).
+
+- Un pool acotado de hilos (`max_workers`) ejecuta los trabajos; el resto
+  espera en cola. Si la cola supera `max_pending`, `submit` rechaza el trabajo.
+- Cada trabajo informa su etapa y avance (hechos/total); `to_dict()` traduce
+  eso a un porcentaje global ponderado por etapa y a un ETA.
+- Los trabajos terminados se conservan `ttl_seconds` para poder consultarlos.
+"""
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+# Peso de cada etapa en el porcentaje global (suman 1)
+STAGE_WEIGHTS = {"extract": 0.30, "chunk": 0.05, "embed": 0.60, "save": 0.05}
+STAGES = list(STAGE_WEIGHTS)
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+
+class QueueFullError(Exception):
+    """La cola de ingesta está llena."""
+
+
+@dataclass
+class IngestJob:
+    kb_id: str
+    filename: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    stage: Optional[str] = None
+    done: int = 0
+    total: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def progress(self, stage: str, done: int, total: int):
+        """Callback de avance: `stage` es una de STAGES."""
+        self.stage, self.done, self.total = stage, done, total
+
+    @property
+    def percent(self) -> float:
+        if self.status == DONE:
+            return 100.0
+        if self.stage not in STAGE_WEIGHTS:
+            return 0.0
+        index = STAGES.index(self.stage)
+        finished = sum(STAGE_WEIGHTS[s] for s in STAGES[:index])
+        fraction = self.done / self.total if self.total else 0.0
+        return round(100 * (finished + STAGE_WEIGHTS[self.stage] * min(fraction, 1.0)), 1)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Estimación lineal sobre el tiempo en ejecución; None si aún no hay avance suficiente."""
+        if self.status != RUNNING or self.started_at is None:
+            return None
+        percent = self.percent
+        if percent < 1:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed * (100 - percent) / percent, 1)
+
+    def to_dict(self) -> Dict:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "kb_id": self.kb_id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "percent": self.percent,
+            "eta_seconds": self.eta_seconds,
+            "elapsed_seconds": round(end - self.started_at, 1) if self.started_at else 0.0,
+            "error": self.error,
+        }
+
+
+class IngestJobManager:
+    """Cola de trabajos de ingesta con un pool de hilos acotado."""
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 8, ttl_seconds: float = 3600):
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest")
+        self._jobs: Dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_for(self, kb_id: str) -> Optional[IngestJob]:
+        """Trabajo en cola o en ejecución para esa KB, si lo hay."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kb_id == kb_id and job.status in (QUEUED, RUNNING):
+                    return job
+        return None
+
+    def completed(self, kb_id: str, filename: str) -> IngestJob:
+        """Registra un trabajo ya terminado (la KB existía): el cliente consulta igual que siempre."""
+        job = IngestJob(kb_id, filename, status=DONE, started_at=time.time())
+        job.finished_at = job.started_at
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def submit(self, kb_id: str, filename: str, run: Callable[[IngestJob], None]) -> Tuple[IngestJob, bool]:
+        """
+        Encola `run(job)` para la KB, o devuelve el trabajo activo si ya hay uno.
+        Devuelve (trabajo, si se creó ahora): si no, `run` nunca se ejecuta.
+        Lanza QueueFullError si hay `max_pending` trabajos esperando.
+        """
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.kb_id == kb_id and job.status in (QUEUED, RUNNING):
+                    return job, False
+            if sum(1 for job in self._jobs.values() if job.status == QUEUED) >= self.max_pending:
+                raise QueueFullError(f"Hay {self.max_pending} documentos en cola")
+            job = IngestJob(kb_id, filename)
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, run)
+        return job, True
+
+    def _run(self, job: IngestJob, run: Callable[[IngestJob], None]):
+        job.status, job.started_at = RUNNING, time.time()
+        try:
+            run(job)
+            job.status = DONE
+        except Exception as e:
+            job.status, job.error = ERROR, str(e)
+            print(f"[INGEST][ERROR] {job.filename} ({job.kb_id}): {e}")
+        finally:
+            job.finished_at = time.time()
+        if job.status == DONE:
+            print(f"[INGEST] {job.filename} ({job.kb_id}) en {job.finished_at - job.started_at:.1f}s")
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at and now - job.finished_at > self.ttl_seconds:
+                del self._jobs[job_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, ERROR)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
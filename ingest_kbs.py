@@ -0,0 +1,159 @@
+"""
+Ingesta offline de las bases de conocimiento, fuera del servidor web.
+
+Recorre las carpetas indicadas (por defecto EEFF_cargados/) más el PDF de
+SURA y construye cada KB en un proceso aparte. Los metadatos (empresa, país,
+año) salen del nombre del archivo, como en read_pdf_text. Un documento se
+salta si su KB ya se construyó desde el mismo PDF (sha256) con la misma
+PIPELINE_VERSION y el mismo espacio de embeddings; si cambió, solo se
+embeben los chunks nuevos o modificados (build_from_pdf). Al final escribe
+registry.json junto a las KBs: el servidor lo lee al arrancar y solo abre las
+KBs listadas, sin extraer ni embeber nada en el camino de las peticiones.
+
+Las claves de los presets son las de PRELOADED_FILES cuando el PDF está ahí;
+para el resto, el nombre del archivo en minúsculas (`SIM_MEX_2024.pdf` ->
+`sim_mex_2024`).
+
+Uso:
+    python ingest_kbs.py                        # SURA + EEFF_cargados/
+    python ingest_kbs.py EEFF_cargados mini     # varias carpetas
+    python ingest_kbs.py --workers 4 --force    # reconstruir todo con 4 procesos
+    python ingest_kbs.py --dry-run              # solo mostrar qué se construiría
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import app
+from kb_store import load_registry, read_manifest, save_registry
+from lexical_index import fold
+from pdf_extract import file_sha256
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_DIRS = [BASE_DIR / "EEFF_cargados"]
+
+
+def _source(path: Path) -> str:
+    """Ruta del PDF relativa al repo cuando se puede (el registro no depende de dónde se despliega)."""
+    try:
+        return path.resolve().relative_to(BASE_DIR).as_posix()
+    except ValueError:
+        return str(path.resolve())
+
+
+def preset_key(path: Path, known) -> str:
+    """Clave del preset: la de PRELOADED_FILES si el PDF está ahí, si no el nombre del archivo."""
+    return known.get(path.resolve()) or re.sub(r"[^a-z0-9]+", "_", fold(path.stem)).strip("_")
+
+
+def discover(dirs, include_sura: bool = True):
+    """Documentos a ingerir como [(clave, nombre de la KB, ruta del PDF)]."""
+    known = {path.resolve(): key for key, path in app.PRELOADED_FILES.items()}
+    documents = []
+    if include_sura and app.SURA_PDF_PATH.exists():
+        documents.append(("sura", "sura", app.SURA_PDF_PATH))
+    seen = {"sura"}
+    for directory in dirs:
+        for path in sorted(Path(directory).glob("*.pdf")):
+            key = preset_key(path, known)
+            if key in seen:
+                print(f"[WARN] {path.name}: la clave '{key}' ya está en uso, se omite")
+                continue
+            seen.add(key)
+            documents.append((key, f"preset_{key}", path))
+    return documents
+
+
+def build_kb(name: str, pdf_path: str, embed_workers: int, pdf_workers: int) -> dict:
+    """
+    Construye una KB en el proceso worker; devuelve su manifest y cuántos chunks
+    se reutilizaron de la versión anterior, se agregaron y se eliminaron.
+    """
+    kb = app.KnowledgeBase(name)
+    diff = kb.build_from_pdf(pdf_path, force_rebuild=True, embed_workers=embed_workers, pdf_workers=pdf_workers)
+    return read_manifest(kb.path), diff
+
+
+def registry_entry(name: str, path: Path, manifest: dict) -> dict:
+    return {
+        "kb": name,
+        "source": _source(path),
+        "source_sha256": manifest.get("source_sha256"),
+        "pipeline_version": manifest.get("pipeline_version"),
+        "chunks": manifest.get("count"),
+        "metadata": manifest.get("metadata", {}),
+        "built_at": manifest.get("created_at"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dirs", nargs="*", type=Path, default=DEFAULT_DIRS, help="Carpetas con PDFs")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, (os.cpu_count() or 1) // 2)),
+                        help="Procesos de construcción en paralelo")
+    parser.add_argument("--embed-workers", type=int, default=2, help="Hilos de embeddings por proceso")
+    parser.add_argument("--no-sura", action="store_true", help="No incluir el PDF de SURA")
+    parser.add_argument("--force", action="store_true", help="Reconstruir aunque la KB esté al día")
+    parser.add_argument("--dry-run", action="store_true", help="Solo mostrar qué se construiría")
+    args = parser.parse_args()
+
+    documents = discover(args.dirs, include_sura=not args.no_sura)
+    previous = (load_registry(app.KB_DIR) or {}).get("kbs", {})
+    entries, pending = {}, []
+    for key, name, path in documents:
+        kb = app.KnowledgeBase(name)
+        if not args.force and kb.is_current(file_sha256(path)):
+            entries[key] = registry_entry(name, path, read_manifest(kb.path))
+            print(f"[SKIP] {key}: al día ({path.name})")
+        else:
+            pending.append((key, name, path))
+            print(f"[BUILD] {key}: {path.name}")
+    if args.dry_run:
+        return 0
+
+    failed = []
+    start = time.perf_counter()
+    if pending:
+        # spawn: cada worker importa la app desde cero (sin hilos ni conexiones heredadas)
+        context = multiprocessing.get_context("spawn")
+        workers = min(args.workers, len(pending))
+        # Los núcleos se reparten entre los documentos en paralelo para la extracción de páginas
+        pdf_workers = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {
+                pool.submit(build_kb, name, str(path), args.embed_workers, pdf_workers): (key, name, path)
+                for key, name, path in pending
+            }
+            for future in as_completed(futures):
+                key, name, path = futures[future]
+                try:
+                    manifest, diff = future.result()
+                    entries[key] = registry_entry(name, path, manifest)
+                    print(f"[OK] {key}: {entries[key]['chunks']} chunks ({diff['reused']} reutilizados, "
+                          f"{diff['added']} nuevos, {diff['removed']} eliminados)")
+                except Exception as e:
+                    failed.append(key)
+                    print(f"[ERROR] {key}: {e}")
+                    # La KB anterior sigue en disco: mejor servirla que dejar la clave sin KB
+                    if key in previous:
+                        entries[key] = previous[key]
+
+    order = [key for key, _, _ in documents]
+    save_registry(app.KB_DIR, {
+        "pipeline_version": app.PIPELINE_VERSION,
+        **app.embedding_provider.describe(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "kbs": {key: entries[key] for key in order if key in entries},
+    })
+    print(f"Registro: {len(entries)} KBs ({len(pending) - len(failed)} construidas, {len(failed)} con error) "
+          f"en {time.perf_counter() - start:.1f}s -> {app.KB_DIR / 'registry.json'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+# kb_store.py
+"""
+Formato en disco de una base de conocimiento (un directorio por KB, con una
+subcarpeta inmutable por cada versión publicada):
+
+    <kb>/CURRENT                      nombre de la versión publicada (v-<sello>)
+    <kb>/v-<sello>/manifest.json      versión de esquema, modelo, dimensión, hash de la fuente, metadatos
+    <kb>/v-<sello>/vectors.npy        matriz float32 (n_chunks x dim) normalizada, se abre con mmap
+    <kb>/v-<sello>/chunks.bin         textos de los chunks en UTF-8, concatenados
+    <kb>/v-<sello>/chunk_offsets.npy  offsets int64 (n_chunks + 1) de cada chunk dentro de chunks.bin
+
+Publicar es escribir la versión completa en su propia carpeta y reemplazar
+CURRENT (un archivo pequeño) con os.replace: nunca se renombra ni se borra una
+carpeta que alguien pueda tener abierta, así que un lector siempre encuentra
+una versión completa y en Windows no choca con los mmap de la versión en uso.
+Las versiones anteriores se borran cuando ningún snapshot de este proceso las
+usa (se conservan las KB_KEEP_VERSIONS más recientes para los demás procesos).
+Las KBs sin CURRENT (archivos directamente en <kb>/) se siguen leyendo.
+
+Junto a las KBs, registry.json (escrito por ingest_kbs.py) lista qué KB sirve
+cada clave, de qué PDF y con qué versión del pipeline se construyó.
+
+Cargar es casi instantáneo (no se deserializa nada) y varios procesos que
+abren la misma KB comparten las páginas del sistema operativo.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SCHEMA_VERSION = 1
+MANIFEST = "manifest.json"
+VECTORS = "vectors.npy"
+CHUNKS = "chunks.bin"
+OFFSETS = "chunk_offsets.npy"
+# Registro de las KBs construidas por ingest_kbs.py (uno por directorio de KBs)
+REGISTRY = "registry.json"
+# Puntero a la versión publicada de la KB
+CURRENT = "CURRENT"
+VERSION_PREFIX = "v-"
+# Versiones que se conservan en disco (la publicada y las anteriores más recientes),
+# para que otro proceso que acaba de leer CURRENT alcance a abrir la suya
+KEEP_VERSIONS = max(1, int(os.getenv("KB_KEEP_VERSIONS", "2")))
+# Directorios temporales de escritura abandonados (p. ej. un proceso que murió)
+STALE_TMP_SECONDS = 3600
+
+# Carpetas de versiones con chunks o vectores abiertos (mmap) en este proceso
+_in_use: Dict[Path, int] = {}
+_in_use_lock = threading.Lock()
+
+
+class ChunkStore(Sequence):
+    """Secuencia de solo lectura de textos de chunks respaldada por chunks.bin (mmap)."""
+
+    def __init__(self, data, offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str]) -> "ChunkStore":
+        encoded = [t.encode("utf-8", errors="surrogatepass") for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return bytes(self._data[start:end]).decode("utf-8", errors="surrogatepass")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def raw(self) -> Tuple[bytes, np.ndarray]:
+        return bytes(self._data[:]), np.asarray(self._offsets)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def current_version(path: Path) -> Optional[str]:
+    """Nombre de la versión publicada (contenido de CURRENT), o None si la KB no tiene versiones."""
+    try:
+        version = (Path(path) / CURRENT).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def published_dir(path: Path) -> Tuple[Path, Optional[str]]:
+    """
+    (carpeta con los archivos de la versión publicada, sello que cambia con cada
+    publicación). Sin CURRENT, la carpeta es la KB misma y el sello sale del
+    manifest; el sello es None si no hay KB.
+    """
+    path = Path(path)
+    version = current_version(path)
+    if version is not None:
+        return path / version, version
+    try:
+        st = os.stat(path / MANIFEST)
+    except FileNotFoundError:
+        return path, None
+    return path, f"{st.st_ino}-{st.st_mtime_ns}"
+
+
+def is_kb_dir(path: Path) -> bool:
+    return (published_dir(path)[0] / MANIFEST).exists()
+
+
+def read_manifest(path: Path) -> Optional[Dict]:
+    """Manifest de la versión publicada de la KB sin abrir vectores ni chunks, o None si no existe."""
+    manifest_path = published_dir(path)[0] / MANIFEST
+    try:
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def load_registry(directory: Path) -> Optional[Dict]:
+    """Registro de KBs de `directory`, o None si nunca se corrió el ingester."""
+    registry_path = Path(directory) / REGISTRY
+    if not registry_path.exists():
+        return None
+    return json.loads(registry_path.read_text(encoding="utf-8"))
+
+
+def save_registry(directory: Path, registry: Dict):
+    """Escribe el registro de forma atómica (el servidor puede estar leyéndolo)."""
+    registry_path = Path(directory) / REGISTRY
+    tmp = registry_path.with_name(f"{REGISTRY}.tmp-{os.getpid()}")
+    tmp.write_text(json.dumps(registry, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, registry_path)
+
+
+def save_kb_dir(path: Path, chunks: Sequence[str], matrix: np.ndarray, manifest: Dict,
+                extra: Optional[Callable[[Path], None]] = None) -> Path:
+    """
+    Escribe la KB como una versión nueva y la publica reemplazando CURRENT, así
+    ningún lector ve una KB a medio escribir. `extra(directorio)` agrega otros
+    archivos (índices) antes de publicar. Devuelve la carpeta de la versión.
+    """
+    path = Path(path)
+    store = chunks if isinstance(chunks, ChunkStore) else ChunkStore.from_texts(chunks)
+    data, offsets = store.raw()
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] != len(store):
+        raise ValueError(f"La matriz {matrix.shape} no corresponde a {len(store)} chunks")
+
+    manifest = {
+        **manifest,
+        "schema_version": SCHEMA_VERSION,
+        "count": len(store),
+        "dim": int(matrix.shape[1]) if matrix.size else 0,
+        "dtype": "float32",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    path.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=path))
+    try:
+        np.save(tmp / VECTORS, matrix)
+        np.save(tmp / OFFSETS, offsets.astype(np.int64))
+        (tmp / CHUNKS).write_bytes(data)
+        if extra is not None:
+            extra(tmp)
+        (tmp / MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        # El sello se elige al publicar: las versiones quedan ordenadas por momento de publicación
+        version = f"{VERSION_PREFIX}{time.time_ns():020d}-{os.getpid()}"
+        os.rename(tmp, path / version)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    published = current_version(path)
+    if published is not None and published > version:
+        # Otro proceso publicó una versión más nueva mientras se escribía esta
+        shutil.rmtree(path / version, ignore_errors=True)
+        return path / published
+    _write_pointer(path, version)
+    collect_versions(path)
+    return path / version
+
+
+def _write_pointer(path: Path, version: str):
+    pointer = path / CURRENT
+    tmp = path / f".{CURRENT}.tmp-{os.getpid()}-{threading.get_ident()}"
+    tmp.write_text(version, encoding="utf-8")
+    for attempt in range(20):
+        try:
+            os.replace(tmp, pointer)
+            return
+        except PermissionError:
+            # Windows: un lector tiene CURRENT abierto en este instante
+            if attempt == 19:
+                tmp.unlink(missing_ok=True)
+                raise
+            time.sleep(0.05)
+
+
+def versions(path: Path) -> List[str]:
+    """Versiones en disco de la KB, de la más antigua a la más nueva."""
+    try:
+        return sorted(p.name for p in Path(path).iterdir() if p.is_dir() and p.name.startswith(VERSION_PREFIX))
+    except FileNotFoundError:
+        return []
+
+
+def collect_versions(path: Path, keep: int = KEEP_VERSIONS) -> List[str]:
+    """
+    Borra las versiones anteriores a la publicada salvo las `keep` más recientes
+    y las que algún snapshot de este proceso aún tiene abiertas; también los
+    archivos del formato sin versiones y las escrituras abandonadas. En Windows
+    lo que otro proceso tiene mapeado no se puede borrar: se reintenta la próxima vez.
+    Devuelve las versiones borradas.
+    """
+    path = Path(os.path.abspath(path))
+    published = current_version(path)
+    if published is None:
+        return []
+    older = [v for v in versions(path) if v < published]
+    removed = []
+    with _in_use_lock:
+        in_use = set(_in_use)
+    for version in older[:max(0, len(older) - (keep - 1))]:
+        if path / version in in_use:
+            continue
+        shutil.rmtree(path / version, ignore_errors=True)
+        if not (path / version).exists():
+            removed.append(version)
+
+    now = time.time()
+    for entry in path.iterdir():
+        try:
+            if entry.is_file() and path not in in_use and entry.name != CURRENT and not entry.name.startswith("."):
+                # Archivos del formato sin versiones (ya reemplazado por una versión)
+                entry.unlink()
+            elif entry.name.startswith(".tmp-") and now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                shutil.rmtree(entry, ignore_errors=True)
+        except OSError:
+            continue
+    return removed
+
+
+def _retain(directory: Path, *objects):
+    """Marca la carpeta como en uso mientras viva alguno de `objects` (chunks, matriz)."""
+    directory = Path(os.path.abspath(directory))
+    with _in_use_lock:
+        _in_use[directory] = _in_use.get(directory, 0) + len(objects)
+    for obj in objects:
+        weakref.finalize(obj, _release, directory)
+
+
+def _release(directory: Path):
+    with _in_use_lock:
+        count = _in_use.get(directory, 0) - 1
+        if count > 0:
+            _in_use[directory] = count
+        else:
+            _in_use.pop(directory, None)
+
+
+def _open_kb_dir(directory: Path) -> Tuple[ChunkStore, np.ndarray, Dict]:
+    manifest = json.loads((directory / MANIFEST).read_text(encoding="utf-8"))
+    version = manifest.get("schema_version")
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Versión de esquema no soportada en {directory}: {version}")
+
+    matrix = np.load(directory / VECTORS, mmap_mode="r")
+    offsets = np.load(directory / OFFSETS, mmap_mode="r")
+    if matrix.dtype != np.float32 or matrix.shape[0] != len(offsets) - 1:
+        raise ValueError(f"KB corrupta en {directory}: vectores {matrix.shape} {matrix.dtype}, "
+                         f"{len(offsets) - 1} chunks")
+
+    with open(directory / CHUNKS, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    store = ChunkStore(data, offsets)
+    _retain(directory, store, matrix)
+    return store, matrix, manifest
+
+
+def load_published(path: Path) -> Tuple[Path, Optional[str], ChunkStore, np.ndarray, Dict]:
+    """
+    Abre con mmap la versión publicada de la KB. Devuelve (carpeta de la
+    versión, sello, chunks, matriz float32 de solo lectura, manifest).
+    """
+    for attempt in range(3):
+        directory, stamp = published_dir(path)
+        try:
+            return (directory, stamp, *_open_kb_dir(directory))
+        except FileNotFoundError:
+            # Otro proceso publicó una versión nueva y borró esta justo entre medio
+            if attempt == 2 or published_dir(path)[1] == stamp:
+                raise
+    raise AssertionError("inalcanzable")
+
+
+def load_kb_dir(path: Path) -> Tuple[ChunkStore, np.ndarray, Dict]:
+    """Abre una KB con mmap. Devuelve (chunks, matriz float32 de solo lectura, manifest)."""
+    return load_published(path)[2:]
+
+
+def migrate_legacy_pickle(pkl_path: Path, kb_path: Path, model: str,
+                          source_dirs: Sequence[Path] = ()) -> Dict:
+    """
+    Convierte un `{name}_embeddings.pkl` antiguo al formato de directorio.
+    Las rutas absolutas de `pdf_path` se reducen al nombre del archivo; si ese
+    archivo está en alguno de `source_dirs`, se registra su sha256.
+    """
+    with open(pkl_path, "rb") as f:
+        data = pickle.load(f)
+    matrix = np.asarray(data["embeddings"], dtype=np.float32)
+    if matrix.size:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+    else:
+        matrix = matrix.reshape(0, 0)
+
+    metadata = dict(data.get("metadata") or {})
+    pdf_path = metadata.pop("pdf_path", None)
+    if pdf_path:
+        # Las rutas pueden venir de Windows: se toma el nombre tras el último separador
+        metadata["source_file"] = pdf_path.replace("\\", "/").rsplit("/", 1)[-1]
+
+    source_sha256 = None
+    for directory in source_dirs:
+        candidate = Path(directory) / metadata.get("source_file", "")
+        if metadata.get("source_file") and candidate.is_file():
+            source_sha256 = _sha256(candidate)
+            break
+
+    manifest = {
+        "name": kb_path.name,
+        "model": model,
+        "source_sha256": source_sha256,
+        "metadata": metadata,
+        "migrated_from": pkl_path.name,
+    }
+    save_kb_dir(kb_path, data["chunks"], matrix, manifest)
+    return manifest
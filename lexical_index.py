@@ -0,0 +1,151 @@
+# lexical_index.py
+"""
+Índice léxico BM25 sobre los chunks de una KB.
+
+- Tokenización para español: minúsculas, sin tildes (NFKD), stopwords y un
+  singularizador ligero ("arrendamientos" -> "arrendamiento"). Las referencias
+  como "2.4.6", "146-02" o "1,234,567" se conservan como un solo token.
+- Postings en arreglos NumPy (ids de chunk + frecuencias, con offsets por
+  término), guardados junto a la KB como `lexical.npz`.
+- Buscar no hace llamadas de red: tokenizar la pregunta y sumar las
+  contribuciones BM25 de unos pocos postings.
+
+También incluye la fusión por ranking recíproco (RRF) para la búsqueda híbrida.
+"""
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vector_index import top_k_indices
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,/-][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes aquel aquella aquellas aquellos aqui asi aun cada como con contra
+cual cuales cuando de del desde donde dos e el ella ellas ello ellos en entre era eran es esa esas ese
+eso esos esta estas este esto estos fue fueron ha han hasta hay la las le les lo los mas me mi mientras
+muy nada ni no nos o otra otras otro otros para pero poco por porque que quien quienes se sea sean segun
+ser si sido sin sobre su sus tal tambien tan tanto te tiene tienen toda todas todo todos tu u un una
+unas uno unos y ya cuanto
+""".split())
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes ni diacríticos."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _singular(token: str) -> str:
+    """Singularizador ligero: solo quita el plural en palabras (no en números ni referencias)."""
+    if len(token) <= 4 or not token.isalpha():
+        return token
+    if token.endswith("ces"):
+        return token[:-3] + "z"
+    if token.endswith("es") and token[-3] in "lrndj":
+        return token[:-2]
+    if token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str, folded: bool = False) -> List[str]:
+    """Términos de `text`; `folded=True` si ya pasó por `fold` (se ahorra repetirlo)."""
+    return [_singular(t) for t in _TOKEN_RE.findall(text if folded else fold(text)) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Índice invertido con puntuación BM25 (k1, b clásicos)."""
+
+    FILENAME = "lexical.npz"
+
+    def __init__(self, terms: Sequence[str], offsets: np.ndarray, doc_ids: np.ndarray,
+                 freqs: np.ndarray, doc_lengths: np.ndarray):
+        self.terms = list(terms)
+        self.term_ids: Dict[str, int] = {t: i for i, t in enumerate(self.terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.freqs = freqs
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if doc_lengths.size else 0.0
+
+    @property
+    def count(self) -> int:
+        return int(self.doc_lengths.shape[0])
+
+    @classmethod
+    def build(cls, chunks: Iterable[str]) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for doc, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc, freq))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[t]) for t in terms], out=offsets[1:])
+        flat = [p for t in terms for p in postings[t]]
+        doc_ids = np.array([d for d, _ in flat], dtype=np.int32)
+        freqs = np.array([f for _, f in flat], dtype=np.float32)
+        return cls(terms, offsets, doc_ids, freqs, np.array(lengths, dtype=np.float32))
+
+    def search(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, puntajes) de los top_k chunks con puntaje > 0, en orden descendente."""
+        n = self.count
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            lo, hi = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tf = self.doc_ids[lo:hi], self.freqs[lo:hi]
+            idf = np.log1p((n - (hi - lo) + 0.5) / ((hi - lo) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / max(self.avg_length, 1e-9))
+            # Cada chunk aparece una sola vez por término: la suma indexada es segura
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ids = top_k_indices(scores, top_k)
+        ids = ids[scores[ids] > 0]
+        return ids, scores[ids]
+
+    def save(self, directory: Path):
+        """Guarda el índice junto a la KB (escritura atómica)."""
+        path = Path(directory) / self.FILENAME
+        tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}.npz")
+        np.savez(tmp, terms=np.array(self.terms, dtype=str), offsets=self.offsets,
+                 doc_ids=self.doc_ids, freqs=self.freqs, doc_lengths=self.doc_lengths)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory: Path, count: Optional[int] = None) -> Optional["BM25Index"]:
+        """Carga el índice guardado; None si no existe o no tiene `count` chunks."""
+        path = Path(directory) / cls.FILENAME
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(data["terms"].tolist(), data["offsets"], data["doc_ids"],
+                        data["freqs"], data["doc_lengths"])
+        if count is not None and index.count != count:
+            return None
+        return index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], top_k: int, k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fusiona rankings de ids (mejor primero) con RRF: suma de 1 / (k + posición)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            fused[int(doc)] = fused.get(int(doc), 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:top_k]
@@ -0,0 +1,46 @@
+"""
+Migración única de las KBs en pickle (`embeddings/*_embeddings.pkl`) al
+formato de directorio de kb_store (manifest + vectors.npy con mmap + chunks).
+
+Uso:
+    python migrate_kb_pickles.py            # convierte y conserva los .pkl
+    python migrate_kb_pickles.py --delete   # convierte y borra los .pkl
+"""
+import argparse
+import time
+from pathlib import Path
+
+from embedding_pipeline import EMBEDDING_MODEL
+from kb_store import is_kb_dir, load_kb_dir, migrate_legacy_pickle
+
+BASE_DIR = Path(__file__).resolve().parent
+EMBEDDINGS_DIR = BASE_DIR / "embeddings"
+# Dónde buscar el PDF original para registrar su hash en el manifest
+SOURCE_DIRS = [BASE_DIR / "EEFF_cargados", BASE_DIR, BASE_DIR / "mini"]
+LEGACY_SUFFIX = "_embeddings.pkl"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", type=Path, default=EMBEDDINGS_DIR)
+    parser.add_argument("--delete", action="store_true", help="Borrar el .pkl tras migrarlo")
+    parser.add_argument("--force", action="store_true", help="Sobrescribir KBs ya migradas")
+    args = parser.parse_args()
+
+    for pkl_path in sorted(args.dir.glob(f"*{LEGACY_SUFFIX}")):
+        kb_path = args.dir / pkl_path.name[:-len(LEGACY_SUFFIX)]
+        if is_kb_dir(kb_path) and not args.force:
+            print(f"[SKIP] {kb_path.name} ya existe")
+        else:
+            start = time.perf_counter()
+            manifest = migrate_legacy_pickle(pkl_path, kb_path, EMBEDDING_MODEL, SOURCE_DIRS)
+            chunks, matrix, _ = load_kb_dir(kb_path)
+            print(f"[OK] {pkl_path.name} -> {kb_path.name}/ ({len(chunks)} chunks, dim {matrix.shape[1]}, "
+                  f"{time.perf_counter() - start:.2f}s) metadata={manifest['metadata']}")
+        if args.delete:
+            pkl_path.unlink()
+            print(f"     borrado {pkl_path.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# pdf_extract.py
+"""
+Extracción de texto de PDFs con PyPDF2.
+
+- Las páginas se reparten en rangos entre un pool de procesos (es trabajo de CPU).
+- El texto de cada página se cachea en disco por (sha256 del PDF, nº de página),
+  así que reconstrucciones y re-subidas no vuelven a extraer.
+- `iter_pdf_pages` entrega (página, texto) en orden a medida que se extraen.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import PyPDF2
+
+PAGE_CACHE_DIR = Path(os.getenv("PDF_PAGE_CACHE_DIR", Path(__file__).resolve().parent / "cache" / "pages"))
+EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+PAGES_PER_TASK = 16
+
+
+def file_sha256(file_path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _open_reader(f) -> PyPDF2.PdfReader:
+    reader = PyPDF2.PdfReader(f)
+    if getattr(reader, "is_encrypted", False):
+        try:
+            reader.decrypt("")
+        except Exception:
+            pass
+    return reader
+
+
+def _page_count(file_path) -> int:
+    with open(file_path, "rb") as f:
+        return len(_open_reader(f).pages)
+
+
+def _extract_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extrae las páginas [start, end). Se ejecuta en los procesos del pool."""
+    with open(file_path, "rb") as f:
+        reader = _open_reader(f)
+        return [(i, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+class _PageCache:
+    """Texto por página en `<cache_dir>/<sha256>/NNNNN.txt`, más el número de páginas."""
+
+    def __init__(self, cache_dir: Path, digest: str):
+        self.dir = Path(cache_dir) / digest
+
+    def _page_path(self, page: int) -> Path:
+        return self.dir / f"{page:05d}.txt"
+
+    def page_count(self) -> Optional[int]:
+        try:
+            return json.loads((self.dir / "meta.json").read_text(encoding="utf-8"))["pages"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def set_page_count(self, pages: int):
+        self._write(self.dir / "meta.json", json.dumps({"pages": pages}))
+
+    def has(self, page: int) -> bool:
+        return self._page_path(page).exists()
+
+    def get(self, page: int) -> str:
+        return self._page_path(page).read_text(encoding="utf-8", errors="surrogatepass")
+
+    def put(self, page: int, text: str):
+        self._write(self._page_path(page), text)
+
+    def _write(self, path: Path, text: str):
+        # Escritura atómica: otro proceso nunca ve un archivo a medio escribir
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(text, encoding="utf-8", errors="surrogatepass")
+        os.replace(tmp, path)
+
+
+def _missing_ranges(missing: List[int], pages_per_task: int) -> List[Tuple[int, int]]:
+    """Agrupa páginas faltantes consecutivas en rangos de hasta pages_per_task."""
+    ranges = []
+    for page in missing:
+        if ranges and ranges[-1][1] == page and page - ranges[-1][0] < pages_per_task:
+            ranges[-1] = (ranges[-1][0], page + 1)
+        else:
+            ranges.append((page, page + 1))
+    return ranges
+
+
+def iter_pdf_pages(file_path, workers: int = EXTRACT_WORKERS,
+                   cache_dir: Optional[Path] = PAGE_CACHE_DIR,
+                   pages_per_task: int = PAGES_PER_TASK,
+                   on_progress: Optional[Callable[[int, int], None]] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Genera (nº de página, texto) en orden. Las páginas cacheadas salen de
+    inmediato; las demás se extraen en paralelo (`workers` procesos) y se
+    cachean. `cache_dir=None` desactiva la caché.
+    `on_progress(páginas hechas, total)` se llama tras cada página.
+    """
+    file_path = str(file_path)
+    cache = _PageCache(cache_dir, file_sha256(file_path)) if cache_dir else None
+
+    n_pages = cache.page_count() if cache else None
+    if n_pages is None:
+        n_pages = _page_count(file_path)
+        if cache:
+            cache.set_page_count(n_pages)
+
+    missing = [i for i in range(n_pages) if not (cache and cache.has(i))]
+    ranges = _missing_ranges(missing, pages_per_task)
+    workers = min(max(1, workers), len(ranges)) if ranges else 1
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    futures = {start: pool.submit(_extract_range, file_path, start, end) for start, end in ranges} if pool else {}
+    range_at = {start: end for start, end in ranges}
+    reader_file = None
+    try:
+        page = 0
+        while page < n_pages:
+            if page not in range_at:
+                yield page, cache.get(page)
+                page += 1
+                if on_progress:
+                    on_progress(page, n_pages)
+                continue
+            end = range_at[page]
+            if pool:
+                extracted = futures[page].result()
+            else:
+                # Sin pool: un solo lector abierto y página por página
+                if reader_file is None:
+                    reader_file = open(file_path, "rb")
+                    reader = _open_reader(reader_file)
+                extracted = ((i, reader.pages[i].extract_text() or "") for i in range(page, end))
+            for i, text in extracted:
+                if cache:
+                    cache.put(i, text)
+                yield i, text
+                if on_progress:
+                    on_progress(i + 1, n_pages)
+            page = end
+    finally:
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if reader_file is not None:
+            reader_file.close()
+
+
+def extract_pdf_text(file_path, **kwargs) -> str:
+    """Texto completo del PDF (páginas no vacías unidas por salto de línea)."""
+    return "\n".join(text for _, text in iter_pdf_pages(file_path, **kwargs) if text).strip()
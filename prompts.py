@@ -4,6 +4,11 @@ import re
 from textwrap import dedent
 import os
 
+from context_packing import pack_document
+
+# Tokens del documento que entran en los prompts de documento completo (antes: 35000 caracteres)
+DOCUMENT_TOKEN_BUDGET = int(os.getenv("PROMPT_DOCUMENT_TOKENS", "8000"))
+
 SURA_LEASE_POLICY = dedent("""
 Nota 2.4.6. Arrendamientos 
 Grupo SURA evalúa al inicio del contrato si un contrato es, o contiene, un arrendamiento. Es decir, si el contrato 
@@ -181,20 +186,14 @@ def _clean_text(text: str) -> str:
     return t.strip()
 
 
-def _truncate_middle(text: str, max_chars: int = 35000, head: int = 20000) -> str:
+def _fit_document(text: str, question: str, budget: int = DOCUMENT_TOKEN_BUDGET) -> str:
     """
-    Si el texto excede max_chars, conserva el inicio (head) y el final
-    (lo que quepa) separándolos con un marcador. Así evitamos prompts enormes.
+    Si el texto excede `budget` tokens, conserva los fragmentos más relevantes
+    para la pregunta (sin duplicados, en el orden del documento) en lugar de
+    cortar por caracteres el medio del documento. Ver context_packing.pack_document.
     """
-    if len(text) <= max_chars:
-        return text
-    tail = max_chars - head - len("\n\n[... CONTENIDO RECORTADO ...]\n\n")
-    tail = max(tail, 0)
-    return (
-        text[:head]
-        + "\n\n[... CONTENIDO RECORTADO ...]\n\n"
-        + (text[-tail:] if tail > 0 else "")
-    )
+    packed, _ = pack_document(text, question, budget)
+    return packed
     
 def save_prompt_to_file(prompt: str, filepath: str = "debug/prompt.txt") -> str:
     """
@@ -219,7 +218,7 @@ def generate_prompt_like_robot(pdf_text: str, question: str) -> str:
     Devuelve un string listo para enviar al modelo.
     """
     pdf_text = _clean_text(pdf_text)
-    pdf_text = _truncate_middle(pdf_text, max_chars=35000, head=20000)
+    pdf_text = _fit_document(pdf_text, question)
 
     prompt = dedent(f"""
     <ROLE>
@@ -298,7 +297,7 @@ def generate_prompt(pdf_text: str, question: str, pais : str, empresa: str, anio
     incorporando la Nota 2.4.6 de SURA como referencia base para arrendamientos.
     """
     pdf_text = _clean_text(pdf_text)
-    pdf_text = _truncate_middle(pdf_text, max_chars=35000, head=20000)
+    pdf_text = _fit_document(pdf_text, question)
 
     prompt = dedent(f"""
     <ROLE>
@@ -0,0 +1,278 @@
+# telemetry.py
+"""
+Trazas por petición y métricas en formato Prometheus, sin dependencias.
+
+- `start_trace(nombre, request_id)` abre la traza de una petición (o de un
+  trabajo de ingesta, con `trace(...)`); `span(etapa, **atributos)` mide una
+  etapa dentro de ella: extract, chunk, embed, search, prompt, completion...
+- `add_tokens(tipo, n)` suma tokens (embedding, prompt, completion) a la
+  traza y al contador global.
+- Al cerrar la traza se escribe una línea JSON con el id, la duración de cada
+  etapa, sus atributos y los tokens (TRACE_LOG: "-" = stdout, una ruta de
+  archivo, o vacío = sin log).
+- Cada etapa alimenta el histograma `sura_stage_duration_seconds`;
+  `render_metrics()` devuelve todo en el formato de texto de Prometheus.
+
+Con TRACING=0, `span` devuelve un contexto vacío compartido y nada se mide.
+Las trazas viajan en un ContextVar: los hilos de un pool la heredan solo si
+se les pasa el contexto (`contextvars.copy_context().run`).
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+ENABLED = os.getenv("TRACING", "1") != "0"
+TRACE_LOG = os.getenv("TRACE_LOG", "-")
+
+# Límites de los histogramas en segundos (de 1 ms a 2 minutos)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por bucket (no acumulados), suma, total]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("sura_stage_duration_seconds", "Duración de cada etapa (extract, chunk, embed, search, "
+                          "prompt, completion...)", ("stage",))
+REQUEST_SECONDS = Histogram("sura_request_duration_seconds", "Duración total por endpoint", ("endpoint",),
+                            REQUEST_BUCKETS)
+REQUESTS = Counter("sura_requests_total", "Peticiones trazadas por endpoint y código de estado", ("endpoint", "status"))
+TOKENS = Counter("sura_tokens_total", "Tokens por tipo (embedding, prompt, completion)", ("kind",))
+CALLS = Counter("sura_api_calls_total", "Llamadas a la API por etapa", ("stage",))
+METRICS = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, TOKENS, CALLS]
+
+
+class Trace:
+    """Etapas y tokens de una petición (o de un trabajo de ingesta)."""
+
+    def __init__(self, name: str, request_id: Optional[str] = None):
+        self.name = name
+        self.id = request_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.status = None
+        self.spans: List[Dict] = []
+        self.tokens: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "request_id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+                "duration_ms": round((time.perf_counter() - self.start) * 1000, 2),
+                "stages": list(self.spans),
+                "tokens": dict(self.tokens),
+            }
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("sura_trace", default=None)
+_log_lock = threading.Lock()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current.get()
+    return trace.id if trace else None
+
+
+class Span:
+    """Etapa medida; `set(...)` agrega atributos (chunks, kb, calls...)."""
+
+    __slots__ = ("stage", "attrs", "start")
+
+    def __init__(self, stage: str, attrs: Dict):
+        self.stage, self.attrs = stage, attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(seconds, stage=self.stage)
+        if self.attrs.get("calls"):
+            CALLS.inc(self.attrs["calls"], stage=self.stage)
+        trace = _current.get()
+        if trace is not None:
+            record = {"stage": self.stage, "ms": round(seconds * 1000, 3), **self.attrs}
+            if exc_type is not None:
+                record["error"] = exc_type.__name__
+            with trace._lock:
+                trace.spans.append(record)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage: str, **attrs):
+    """Mide una etapa: `with span("search", kb=...) as s: ...; s.set(results=3)`."""
+    if not ENABLED:
+        return _NOOP
+    return Span(stage, attrs)
+
+
+def add_tokens(kind: str, count: Optional[int]):
+    """Suma `count` tokens de `kind` (embedding, prompt, completion) a la traza y al contador."""
+    if not ENABLED or not count:
+        return
+    TOKENS.inc(count, kind=kind)
+    trace = _current.get()
+    if trace is not None:
+        with trace._lock:
+            trace.tokens[kind] = trace.tokens.get(kind, 0) + int(count)
+
+
+def add_usage(usage: Optional[Dict]):
+    """Tokens de prompt y respuesta desde el `usage` de una completion."""
+    if usage:
+        add_tokens("prompt", usage.get("prompt_tokens"))
+        add_tokens("completion", usage.get("completion_tokens"))
+
+
+def start_trace(name: str, request_id: Optional[str] = None) -> Optional[contextvars.Token]:
+    """Abre la traza en el contexto actual; None si el tracing está desactivado."""
+    if not ENABLED:
+        return None
+    return _current.set(Trace(name, request_id))
+
+
+def finish_trace(token: Optional[contextvars.Token], status=None):
+    """Cierra la traza abierta con `start_trace`: métricas de la petición y línea JSON."""
+    if token is None:
+        return
+    trace = _current.get()
+    try:
+        _current.reset(token)
+    except ValueError:
+        # El token es de otro contexto (p. ej. un stream que terminó en otro hilo)
+        _current.set(None)
+    if trace is None:
+        return
+    trace.status = status if status is not None else trace.status
+    record = trace.to_dict()
+    REQUEST_SECONDS.observe(record["duration_ms"] / 1000, endpoint=trace.name)
+    REQUESTS.inc(endpoint=trace.name, status=trace.status)
+    _write_log(record)
+
+
+@contextmanager
+def trace(name: str, request_id: Optional[str] = None) -> Iterator[Optional[Trace]]:
+    """Traza fuera de una petición HTTP (p. ej. un trabajo de ingesta)."""
+    token = start_trace(name, request_id)
+    status = "ok"
+    try:
+        yield current_trace()
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        finish_trace(token, status)
+
+
+def _write_log(record: Dict):
+    if not TRACE_LOG:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _log_lock:
+        if TRACE_LOG == "-":
+            print(line, file=sys.stdout, flush=True)
+        else:
+            with open(TRACE_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
@@ -0,0 +1,160 @@
+# upload_cache.py
+"""
+Caché persistente de KBs de PDFs subidos.
+
+- Las subidas se identifican por el sha256 de sus bytes, calculado mientras
+  werkzeug escribe el cuerpo de la petición (HashingRequest).
+- Las KBs quedan en disco y se reutilizan en preguntas posteriores.
+- Un hilo de fondo expulsa KBs por TTL y, si se supera la cuota de disco,
+  por LRU (se usa el mtime, que se actualiza en cada uso).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from flask import Request
+from werkzeug.datastructures import FileStorage
+
+
+class HashingStream:
+    """Archivo temporal que acumula el sha256 de todo lo que se le escribe."""
+
+    def __init__(self, max_memory: int = 500 * 1024):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory, mode="w+b")
+        self._hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class HashingRequest(Request):
+    """Request de Flask cuyos archivos subidos se hashean mientras llegan."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingStream()
+
+
+def upload_digest(file: FileStorage) -> str:
+    """sha256 del archivo subido; si no pasó por HashingRequest, se calcula leyéndolo."""
+    if isinstance(file.stream, HashingStream):
+        return file.stream.hexdigest()
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.stream.read(1024 * 1024), b""):
+        digest.update(block)
+    file.stream.seek(0)
+    return digest.hexdigest()
+
+
+def _disk_usage(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size
+
+
+class UploadKBStore:
+    """
+    Gestiona las KBs subidas (`{prefix}{kb_id}{suffix}` en `directory`, archivo o
+    directorio): acceso (touch), expulsión por TTL/cuota y barrido periódico.
+    """
+
+    def __init__(self, directory: Path, prefix: str = "upload_", suffix: str = "",
+                 ttl_seconds: float = 72 * 3600, quota_bytes: int = 500 * 1024 * 1024,
+                 sweep_interval: float = 600, on_evict: Optional[Callable[[str], None]] = None):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.suffix = suffix
+        self.ttl_seconds = ttl_seconds
+        self.quota_bytes = quota_bytes
+        self.sweep_interval = sweep_interval
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def path_for(self, kb_id: str) -> Path:
+        return self.directory / f"{self.prefix}{kb_id}{self.suffix}"
+
+    def kb_id_for(self, path: Path) -> str:
+        return path.name[len(self.prefix):len(path.name) - len(self.suffix)]
+
+    def touch(self, kb_id: str):
+        """Marca la KB como usada ahora (para el LRU)."""
+        try:
+            os.utime(self.path_for(kb_id))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, path: Path):
+        try:
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        except FileNotFoundError:
+            return
+        if self.on_evict:
+            self.on_evict(self.kb_id_for(path))
+
+    def sweep(self) -> List[str]:
+        """Expulsa KBs vencidas por TTL y luego las menos usadas hasta quedar bajo la cuota."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for path in self.directory.glob(f"{self.prefix}*{self.suffix}"):
+                # Restos de escrituras del formato anterior (`.tmp-<pid>`, `.old-<pid>`) no son KBs
+                if "." in self.kb_id_for(path):
+                    continue
+                try:
+                    entries.append((path.stat().st_mtime, _disk_usage(path), path))
+                except FileNotFoundError:
+                    continue
+            entries.sort(key=lambda e: e[0])
+
+            evicted = []
+            kept = []
+            for mtime, size, path in entries:
+                if now - mtime > self.ttl_seconds:
+                    self._evict(path)
+                    evicted.append(self.kb_id_for(path))
+                else:
+                    kept.append((mtime, size, path))
+
+            total = sum(size for _, size, _ in kept)
+            for mtime, size, path in kept:
+                if total <= self.quota_bytes:
+                    break
+                self._evict(path)
+                evicted.append(self.kb_id_for(path))
+                total -= size
+            return evicted
+
+    def start_sweeper(self):
+        """Lanza (una sola vez) el hilo que barre periódicamente."""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, name="upload-kb-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            try:
+                evicted = self.sweep()
+                if evicted:
+                    print(f"[UPLOADS] KBs expulsadas: {', '.join(evicted)}")
+            except Exception as e:
+                print(f"[UPLOADS][ERROR] Barrido de KBs: {e}")
+            time.sleep(self.sweep_interval)
@@ -0,0 +1,352 @@
+# vector_index.py
+"""
+Índices de vectores para la búsqueda de KnowledgeBase.
+
+- FlatIndex: búsqueda exacta (un GEMM contra toda la matriz). Es el valor por
+  defecto y lo más rápido para KBs de unos pocos miles de chunks.
+- IVFIndex: índice aproximado (inverted file) en NumPy puro. Agrupa los
+  vectores con k-means esférico en `nlist` listas y en cada consulta solo
+  puntúa los chunks de las `nprobe` listas más cercanas. Subir `nprobe` mejora
+  el recall a costa de latencia; `nprobe == nlist` equivale a la búsqueda exacta.
+- CompactIndex: búsqueda sobre una copia compacta de la matriz, con menos
+  dimensiones (las primeras `KB_VECTOR_DIM`, renormalizadas) y/o cuantizada a
+  int8 con una escala por vector. Opcionalmente vuelve a puntuar los mejores
+  `KB_RESCORE` candidatos con la matriz float32 exacta.
+
+Todos los índices trabajan sobre la matriz float32 normalizada de la KB (que
+puede ser un mmap) y no la copian. Los que necesitan estado propio lo guardan
+junto a la KB (`index_<tipo>.npz`) y se reconstruyen si ya no corresponde.
+"""
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+INDEX_KINDS = ("flat", "ivf", "compact")
+# "flat" (exacto), "ivf" (aproximado, menos latencia en KBs grandes) o
+# "compact" (menos memoria: dimensiones recortadas y/o int8; algo más lento
+# que flat con todas las dimensiones y con recall < 1 si no se re-puntúa)
+INDEX_KIND = os.getenv("KB_INDEX", "flat").lower()
+# Por debajo de este tamaño se usa siempre la búsqueda exacta
+INDEX_MIN_CHUNKS = int(os.getenv("KB_INDEX_MIN_CHUNKS", "5000"))
+# 0 = automático (~sqrt(n_chunks))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_TRAIN_ITERS = 10
+# Muestras por lista para entrenar k-means (el resto solo se asigna)
+IVF_TRAIN_PER_LIST = 64
+
+# KB_INDEX=compact: dimensiones que se conservan (0 = todas), cuantización
+# ("int8" o "none") y candidatos que se re-puntúan en float32 (0 = ninguno)
+COMPACT_DIM = int(os.getenv("KB_VECTOR_DIM", "0"))
+COMPACT_QUANTIZATION = os.getenv("KB_QUANTIZATION", "int8").lower()
+COMPACT_RESCORE = int(os.getenv("KB_RESCORE", "0"))
+# Filas por bloque al construir los códigos
+COMPACT_BLOCK = 4096
+# Bytes de cada bloque de códigos int8 pasado a float32 al buscar: que quepa en
+# la caché del procesador es casi 2 veces más rápido que bloques grandes
+COMPACT_SEARCH_BLOCK_BYTES = 1 << 20
+
+SearchResult = Tuple[np.ndarray, np.ndarray]  # (índices, puntajes) en orden descendente
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Índices de los top_k puntajes en orden descendente.
+    Usa argpartition (O(n)) y solo ordena los k candidatos.
+    """
+    n = scores.shape[0]
+    if top_k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if top_k >= n:
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class FlatIndex:
+    """Búsqueda exacta por producto interno sobre toda la matriz."""
+
+    kind = "flat"
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    def search(self, queries: np.ndarray, top_k: int) -> List[SearchResult]:
+        scores = queries @ self.matrix.T
+        results = []
+        for row in scores:
+            ids = top_k_indices(row, top_k)
+            results.append((ids, row[ids]))
+        return results
+
+    def save(self, directory: Path):
+        pass
+
+    def stats(self) -> dict:
+        return {"kind": self.kind, "count": int(self.matrix.shape[0])}
+
+
+class IVFIndex:
+    """
+    Inverted file con k-means esférico. Los chunks se guardan agrupados por
+    lista (`order` + `offsets`) para que reunir los candidatos sea un slice.
+    """
+
+    kind = "ivf"
+    FILENAME = "index_ivf.npz"
+
+    def __init__(self, matrix: np.ndarray, centroids: np.ndarray, order: np.ndarray,
+                 offsets: np.ndarray, nprobe: int = IVF_NPROBE):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+              iters: int = IVF_TRAIN_ITERS, seed: int = 0) -> "IVFIndex":
+        n = matrix.shape[0]
+        nlist = nlist or max(1, int(round(np.sqrt(n))))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(seed)
+
+        sample_size = min(n, nlist * IVF_TRAIN_PER_LIST)
+        sample = np.asarray(matrix[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            # Suma por lista como un GEMM con la matriz one-hot de asignaciones
+            one_hot = np.zeros((sample_size, nlist), dtype=np.float32)
+            one_hot[np.arange(sample_size), assign] = 1.0
+            sums = one_hot.T @ sample
+            norms = np.linalg.norm(sums, axis=1)
+            # Las listas que quedaron vacías conservan su centroide anterior
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        assign = _assign(matrix, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        return cls(matrix, centroids, order, offsets, nprobe=nprobe)
+
+    def search(self, queries: np.ndarray, top_k: int, nprobe: Optional[int] = None) -> List[SearchResult]:
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = queries @ self.centroids.T
+        results = []
+        for query, probe_scores in zip(queries, probes):
+            lists = top_k_indices(probe_scores, nprobe)
+            ids = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+            if ids.size == 0:
+                results.append((ids, np.empty(0, dtype=np.float32)))
+                continue
+            ids.sort()  # lectura secuencial del mmap
+            scores = self.matrix[ids] @ query
+            best = top_k_indices(scores, top_k)
+            results.append((ids[best], scores[best]))
+        return results
+
+    def save(self, directory: Path):
+        """Guarda el índice junto a la KB (escritura atómica)."""
+        path = Path(directory) / self.FILENAME
+        tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}.npz")
+        np.savez(tmp, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                 shape=np.array(self.matrix.shape, dtype=np.int64))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory: Path, matrix: np.ndarray, nprobe: int = IVF_NPROBE) -> Optional["IVFIndex"]:
+        """Carga el índice guardado; None si no existe o no corresponde a la matriz."""
+        path = Path(directory) / cls.FILENAME
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            if tuple(data["shape"]) != matrix.shape:
+                return None
+            return cls(matrix, data["centroids"], data["order"], data["offsets"], nprobe=nprobe)
+
+    def stats(self) -> dict:
+        sizes = np.diff(self.offsets)
+        return {
+            "kind": self.kind,
+            "count": int(self.matrix.shape[0]),
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "max_list": int(sizes.max()) if sizes.size else 0,
+        }
+
+
+class CompactIndex:
+    """
+    Búsqueda exacta sobre códigos compactos de la matriz. Recortar a las
+    primeras `dim` componentes y renormalizar es lo mismo que pedir
+    `dimensions` a text-embedding-3, sin volver a embeber; con int8 cada fila
+    se guarda como enteros con su escala (max |x| / 127), 4 veces menos que
+    float32. Los códigos van en un .npy aparte que se abre con mmap, así que
+    en memoria solo tienen que estar ellos: la matriz float32 queda en disco y
+    con `rescore` solo se leen las filas de los candidatos a re-puntuar.
+    """
+
+    kind = "compact"
+    FILENAME = "index_compact.npz"
+    CODES = "index_compact.npy"
+    QUANTIZATIONS = ("int8", "none")
+
+    def __init__(self, matrix: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray],
+                 rescore: int = COMPACT_RESCORE):
+        self.matrix = matrix
+        self.codes = codes
+        self.scales = scales
+        self.rescore = rescore
+
+    @property
+    def dim(self) -> int:
+        return self.codes.shape[1]
+
+    @property
+    def quantization(self) -> str:
+        return "int8" if self.scales is not None else "none"
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, dim: int = COMPACT_DIM, quantization: str = COMPACT_QUANTIZATION,
+              rescore: int = COMPACT_RESCORE) -> "CompactIndex":
+        if quantization not in cls.QUANTIZATIONS:
+            raise ValueError(f"Cuantización desconocida: {quantization} (usa {', '.join(cls.QUANTIZATIONS)})")
+        n, full = matrix.shape
+        dim = min(dim or full, full)
+        int8 = quantization == "int8"
+        codes = np.empty((n, dim), dtype=np.int8 if int8 else np.float32)
+        scales = np.empty(n, dtype=np.float32) if int8 else None
+        for start in range(0, n, COMPACT_BLOCK):
+            block = _truncate(np.asarray(matrix[start:start + COMPACT_BLOCK], dtype=np.float32), dim)
+            if int8:
+                block_scales = np.abs(block).max(axis=1) / 127.0
+                block_scales[block_scales == 0] = 1.0
+                codes[start:start + COMPACT_BLOCK] = np.rint(block / block_scales[:, None])
+                scales[start:start + COMPACT_BLOCK] = block_scales
+            else:
+                codes[start:start + COMPACT_BLOCK] = block
+        return cls(matrix, codes, scales, rescore=rescore)
+
+    def approximate_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Puntajes (n_consultas x n_chunks) contra los códigos compactos."""
+        queries = _truncate(np.asarray(queries, dtype=np.float32), self.dim)
+        if self.scales is None:
+            return queries @ self.codes.T
+        scores = np.empty((queries.shape[0], self.codes.shape[0]), dtype=np.float32)
+        rows = max(64, COMPACT_SEARCH_BLOCK_BYTES // (4 * self.dim))
+        for start in range(0, self.codes.shape[0], rows):
+            block = np.asarray(self.codes[start:start + rows], dtype=np.float32)
+            scores[:, start:start + rows] = (queries @ block.T) * self.scales[start:start + rows]
+        return scores
+
+    def search(self, queries: np.ndarray, top_k: int) -> List[SearchResult]:
+        results = []
+        for query, row in zip(queries, self.approximate_scores(queries)):
+            if self.rescore <= 0:
+                ids = top_k_indices(row, top_k)
+                results.append((ids, row[ids]))
+                continue
+            candidates = np.sort(top_k_indices(row, max(self.rescore, top_k)))  # lectura secuencial del mmap
+            exact = np.asarray(self.matrix[candidates], dtype=np.float32) @ query
+            best = top_k_indices(exact, top_k)
+            results.append((candidates[best], exact[best]))
+        return results
+
+    def save(self, directory: Path):
+        """Guarda códigos y escalas junto a la KB (escritura atómica)."""
+        directory = Path(directory)
+        codes_tmp = directory / f"{self.CODES}.tmp-{os.getpid()}.npy"
+        np.save(codes_tmp, self.codes)
+        os.replace(codes_tmp, directory / self.CODES)
+        tmp = directory / f"{self.FILENAME}.tmp-{os.getpid()}.npz"
+        np.savez(tmp, scales=self.scales if self.scales is not None else np.empty(0, dtype=np.float32),
+                 quantization=np.array(self.quantization), shape=np.array(self.matrix.shape, dtype=np.int64))
+        os.replace(tmp, directory / self.FILENAME)
+
+    @classmethod
+    def load(cls, directory: Path, matrix: np.ndarray, dim: int = COMPACT_DIM,
+             quantization: str = COMPACT_QUANTIZATION, rescore: int = COMPACT_RESCORE) -> Optional["CompactIndex"]:
+        """Abre los códigos guardados (mmap); None si no existen o son de otra matriz o configuración."""
+        directory = Path(directory)
+        if not (directory / cls.FILENAME).exists() or not (directory / cls.CODES).exists():
+            return None
+        with np.load(directory / cls.FILENAME) as data:
+            if tuple(data["shape"]) != matrix.shape or str(data["quantization"]) != quantization:
+                return None
+            scales = data["scales"] if quantization == "int8" else None
+        codes = np.load(directory / cls.CODES, mmap_mode="r")
+        if codes.shape != (matrix.shape[0], min(dim or matrix.shape[1], matrix.shape[1])):
+            return None
+        return cls(matrix, codes, scales, rescore=rescore)
+
+    def stats(self) -> dict:
+        nbytes = self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        return {
+            "kind": self.kind,
+            "count": int(self.codes.shape[0]),
+            "dim": self.dim,
+            "quantization": self.quantization,
+            "rescore": self.rescore,
+            "bytes": int(nbytes),
+        }
+
+
+def _truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """Primeras `dim` componentes de cada fila, renormalizadas (L2)."""
+    if dim >= vectors.shape[-1]:
+        return vectors
+    vectors = vectors[..., :dim]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, block: int = 16384) -> np.ndarray:
+    """Lista más cercana de cada fila, por bloques para acotar la memoria."""
+    assign = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], block):
+        assign[start:start + block] = np.argmax(matrix[start:start + block] @ centroids.T, axis=1)
+    return assign
+
+
+def build_index(matrix: np.ndarray, kind: str = INDEX_KIND, directory: Optional[Path] = None):
+    """
+    Índice para la matriz según `kind`. Las KBs pequeñas usan FlatIndex, salvo
+    con "compact", que busca ahorrar memoria y no latencia.
+    Con `directory`, reutiliza el índice guardado ahí; si no está, se construye
+    solo en memoria: `directory` es una versión publicada de la KB y no se
+    modifica (el índice se guarda con la próxima versión, ver KnowledgeBase._save).
+    Un `kind` desconocido es ValueError con cualquier tamaño de KB.
+    """
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Tipo de índice desconocido: {kind} (usa {', '.join(INDEX_KINDS)})")
+    if kind == "compact" and matrix.size:
+        index_class = CompactIndex
+    elif kind == "flat" or matrix.shape[0] < max(INDEX_MIN_CHUNKS, 1):
+        return FlatIndex(matrix)
+    else:
+        index_class = IVFIndex
+
+    if directory is not None:
+        index = index_class.load(directory, matrix)
+        if index is not None:
+            return index
+    start = time.perf_counter()
+    index = index_class.build(matrix)
+    if index.kind == "ivf":
+        print(f"[INDEX] IVF de {matrix.shape[0]} vectores, {index.nlist} listas ({time.perf_counter() - start:.1f}s)")
+    else:
+        print(f"[INDEX] Compacto de {matrix.shape[0]} vectores, {index.dim} dims {index.quantization} "
+              f"({time.perf_counter() - start:.1f}s)")
+    return index